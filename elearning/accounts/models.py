@@ -1,6 +1,10 @@
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from elearning.caching import bump_versions
 
 
 class CustomUser(AbstractUser):
@@ -28,3 +32,17 @@ class StatusUpdate(models.Model):
 
     def __str__(self):
         return f"Status by {self.user.username} at {self.created_at}"
+
+# Bump the version counters of the user's cached pages, see
+# elearning/caching.py
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def bump_user_version(sender, instance, update_fields=None, **kwargs):
+    # Logging in only updates last_login, which no page shows
+    if update_fields != frozenset(['last_login']):
+        bump_versions('user', [instance.id])
+
+@receiver(post_save, sender=StatusUpdate)
+@receiver(post_delete, sender=StatusUpdate)
+def bump_status_user_version(sender, instance, **kwargs):
+    bump_versions('user', [instance.user_id])
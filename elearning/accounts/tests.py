@@ -1,13 +1,16 @@
 from accounts.models import StatusUpdate
 from courses.models import Course
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
 from django.urls import reverse
 
+from elearning.testing import TestCase
+
 User = get_user_model()
 
 class AccountsTests(TestCase):
     def setUp(self):
+        cache.clear()
         # Create a teacher and a student.
         self.teacher = User.objects.create_user(
             username="teacher1",
@@ -134,3 +137,98 @@ class AccountsTests(TestCase):
         response = self.client.get(reverse("accounts:home"))
         teacher_profile_url = reverse("accounts:public_profile", args=[self.teacher.username])
         self.assertContains(response, teacher_profile_url)
+
+
+class AccountViewQueryTests(TestCase):
+    # Query budgets for every view in accounts/views.py
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username="teacher1", password="pass123", role="teacher")
+        self.student = User.objects.create_user(username="student1", password="pass123", role="student")
+        for i in range(3):
+            course = Course.objects.create(title=f"Course {i}", description="Test", teacher=self.teacher)
+            course.enrolled_students.add(self.student)
+            StatusUpdate.objects.create(user=self.student, content=f"Status {i}")
+
+    def assertQueries(self, num, user, method, url, data=None):
+        if user is not None:
+            self.client.force_login(user)
+            # Warm the cached unread count used by every page
+            self.client.get(reverse('accounts:login'))
+        with self.assertNumQueries(num):
+            return getattr(self.client, method)(url, data or {})
+
+    def test_register(self):
+        self.assertQueries(0, None, 'get', reverse('accounts:register'))
+        # Username checks and the insert, then logging in, which creates the
+        # session and updates last_login inside savepoints
+        response = self.assertQueries(11, None, 'post', reverse('accounts:register'), {
+            'username': 'newstudent',
+            'real_name': 'New Student',
+            'email': 'newstudent@example.com',
+            'role': 'student',
+            'password1': 'complexpassword123',
+            'password2': 'complexpassword123',
+        })
+        self.assertRedirects(response, reverse('accounts:home'))
+
+    def test_login_and_logout(self):
+        self.assertQueries(0, None, 'get', reverse('accounts:login'))
+        self.assertQueries(9, None, 'post', reverse('accounts:login'), {'username': 'student1', 'password': 'pass123'})
+        self.assertQueries(4, None, 'get', reverse('accounts:logout'))
+
+    def test_home(self):
+        self.assertQueries(3, self.student, 'get', reverse('accounts:home'))
+        StatusUpdate.objects.bulk_create([StatusUpdate(user=self.student, content="More") for i in range(20)])
+        self.assertQueries(3, self.student, 'get', reverse('accounts:home'))
+        self.assertQueries(3, self.student, 'post', reverse('accounts:home'), {'content': 'Hello'})
+
+    def test_search_users(self):
+        self.assertQueries(2, self.student, 'get', reverse('accounts:search_users'))
+        self.assertQueries(3, self.teacher, 'get', reverse('accounts:search_users'), {'q': 'student'})
+
+    def test_public_profile(self):
+        # The profile user's id for the response cache key, then the
+        # profile user, their courses and their status updates. Cached
+        # pages only need the id.
+        for user, username in [(self.student, 'teacher1'), (self.teacher, 'student1')]:
+            url = reverse('accounts:public_profile', args=[username])
+            self.assertQueries(6, user, 'get', url)
+            self.assertQueries(3, user, 'get', url)
+
+
+class ProfileCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.student = User.objects.create_user(username="student1", password="pass123", role="student")
+        self.teacher = User.objects.create_user(username="teacher1", password="pass123", role="teacher")
+        self.course = Course.objects.create(title="Biology", description="Test", teacher=self.teacher)
+        self.client.login(username="student1", password="pass123")
+        self.url = reverse('accounts:public_profile', args=['teacher1'])
+
+    def get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_profile_is_cached_until_it_changes(self):
+        self.assertEqual(self.get()['X-Cache'], 'miss')
+        self.assertEqual(self.get()['X-Cache'], 'hit')
+        StatusUpdate.objects.create(user=self.teacher, content="Office hours moved")
+        response = self.get()
+        self.assertEqual(response['X-Cache'], 'miss')
+        self.assertContains(response, "Office hours moved")
+        self.course.title = "Marine Biology"
+        self.course.save()
+        self.assertContains(self.get(), "Marine Biology")
+        self.teacher.real_name = "Dr Teach"
+        self.teacher.save()
+        self.assertContains(self.get(), "Dr Teach")
+        # Other users' changes leave it cached
+        other = User.objects.create_user(username="student2", password="pass123", role="student")
+        StatusUpdate.objects.create(user=other, content="Hello")
+        self.assertEqual(self.get()['X-Cache'], 'hit')
+
+    def test_unknown_profiles_are_not_cached(self):
+        self.assertEqual(self.client.get(reverse('accounts:public_profile', args=['nobody'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('accounts:public_profile', args=['nobody'])).status_code, 404)
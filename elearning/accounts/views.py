@@ -4,6 +4,8 @@ from django.contrib.auth.decorators import login_required
 from django.db.models import Q
 from django.shortcuts import get_object_or_404, redirect, render
 
+from elearning.caching import cache_response
+
 from .forms import CustomUserCreationForm, StatusUpdateForm
 from .models import CustomUser, StatusUpdate
 
@@ -70,8 +72,15 @@ def search_users(request):
         )
     return render(request, 'accounts/search_users.html', {'results': results, 'query': query})
 
+def profile_versions(request, username):
+    # The profile depends on its user's version, so look up the id first;
+    # unknown usernames are not cached
+    user_id = CustomUser.objects.filter(username=username).values_list('id', flat=True).first()
+    return None if user_id is None else [('user', user_id)]
+
 # Public profile view
 @login_required
+@cache_response(profile_versions)
 def public_profile(request, username):
     User = get_user_model()
     profile_user = get_object_or_404(User, username=username)
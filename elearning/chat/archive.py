@@ -0,0 +1,137 @@
+import json
+import os
+import shutil
+import threading
+import zlib
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+# Cold storage for old chat messages. Each course gets a directory under
+# CHAT_ARCHIVE_ROOT holding append-only segment files of zlib-compressed
+# blocks, plus index.jsonl with one line per block:
+#   {"segment", "offset", "length", "count", "first": [ts, id], "last": [ts, id]}
+# Blocks are written oldest first, so the index is ordered by
+# (timestamp, id) and a page of history only decompresses the blocks it
+# actually needs.
+
+INDEX_NAME = "index.jsonl"
+
+
+def course_dir(course_id):
+    return os.path.join(settings.CHAT_ARCHIVE_ROOT, str(course_id))
+
+
+class ArchiveIndex:
+    # Parsed index files, reloaded when the file on disk changes
+
+    def __init__(self):
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get(self, course_id):
+        path = os.path.join(course_dir(course_id), INDEX_NAME)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        with self._lock:
+            cached = self._cache.get(course_id)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+        with open(path) as f:
+            blocks = [json.loads(line) for line in f if line.strip()]
+        for block in blocks:
+            block["first"] = (parse_datetime(block["first"][0]), block["first"][1])
+            block["last"] = (parse_datetime(block["last"][0]), block["last"][1])
+        with self._lock:
+            self._cache[course_id] = (mtime, blocks)
+        return blocks
+
+    def forget(self, course_id):
+        with self._lock:
+            self._cache.pop(course_id, None)
+
+
+archive_index = ArchiveIndex()
+
+
+def last_archived(course_id):
+    # Return the (timestamp, id) of the newest archived message, or None
+    blocks = archive_index.get(course_id)
+    return blocks[-1]["last"] if blocks else None
+
+
+def append_block(course_id, rows):
+    # Compress rows (oldest first) into a block at the end of the current
+    # segment, rolling over to a new segment when it grows too large
+    directory = course_dir(course_id)
+    os.makedirs(directory, exist_ok=True)
+    blocks = archive_index.get(course_id)
+    segment = blocks[-1]["segment"] if blocks else "segment-000001.z"
+    segment_path = os.path.join(directory, segment)
+    if os.path.exists(segment_path) and os.path.getsize(segment_path) >= settings.CHAT_ARCHIVE_SEGMENT_BYTES:
+        segment = "segment-%06d.z" % (int(segment[8:14]) + 1)
+        segment_path = os.path.join(directory, segment)
+
+    payload = zlib.compress("\n".join(
+        json.dumps({
+            "id": row["id"],
+            "username": row["username"],
+            "message": row["message"],
+            "timestamp": row["timestamp"].isoformat(),
+        })
+        for row in rows
+    ).encode())
+    with open(segment_path, "ab") as f:
+        offset = f.tell()
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+
+    # The index line is only written once the block is safely on disk
+    entry = {
+        "segment": segment,
+        "offset": offset,
+        "length": len(payload),
+        "count": len(rows),
+        "first": [rows[0]["timestamp"].isoformat(), rows[0]["id"]],
+        "last": [rows[-1]["timestamp"].isoformat(), rows[-1]["id"]],
+    }
+    with open(os.path.join(directory, INDEX_NAME), "a") as f:
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    archive_index.forget(course_id)
+
+
+def read_block(course_id, block):
+    with open(os.path.join(course_dir(course_id), block["segment"]), "rb") as f:
+        f.seek(block["offset"])
+        data = zlib.decompress(f.read(block["length"]))
+    rows = [json.loads(line) for line in data.decode().split("\n")]
+    for row in rows:
+        row["timestamp"] = parse_datetime(row["timestamp"])
+    return rows
+
+
+def get_archived_page(course_id, before, limit):
+    # Return up to `limit` archived messages older than the (timestamp, id)
+    # cursor (or the newest ones when it is None), oldest first
+    rows = []
+    for block in reversed(archive_index.get(course_id)):
+        if len(rows) >= limit:
+            break
+        if before is not None and block["first"] >= before:
+            continue
+        older = [
+            row for row in read_block(course_id, block)
+            if before is None or (row["timestamp"], row["id"]) < before
+        ]
+        rows = older + rows
+    return rows[-limit:] if len(rows) > limit else rows
+
+
+def delete_course_archive(course_id):
+    shutil.rmtree(course_dir(course_id), ignore_errors=True)
+    archive_index.forget(course_id)
@@ -0,0 +1,89 @@
+import asyncio
+import json
+import time
+
+from channels.testing import WebsocketCommunicator
+
+# Helpers behind the bench_channel_layer and chat_loadtest commands.
+
+
+def percentile(values, p):
+    # Nearest-rank percentile of an already sorted list
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+async def measure_fanout(layer, clients, messages):
+    # Time each group_send until every member of the group has received it
+    channels = [await layer.new_channel() for _ in range(clients)]
+    for channel in channels:
+        await layer.group_add("bench", channel)
+    latencies = []
+    try:
+        for i in range(messages):
+            start = time.perf_counter()
+            await layer.group_send("bench", {"type": "bench.message", "n": i})
+            await asyncio.gather(*(layer.receive(channel) for channel in channels))
+            latencies.append(time.perf_counter() - start)
+    finally:
+        for channel in channels:
+            await layer.group_discard("bench", channel)
+        await layer.flush()
+    return sorted(latencies)
+
+
+async def open_client(application, course_id, user, coalesce):
+    # Connect a simulated chat client and consume its join frame
+    communicator = WebsocketCommunicator(
+        application,
+        f"/ws/course_chat/{course_id}/",
+        subprotocols=["chat.v2"] if coalesce else None,
+    )
+    communicator.scope["user"] = user
+    connected, _ = await communicator.connect(timeout=10)
+    if not connected:
+        raise RuntimeError(f"{user.username} could not join course {course_id}")
+    await communicator.receive_from(timeout=10)
+    return communicator
+
+
+async def listen(communicator, sent_at, latencies, expected, timeout):
+    # Record the broadcast latency of every chat message this client receives
+    received = 0
+    while received < expected:
+        try:
+            frame = json.loads(await communicator.receive_from(timeout=timeout))
+        except asyncio.TimeoutError:
+            break
+        now = time.perf_counter()
+        for message in frame if isinstance(frame, list) else [frame]:
+            latencies.append(now - sent_at[message["message"]])
+            received += 1
+    return received
+
+
+async def run_room(application, course_id, users, rate, duration, coalesce, timeout):
+    # Open every client in a room, send at `rate` messages per second round
+    # robin across the clients, and wait for the broadcasts to arrive
+    clients = [await open_client(application, course_id, user, coalesce) for user in users]
+    total = max(1, int(rate * duration))
+    sent_at = {}
+    latencies = []
+    listeners = [
+        asyncio.create_task(listen(client, sent_at, latencies, total, timeout))
+        for client in clients
+    ]
+    interval = 1 / rate
+    start = time.perf_counter()
+    for n in range(total):
+        # Keep to the schedule rather than sleeping a fixed interval
+        delay = start + n * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        text = f"room {course_id} message {n}"
+        sent_at[text] = time.perf_counter()
+        await clients[n % len(clients)].send_to(text_data=json.dumps({"message": text}))
+    delivered = sum(await asyncio.gather(*listeners))
+    for client in clients:
+        await client.disconnect()
+    return total, delivered, latencies
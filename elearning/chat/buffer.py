@@ -0,0 +1,158 @@
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from courses.stats import add_counts
+from django.conf import settings
+from django.db import DataError, IntegrityError, transaction
+from django.utils import timezone
+
+from elearning.caching import bump_versions
+
+from .ids import next_message_id
+from .models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+
+class MessageBuffer:
+    # Write-behind buffer that persists chat messages in batches.
+    # Messages are broadcast before they are written; the buffer is flushed
+    # with a single bulk_create once it reaches CHAT_BUFFER_MAX_SIZE messages
+    # or CHAT_BUFFER_FLUSH_INTERVAL seconds after the first pending message.
+    # A batch that fails to write goes back to the front of the queue and is
+    # retried with a growing delay; once CHAT_BUFFER_MAX_RETRIES attempts
+    # have failed the messages are inserted one at a time.
+
+    def __init__(self):
+        self._pending = []
+        self._lock = threading.Lock()
+        self._timer = None
+        self._timer_loop = None
+        self._failures = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, course_id, sender_id, message):
+        # Queue a message and schedule a flush when a threshold is hit.
+        # The unsaved message is returned with its final id already set.
+        chat_message = ChatMessage(
+            id=next_message_id(),
+            course_id=course_id,
+            sender_id=sender_id,
+            message=message,
+            timestamp=timezone.now(),
+        )
+        with self._lock:
+            self._pending.append(chat_message)
+            size = len(self._pending)
+
+        loop = asyncio.get_running_loop()
+        if size >= settings.CHAT_BUFFER_MAX_SIZE and not self._failures:
+            loop.create_task(self.flush())
+        elif self._timer is None or self._timer_loop is not loop:
+            self._timer = loop.call_later(settings.CHAT_BUFFER_FLUSH_INTERVAL, self._on_timer)
+            self._timer_loop = loop
+        return chat_message
+
+    def _on_timer(self):
+        self._timer = None
+        asyncio.get_running_loop().create_task(self.flush())
+
+    def _take(self):
+        # Swap out the pending batch so new messages go into a fresh list
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    async def flush(self):
+        batch = self._take()
+        if batch:
+            unsaved = await sync_to_async(self._write)(batch)
+            if unsaved:
+                self._retry(unsaved)
+
+    def flush_sync(self):
+        # Used at process shutdown when no event loop is running, so the
+        # retries wait here instead of being scheduled
+        batch = self._take()
+        for attempt in range(settings.CHAT_BUFFER_MAX_RETRIES + 1):
+            if not batch:
+                return
+            if attempt:
+                time.sleep(self._retry_delay())
+            batch = self._write(batch)
+        if batch:
+            logger.error("Lost %d chat messages that could not be persisted before exit", len(batch))
+
+    def _retry_delay(self):
+        return settings.CHAT_BUFFER_RETRY_DELAY * 2 ** min(self._failures - 1, 5)
+
+    def _retry(self, batch):
+        # Put unsaved messages back ahead of newer ones and flush them again
+        # after the backoff delay
+        with self._lock:
+            self._pending[:0] = batch
+        if self._timer is not None:
+            self._timer.cancel()
+        loop = asyncio.get_running_loop()
+        self._timer = loop.call_later(self._retry_delay(), self._on_timer)
+        self._timer_loop = loop
+
+    def _write(self, batch):
+        # Store a batch and return the messages that should be tried again
+        try:
+            ChatMessage.objects.bulk_create(batch, batch_size=settings.CHAT_BUFFER_MAX_SIZE)
+        except Exception:
+            self._failures += 1
+            if self._failures <= settings.CHAT_BUFFER_MAX_RETRIES:
+                logger.warning(
+                    "Failed to persist %d chat messages (attempt %d), retrying",
+                    len(batch), self._failures, exc_info=True,
+                )
+                return batch
+            stored, unsaved = self._write_rows(batch)
+        else:
+            stored, unsaved = batch, []
+        if not unsaved:
+            self._failures = 0
+        # bulk_create sends no post_save, so bump the cached rooms and
+        # count the messages here
+        per_course = Counter(message.course_id for message in stored)
+        bump_versions('course', per_course)
+        for course_id, count in per_course.items():
+            add_counts(course_id, chat_messages=count)
+        return unsaved
+
+    def _write_rows(self, batch):
+        # Insert the messages one at a time so a bad row cannot take the
+        # rest of the batch with it. Rows the database rejects (course or
+        # sender deleted, id already taken) are logged and dropped; the
+        # others are returned to be retried.
+        stored, unsaved = [], []
+        for message in batch:
+            try:
+                with transaction.atomic():
+                    ChatMessage.objects.bulk_create([message])
+            except (IntegrityError, DataError):
+                logger.exception("Dropping chat message %d that cannot be stored", message.id)
+            except Exception:
+                unsaved.append(message)
+            else:
+                stored.append(message)
+        if unsaved:
+            logger.warning("Failed to persist %d chat messages, retrying", len(unsaved))
+        return stored, unsaved
+
+
+# One buffer per process, drained when the interpreter exits
+message_buffer = MessageBuffer()
+atexit.register(message_buffer.flush_sync)
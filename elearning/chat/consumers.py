@@ -1,11 +1,26 @@
+import asyncio
 import json
+from urllib.parse import parse_qs
 
 from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from courses.membership import is_enrolled
 from courses.models import Course
-from django.contrib.auth import get_user_model
+from django.conf import settings
 
-from .models import ChatMessage
+from .buffer import message_buffer
+from .history import (
+    decode_cursor,
+    encode_cursor,
+    get_history_page,
+    get_messages_since,
+    recent_messages,
+    serialize_message,
+)
+from .outbound import SLOW_CONSUMER_CLOSE_CODE, OutboundQueue
+
+# Subprotocol a client offers to receive coalesced array frames
+PROTOCOL_V2 = "chat.v2"
 
 
 class CourseChatConsumer(AsyncWebsocketConsumer):
@@ -15,13 +30,53 @@ class CourseChatConsumer(AsyncWebsocketConsumer):
         # Create a unique room group name using the course ID
         self.room_group_name = f"course_chat_{self.course_id}"
 
+        # Resolve the user and their membership once for the whole connection
+        user = self.scope.get("user")
+        self.course = await self.get_course_for_member(user)
+        if self.course is None:
+            # Reject users who are not the teacher or an enrolled student
+            await self.close()
+            return
+        self.user_id = user.pk
+        self.username = user.username
+
         # Add the channel to the group
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
+        # Broadcasts now reach this process, so it can buffer the room
+        recent_messages.join(self.course_id)
+        self.in_room = True
+        # Clients that ask for the v2 protocol get broadcasts coalesced
+        # into array frames
+        self.coalesce = PROTOCOL_V2 in self.scope.get("subprotocols", [])
+        self.pending_frames = []
+        self.flush_task = None
+
         # Accept the WebSocket connection
-        await self.accept()
+        await self.accept(subprotocol=PROTOCOL_V2 if self.coalesce else None)
+
+        # Broadcasts go through a bounded queue so a slow reader only
+        # hurts itself
+        self.outbound = OutboundQueue(
+            self.send, settings.CHAT_SEND_QUEUE_SIZE, settings.CHAT_SLOW_CONSUMER_POLICY
+        )
+        self.outbound.start()
+
+        # A reconnecting client only needs the messages it missed
+        last_id = self.get_last_seen_id()
+        if last_id is not None:
+            await self.send_missed_messages(last_id)
+            return
+        # Send the newest page of history, from memory once the room is warm
+        messages, has_older = await sync_to_async(recent_messages.get)(self.course_id)
+        await self.send(text_data=json.dumps({
+            "type": "recent",
+            "messages": [serialize_message(m) for m in messages],
+            "has_more": has_older,
+            "cursor": encode_cursor(messages[0]) if messages else None,
+        }))
 
     async def disconnect(self, close_code):
         # Remove the channel from the group
@@ -29,48 +84,115 @@ class CourseChatConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             self.channel_name
         )
+        if getattr(self, "in_room", False):
+            recent_messages.leave(self.course_id)
+        # Drop any queued frames that can no longer be delivered
+        if getattr(self, "flush_task", None) is not None:
+            self.flush_task.cancel()
+        if getattr(self, "outbound", None) is not None:
+            self.outbound.stop()
+        # Make sure nothing this connection sent is left unwritten
+        await message_buffer.flush()
 
     async def receive(self, text_data):
         # Parse the JSON data
         data = json.loads(text_data)
+        if data.get("type") == "load_older":
+            await self.send_older_history(data.get("before"))
+            return
         message = data.get("message", "")
-        user = self.scope.get("user")
-        # Get the username
-        username = user.username if user and user.is_authenticated else "Anonymous"
 
-        # Save the message to the database
-        await self.save_message(user, message)
+        # Queue the message to be written to the database in the next batch
+        chat_message = message_buffer.add(self.course_id, self.user_id, message)
 
-        # Broadcast the message
+        payload = {
+            "id": chat_message.id,
+            "message": message,
+            "username": self.username,
+            "timestamp": chat_message.timestamp.isoformat(),
+        }
+        # Broadcast the message, serialized once for every recipient
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 "type": "chat_message",
-                "message": message,
-                "username": username,
+                **payload,
+                "frame": json.dumps(payload),
             }
         )
 
     async def chat_message(self, event):
-        # Retrieve the message and username from the
-        message = event["message"]
-        username = event["username"]
-        # Send the message to the WebSocket
+        # Keep this process's copy of the room's recent history up to date
+        recent_messages.append(self.course_id, event)
+        if not self.coalesce:
+            # Send the message to the WebSocket
+            await self.queue_frame(event["frame"])
+            return
+        # Hold the frame until the end of the current tick
+        self.pending_frames.append(event["frame"])
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_frames())
+
+    async def flush_frames(self):
+        # Send every frame received during the tick as one JSON array
+        await asyncio.sleep(settings.CHAT_COALESCE_TICK)
+        frames, self.pending_frames = self.pending_frames, []
+        self.flush_task = None
+        await self.queue_frame("[" + ",".join(frames) + "]")
+
+    async def queue_frame(self, frame):
+        # Hand a frame to the writer, closing the connection if the client
+        # has fallen too far behind and the policy says so
+        if not self.outbound.put(frame):
+            await self.close(code=SLOW_CONSUMER_CLOSE_CODE)
+
+    def get_last_seen_id(self):
+        # Read the last message id the client saw from ?last_id=
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        try:
+            return int(query["last_id"][0])
+        except (KeyError, ValueError):
+            return None
+
+    async def send_missed_messages(self, last_id):
+        # Send what the client missed while disconnected, or tell it to
+        # reload the page when it is too far behind
+        messages = recent_messages.since(self.course_id, last_id)
+        if messages is None:
+            # Write out anything still buffered before reading the table
+            await message_buffer.flush()
+            messages = await sync_to_async(get_messages_since)(
+                self.course_id, last_id, settings.CHAT_RESYNC_MAX_MESSAGES + 1
+            )
+        reload = len(messages) > settings.CHAT_RESYNC_MAX_MESSAGES
         await self.send(text_data=json.dumps({
-            "message": message,
-            "username": username,
+            "type": "resync",
+            "messages": [] if reload else [serialize_message(m) for m in messages],
+            "reload": reload,
         }))
 
-    @sync_to_async
-    def save_message(self, user, message):
-        from chat.models import ChatMessage
-        from courses.models import Course
-        course = Course.objects.get(id=self.course_id)
-        # If the user is not authenticated, do not save the message
-        if not user.is_authenticated:
+    async def send_older_history(self, before):
+        # Send the page of history that precedes the client's oldest message
+        cursor = decode_cursor(before)
+        if cursor is None:
             return
-        # Get the concrete user instance
-        User = get_user_model()
-        actual_user = User.objects.get(pk=user.pk)
-        # Create and save the chat message
-        ChatMessage.objects.create(course=course, sender=actual_user, message=message)
+        messages, has_more = await sync_to_async(get_history_page)(self.course_id, cursor)
+        await self.send(text_data=json.dumps({
+            "type": "history",
+            "messages": [serialize_message(m) for m in messages],
+            "has_more": has_more,
+            "cursor": encode_cursor(messages[0]) if messages else None,
+        }))
+
+    @sync_to_async
+    def get_course_for_member(self, user):
+        # Anonymous users can never join a course chat
+        if user is None or not user.is_authenticated:
+            return None
+        course = Course.objects.filter(id=self.course_id).only("id", "title", "teacher_id").first()
+        if course is None:
+            return None
+        # Only the teacher and enrolled students may join
+        if course.teacher_id == user.pk or is_enrolled(user, course.id):
+            return course
+        return None
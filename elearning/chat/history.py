@@ -0,0 +1,180 @@
+import threading
+from collections import Counter, OrderedDict, deque
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+
+from .archive import get_archived_page
+from .models import ChatMessage
+
+# Chat history is paged newest-first with a (timestamp, id) keyset cursor so
+# each page is a single range scan on the (course, timestamp) index, no
+# matter how far back the reader has scrolled.
+
+
+def encode_cursor(message):
+    # Build an opaque cursor pointing at a history row
+    return f"{message['timestamp'].isoformat()}|{message['id']}"
+
+
+def decode_cursor(cursor):
+    # Return (timestamp, id) for a cursor, or None if it is malformed
+    try:
+        timestamp, message_id = cursor.rsplit("|", 1)
+        timestamp = parse_datetime(timestamp)
+        message_id = int(message_id)
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if timestamp is None:
+        return None
+    return timestamp, message_id
+
+
+def serialize_message(message):
+    # Turn a history row into the JSON payload sent to clients
+    return {
+        "id": message["id"],
+        "username": message["username"],
+        "message": message["message"],
+        "timestamp": message["timestamp"].isoformat(),
+    }
+
+
+def get_history_page(course_id, before=None, limit=None):
+    # Return one page of messages older than the cursor, oldest first,
+    # along with whether there are even older messages to load
+    limit = limit or settings.CHAT_HISTORY_PAGE_SIZE
+    messages = ChatMessage.objects.filter(course_id=course_id)
+    if before is not None:
+        timestamp, message_id = before
+        messages = messages.filter(
+            Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id)
+        )
+    rows = list(
+        messages.order_by("-timestamp", "-id")
+        .values("id", "message", "timestamp", username=F("sender__username"))[:limit + 1]
+    )
+    if len(rows) <= limit:
+        # The hot table ran out, so carry on into the cold archive
+        cursor = (rows[-1]["timestamp"], rows[-1]["id"]) if rows else before
+        rows.extend(reversed(get_archived_page(course_id, cursor, limit + 1 - len(rows))))
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    return rows, has_more
+
+
+def get_messages_since(course_id, last_id, limit):
+    # Return up to `limit` messages newer than the client's last-seen id
+    return list(
+        ChatMessage.objects.filter(course_id=course_id, id__gt=last_id)
+        .order_by("id")
+        .values("id", "message", "timestamp", username=F("sender__username"))[:limit]
+    )
+
+
+class RecentMessages:
+    # Per-process ring buffer of the newest history page of each room.
+    # Broadcasts only reach this process through its own consumers, so a
+    # room is buffered only while one of them is in it: it is filled from
+    # the database on first use, kept up to date from broadcasts and
+    # dropped when the last local consumer leaves. Rooms without a local
+    # consumer are always read from the database.
+
+    def __init__(self):
+        self._rooms = OrderedDict()
+        self._consumers = Counter()
+        self._lock = threading.Lock()
+
+    def join(self, course_id):
+        # Called by a consumer once it receives the room's broadcasts
+        with self._lock:
+            self._consumers[course_id] += 1
+
+    def leave(self, course_id):
+        with self._lock:
+            self._consumers[course_id] -= 1
+            if self._consumers[course_id] <= 0:
+                del self._consumers[course_id]
+                self._rooms.pop(course_id, None)
+
+    def get(self, course_id):
+        # Return (rows, has_older) for a room, loading it on a cold start
+        with self._lock:
+            room = self._room(course_id)
+            if room is not None and room["warm"]:
+                return list(room["messages"]), room["has_older"]
+        rows, has_older = get_history_page(course_id)
+        with self._lock:
+            room = self._room(course_id, create=True)
+            if room is None:
+                return rows, has_older
+            # Keep anything broadcast while the page was being loaded
+            seen = {m["id"] for m in rows}
+            merged = rows + [m for m in room["messages"] if m["id"] not in seen]
+            merged.sort(key=lambda m: (m["timestamp"], m["id"]))
+            room["messages"].clear()
+            room["messages"].extend(merged)
+            room["ids"] = {m["id"] for m in room["messages"]}
+            room["has_older"] = has_older or len(merged) > room["messages"].maxlen
+            room["warm"] = True
+            return list(room["messages"]), room["has_older"]
+
+    def append(self, course_id, message):
+        # Record a serialized broadcast message once, however many local
+        # clients receive it. Broadcasts from different processes can arrive
+        # out of id order, so the copies are spotted by id, not by position.
+        with self._lock:
+            room = self._room(course_id, create=True)
+            if room is None or message["id"] in room["ids"]:
+                return
+            if len(room["messages"]) == room["messages"].maxlen:
+                room["has_older"] = True
+                room["ids"].discard(room["messages"][0]["id"])
+            room["ids"].add(message["id"])
+            room["messages"].append({
+                "id": message["id"],
+                "username": message["username"],
+                "message": message["message"],
+                "timestamp": parse_datetime(message["timestamp"]),
+            })
+
+    def since(self, course_id, last_id):
+        # Return the messages newer than last_id if this room's buffer
+        # reaches back that far, otherwise None
+        with self._lock:
+            room = self._room(course_id)
+            if room is None or not room["warm"]:
+                return None
+            messages = list(room["messages"])
+            covered = not room["has_older"] or (messages and messages[0]["id"] <= last_id)
+        if not covered:
+            return None
+        return [m for m in messages if m["id"] > last_id]
+
+    def clear(self):
+        with self._lock:
+            self._rooms.clear()
+
+    def _room(self, course_id, create=False):
+        # Look up a room, marking it as recently used. Only rooms with a
+        # local consumer are created, and the least recently used ones
+        # beyond CHAT_RECENT_MAX_ROOMS are dropped to be reloaded later.
+        room = self._rooms.get(course_id)
+        if room is None and create and self._consumers[course_id] > 0:
+            room = {
+                "messages": deque(maxlen=settings.CHAT_HISTORY_PAGE_SIZE),
+                "ids": set(),
+                "has_older": False,
+                "warm": False,
+            }
+            self._rooms[course_id] = room
+        if room is not None:
+            self._rooms.move_to_end(course_id)
+            while len(self._rooms) > settings.CHAT_RECENT_MAX_ROOMS:
+                self._rooms.popitem(last=False)
+        return room
+
+
+recent_messages = RecentMessages()
@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# Chat message ids are generated in-process instead of by the database so a
+# message can be broadcast with its final id before the write-behind buffer
+# has stored it. Ids are 53-bit integers laid out as
+#   milliseconds since EPOCH_MS (41 bits) | node id (6 bits) | sequence (6 bits)
+# which keeps them unique across processes, ordered by send time and small
+# enough to survive a round trip through a JavaScript number. Two processes
+# sharing a node id would hand out the same ids, so the node id is never
+# guessed: it is CHAT_NODE_ID when set, 0 with the in-process layer (one
+# process), and otherwise leased from the channel layer's Redis. It is only
+# resolved when the first id is needed, so processes that never send a
+# chat message do not need one.
+
+EPOCH_MS = 1735689600000  # 2025-01-01T00:00:00Z
+NODE_BITS = 6
+SEQUENCE_BITS = 6
+MAX_NODE_ID = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+NODE_LEASE_KEY = "chat:node:{}"
+
+logger = logging.getLogger(__name__)
+
+
+def chat_node_id():
+    node_id = settings.CHAT_NODE_ID
+    if node_id is None:
+        # Only one process can serve chat over the in-process layer
+        if settings.CHANNEL_LAYERS['default']['BACKEND'] == 'chat.layers.LocalChannelLayer':
+            return 0
+        return node_lease.acquire()
+    if not 0 <= node_id <= MAX_NODE_ID:
+        raise ImproperlyConfigured(f"CHAT_NODE_ID must be between 0 and {MAX_NODE_ID}, not {node_id}.")
+    return node_id
+
+
+class NodeLease:
+    # Claims a free node id in Redis with a key that expires after
+    # CHAT_NODE_LEASE_TIMEOUT seconds, renewed from a daemon thread for as
+    # long as the process runs. Deployments without CHAT_NODE_ID rely on it.
+
+    def __init__(self):
+        self.node_id = None
+        self._token = uuid.uuid4().hex
+        self._client = None
+        self._thread = None
+
+    def redis(self):
+        if self._client is None:
+            import redis
+
+            host = settings.CHANNEL_LAYERS['default'].get('CONFIG', {}).get('hosts', [None])[0]
+            if not isinstance(host, str):
+                raise ImproperlyConfigured("Set CHAT_NODE_ID; no Redis URL to lease a chat node id from.")
+            self._client = redis.Redis.from_url(host)
+        return self._client
+
+    def acquire(self):
+        timeout = settings.CHAT_NODE_LEASE_TIMEOUT
+        for node_id in range(MAX_NODE_ID + 1):
+            if self.redis().set(NODE_LEASE_KEY.format(node_id), self._token, nx=True, ex=timeout):
+                self.node_id = node_id
+                break
+        else:
+            raise ImproperlyConfigured(
+                f"All {MAX_NODE_ID + 1} chat node ids are leased; set CHAT_NODE_ID explicitly."
+            )
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._keep_alive, name="chat-node-lease", daemon=True)
+            self._thread.start()
+        return self.node_id
+
+    def renew(self):
+        # Extend the lease, or report that another process has taken the id
+        key = NODE_LEASE_KEY.format(self.node_id)
+        if self.redis().get(key) != self._token.encode():
+            return False
+        self.redis().expire(key, settings.CHAT_NODE_LEASE_TIMEOUT)
+        return True
+
+    def _keep_alive(self):
+        while True:
+            time.sleep(settings.CHAT_NODE_LEASE_TIMEOUT / 3)
+            try:
+                if not self.renew():
+                    logger.error("Lost the lease on chat node id %d, taking a new one", self.node_id)
+                    next_message_id.node_id = self.acquire()
+            except Exception:
+                logger.exception("Could not renew the lease on chat node id %s", self.node_id)
+
+
+class MessageIdGenerator:
+    def __init__(self, node_id=None):
+        self.node_id = node_id
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._sequence = 0
+
+    def __call__(self):
+        with self._lock:
+            if self.node_id is None:
+                self.node_id = chat_node_id()
+            now_ms = int(time.time() * 1000) - EPOCH_MS
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            else:
+                # Same millisecond (or the clock went backwards), so keep
+                # counting and borrow the next millisecond on overflow
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    self._last_ms += 1
+                    self._sequence = 0
+            return (self._last_ms << (NODE_BITS + SEQUENCE_BITS)) | (self.node_id << SEQUENCE_BITS) | self._sequence
+
+
+node_lease = NodeLease()
+next_message_id = MessageIdGenerator()
@@ -0,0 +1,138 @@
+import asyncio
+import random
+import string
+import time
+from copy import deepcopy
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+
+class LocalChannelLayer(BaseChannelLayer):
+    # In-process channel layer for single-node deployments and tests.
+    #
+    # Unlike channels' InMemoryChannelLayer, a group_send copies the message
+    # once and hands the same copy to every member instead of deep-copying
+    # it and spawning a task per recipient, and expired messages and group
+    # memberships are swept at most once per second instead of on every
+    # send and receive. Consumers must treat received messages as read-only.
+
+    extensions = ["groups", "flush"]
+
+    def __init__(self, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.group_expiry = group_expiry
+        self.channels = {}
+        self.groups = {}
+        self._next_sweep = 0
+
+    def _queue(self, channel):
+        queue = self.channels.get(channel)
+        if queue is None:
+            queue = self.channels[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+        return queue
+
+    def _put(self, channel, message, expires):
+        try:
+            self._queue(channel).put_nowait((expires, message))
+        except asyncio.QueueFull:
+            raise ChannelFull(channel)
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        assert "__asgi_channel__" not in message
+        self._sweep()
+        self._put(channel, deepcopy(message), time.time() + self.expiry)
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        self._sweep()
+        queue = self._queue(channel)
+        while True:
+            expires, message = await queue.get()
+            if expires >= time.time():
+                break
+            # The message sat in the queue too long, so the reader is gone
+            self._remove_from_groups(channel)
+        if queue.empty() and self.channels.get(channel) is queue:
+            del self.channels[channel]
+        return message
+
+    async def new_channel(self, prefix="specific."):
+        return "%s.local!%s" % (
+            prefix,
+            "".join(random.choice(string.ascii_letters) for i in range(12)),
+        )
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        self.groups.setdefault(group, {})[channel] = time.time()
+
+    async def group_discard(self, group, channel):
+        assert self.valid_channel_name(channel), "Invalid channel name"
+        assert self.valid_group_name(group), "Invalid group name"
+        members = self.groups.get(group)
+        if members:
+            members.pop(channel, None)
+            if not members:
+                del self.groups[group]
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Invalid group name"
+        self._sweep()
+        members = self.groups.get(group)
+        if not members:
+            return
+        # One copy shared by every member of the group
+        message = deepcopy(message)
+        expires = time.time() + self.expiry
+        for channel in list(members):
+            try:
+                self._put(channel, message, expires)
+            except ChannelFull:
+                pass
+
+    # Flush extension
+
+    async def flush(self):
+        self.channels = {}
+        self.groups = {}
+
+    async def close(self):
+        pass
+
+    # Expiry
+
+    def _sweep(self):
+        # Drop expired messages and group memberships, at most once a second
+        now = time.time()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + 1
+        for channel, queue in list(self.channels.items()):
+            expired = False
+            while not queue.empty() and queue._queue[0][0] < now:
+                queue.get_nowait()
+                expired = True
+            if expired:
+                self._remove_from_groups(channel)
+            if queue.empty() and not queue._getters:
+                del self.channels[channel]
+        cutoff = now - self.group_expiry
+        for group, members in list(self.groups.items()):
+            for channel, joined in list(members.items()):
+                if joined < cutoff:
+                    del members[channel]
+            if not members:
+                del self.groups[group]
+
+    def _remove_from_groups(self, channel):
+        for members in self.groups.values():
+            members.pop(channel, None)
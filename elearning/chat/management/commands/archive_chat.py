@@ -0,0 +1,60 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from django.utils import timezone
+
+from chat.archive import append_block, last_archived
+from chat.models import ChatMessage
+
+
+class Command(BaseCommand):
+    help = "Moves old chat messages out of the database into compressed per-course archive segments."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.CHAT_ARCHIVE_AFTER_DAYS,
+            help="Archive messages older than this many days.",
+        )
+        parser.add_argument('--block-size', type=int, default=500, help="Messages per compressed block.")
+        parser.add_argument('--course', type=int, help="Only archive this course.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        old_messages = ChatMessage.objects.filter(timestamp__lt=cutoff)
+        if options['course']:
+            old_messages = old_messages.filter(course_id=options['course'])
+        course_ids = old_messages.order_by().values_list('course_id', flat=True).distinct()
+
+        total = 0
+        for course_id in list(course_ids):
+            archived = self.archive_course(course_id, cutoff, options['block_size'])
+            total += archived
+            self.stdout.write(f"Course {course_id}: archived {archived} messages")
+        self.stdout.write(self.style.SUCCESS(f"Archived {total} messages older than {cutoff:%Y-%m-%d}"))
+
+    def archive_course(self, course_id, cutoff, block_size):
+        messages = ChatMessage.objects.filter(course_id=course_id)
+
+        # Rows already written by an interrupted run only need deleting
+        upto = last_archived(course_id)
+        if upto is not None:
+            timestamp, message_id = upto
+            messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lte=message_id)).delete()
+
+        archived = 0
+        while True:
+            rows = list(
+                messages.filter(timestamp__lt=cutoff)
+                .order_by('timestamp', 'id')
+                .values('id', 'message', 'timestamp', username=F('sender__username'))[:block_size]
+            )
+            if not rows:
+                return archived
+            # Write the block before deleting so a crash never loses messages
+            append_block(course_id, rows)
+            ChatMessage.objects.filter(id__in=[row['id'] for row in rows]).delete()
+            archived += len(rows)
@@ -0,0 +1,56 @@
+import asyncio
+import os
+
+from channels.layers import InMemoryChannelLayer
+from channels_redis.core import RedisChannelLayer
+from django.core.management.base import BaseCommand
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from chat.benchmarks import measure_fanout, percentile
+from chat.layers import LocalChannelLayer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares group fanout latency of the bundled in-process channel layer with channels' "
+        "InMemoryChannelLayer and, given a Redis URL, with RedisChannelLayer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=300, help="Channels in the group.")
+        parser.add_argument('--messages', type=int, default=200, help="Group sends to time.")
+        parser.add_argument(
+            '--redis-url',
+            default=os.environ.get('REDIS_URL'),
+            help="Also benchmark a Redis layer at this URL (defaults to REDIS_URL).",
+        )
+
+    def handle(self, *args, **options):
+        clients = options['clients']
+        messages = options['messages']
+        # Neither in-process layer pays for the network round trip or the
+        # serialisation Redis needs, so Redis is only measured against a
+        # real server
+        layers = [
+            ("local", lambda: LocalChannelLayer(capacity=messages + 1)),
+            ("inmemory", lambda: InMemoryChannelLayer(capacity=messages + 1)),
+        ]
+        if options['redis_url']:
+            layers.append(("redis", lambda: RedisChannelLayer(
+                hosts=[options['redis_url']], capacity=messages + 1, prefix="bench"
+            )))
+
+        self.stdout.write(f"Fanout to {clients} channels, {messages} group sends")
+        for name, make_layer in layers:
+            try:
+                latencies = asyncio.run(measure_fanout(make_layer(), clients, messages))
+            except (ConnectionError, OSError, RedisConnectionError) as e:
+                self.stdout.write(f"{name:>9}: skipped ({e})")
+                continue
+            self.stdout.write(
+                f"{name:>9}: p50 {percentile(latencies, 50) * 1000:.2f} ms"
+                f"  p95 {percentile(latencies, 95) * 1000:.2f} ms"
+                f"  max {latencies[-1] * 1000:.2f} ms"
+            )
+        if not options['redis_url']:
+            self.stdout.write(f"{'redis':>9}: skipped (set REDIS_URL or pass --redis-url)")
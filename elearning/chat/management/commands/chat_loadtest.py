@@ -0,0 +1,148 @@
+import asyncio
+import time
+
+from courses.models import Course
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+
+from chat.benchmarks import percentile, run_room
+from chat.buffer import message_buffer
+
+# Every seeded user's username starts with this prefix
+SEED_PREFIX = "loadtest_"
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures chat throughput and broadcast latency with simulated WebSocket clients, "
+        "seeded into a temporary test database unless --allow-live-db is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=5, help="Course chat rooms to open.")
+        parser.add_argument('--clients', type=int, default=50, help="Clients connected to each room.")
+        parser.add_argument('--rate', type=float, default=10, help="Messages sent per second in each room.")
+        parser.add_argument('--duration', type=float, default=10, help="Seconds to keep sending for.")
+        parser.add_argument(
+            '--layer',
+            choices=['memory', 'redis', 'settings'],
+            default='memory',
+            help="Channel layer to use: the bundled in-process layer, Redis, or whatever settings configure.",
+        )
+        parser.add_argument('--redis-url', default='redis://127.0.0.1:6379/0', help="Redis URL for --layer redis.")
+        parser.add_argument('--coalesce', action='store_true', help="Connect with the chat.v2 subprotocol.")
+        parser.add_argument('--timeout', type=float, default=10, help="Seconds to wait for a broadcast.")
+        parser.add_argument(
+            '--allow-live-db',
+            action='store_true',
+            help="Seed the configured database instead, deleting any existing users named loadtest_*.",
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help="Keep the seeded users, courses and messages (needs --allow-live-db).",
+        )
+
+    def handle(self, *args, **options):
+        if options['keep'] and not options['allow_live_db']:
+            raise CommandError("--keep needs --allow-live-db; the temporary database is always destroyed.")
+        if options['allow_live_db']:
+            self.load_test(options)
+            return
+        # Build a migrated throwaway database the way the test runner does,
+        # so seeding and cleanup never touch real accounts
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.load_test(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def load_test(self, options):
+        rooms = self.seed(options['rooms'], options['clients'])
+        try:
+            layers = self.channel_layers(options)
+            if layers is None:
+                sent, delivered, latencies, elapsed = self.run(rooms, options)
+            else:
+                with override_settings(CHANNEL_LAYERS=layers):
+                    sent, delivered, latencies, elapsed = self.run(rooms, options)
+        finally:
+            message_buffer.flush_sync()
+            if not options['keep']:
+                self.cleanup()
+
+        latencies.sort()
+        self.stdout.write(
+            f"{len(rooms)} rooms x {options['clients']} clients, "
+            f"{sent} messages sent, {delivered} broadcasts delivered in {elapsed:.1f}s"
+        )
+        self.stdout.write(f"Throughput: {sent / elapsed:.1f} messages/s, {delivered / elapsed:.1f} deliveries/s")
+        if latencies:
+            self.stdout.write(
+                f"Broadcast latency: p50 {percentile(latencies, 50) * 1000:.2f} ms"
+                f"  p95 {percentile(latencies, 95) * 1000:.2f} ms"
+                f"  p99 {percentile(latencies, 99) * 1000:.2f} ms"
+            )
+        if delivered < sent * options['clients']:
+            self.stdout.write(self.style.WARNING(
+                f"{sent * options['clients'] - delivered} broadcasts were not delivered"
+            ))
+
+    def channel_layers(self, options):
+        if options['layer'] == 'memory':
+            return {'default': {'BACKEND': 'chat.layers.LocalChannelLayer', 'CONFIG': {'capacity': 1000}}}
+        if options['layer'] == 'redis':
+            return {'default': {
+                'BACKEND': 'channels_redis.core.RedisChannelLayer',
+                'CONFIG': {'hosts': [options['redis_url']], 'capacity': 1000},
+            }}
+        return None
+
+    def seed(self, room_count, client_count):
+        # Create a teacher, its courses and enrolled students for each room
+        User = get_user_model()
+        self.cleanup()
+        teacher = User(username=f"{SEED_PREFIX}teacher", role='teacher')
+        teacher.set_unusable_password()
+        teacher.save()
+        rooms = []
+        Enrollment = Course.enrolled_students.through
+        for r in range(room_count):
+            course = Course.objects.create(title=f"Load test room {r}", description="Load test", teacher=teacher)
+            students = [
+                User(username=f"{SEED_PREFIX}{r}_{i}", role='student', password='!')
+                for i in range(client_count - 1)
+            ]
+            students = User.objects.bulk_create(students)
+            # Insert enrollments directly so no notifications are created
+            Enrollment.objects.bulk_create(
+                [Enrollment(course_id=course.id, customuser_id=s.id) for s in students]
+            )
+            rooms.append((course.id, [teacher] + students))
+        return rooms
+
+    def cleanup(self):
+        # Courses and their chat messages go with the seeded teacher
+        get_user_model().objects.filter(username__startswith=SEED_PREFIX).delete()
+
+    def run(self, rooms, options):
+        from elearning.asgi import application
+
+        async def run_all():
+            return await asyncio.gather(*(
+                run_room(
+                    application, course_id, users, options['rate'], options['duration'],
+                    options['coalesce'], options['timeout'],
+                )
+                for course_id, users in rooms
+            ))
+
+        start = time.perf_counter()
+        results = asyncio.run(run_all())
+        elapsed = time.perf_counter() - start
+        sent = sum(r[0] for r in results)
+        delivered = sum(r[1] for r in results)
+        latencies = [latency for r in results for latency in r[2]]
+        return sent, delivered, latencies, elapsed
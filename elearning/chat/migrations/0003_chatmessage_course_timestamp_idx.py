@@ -0,0 +1,20 @@
+# Generated by Django 5.1.6 on 2026-10-17 23:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_chatmessage_timestamp_default'),
+        ('courses', '0002_course_blocked_students'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['course', 'timestamp'], name='chat_course_timestamp_idx'),
+        ),
+    ]
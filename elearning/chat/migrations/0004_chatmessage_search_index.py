@@ -0,0 +1,67 @@
+from django.db import migrations
+
+# Full-text index over ChatMessage.message. SQLite gets an external-content
+# FTS5 table kept in sync by triggers; PostgreSQL gets a GIN index on the
+# message's tsvector. Other backends fall back to unindexed matching.
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE chat_chatmessage_fts USING fts5(
+        message, content='chat_chatmessage', content_rowid='id', tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER chat_chatmessage_fts_insert AFTER INSERT ON chat_chatmessage BEGIN
+        INSERT INTO chat_chatmessage_fts(rowid, message) VALUES (new.id, new.message);
+    END
+    """,
+    """
+    CREATE TRIGGER chat_chatmessage_fts_delete AFTER DELETE ON chat_chatmessage BEGIN
+        INSERT INTO chat_chatmessage_fts(chat_chatmessage_fts, rowid, message) VALUES ('delete', old.id, old.message);
+    END
+    """,
+    """
+    CREATE TRIGGER chat_chatmessage_fts_update AFTER UPDATE OF message ON chat_chatmessage BEGIN
+        INSERT INTO chat_chatmessage_fts(chat_chatmessage_fts, rowid, message) VALUES ('delete', old.id, old.message);
+        INSERT INTO chat_chatmessage_fts(rowid, message) VALUES (new.id, new.message);
+    END
+    """,
+    "INSERT INTO chat_chatmessage_fts(chat_chatmessage_fts) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS chat_chatmessage_fts_update",
+    "DROP TRIGGER IF EXISTS chat_chatmessage_fts_delete",
+    "DROP TRIGGER IF EXISTS chat_chatmessage_fts_insert",
+    "DROP TABLE IF EXISTS chat_chatmessage_fts",
+]
+
+POSTGRES_FORWARD = [
+    "CREATE INDEX chat_chatmessage_search_idx ON chat_chatmessage USING GIN (to_tsvector('english', message))",
+]
+
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS chat_chatmessage_search_idx",
+]
+
+
+def run_statements(sqlite, postgres):
+    def run(apps, schema_editor):
+        statements = {'sqlite': sqlite, 'postgresql': postgres}.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_chatmessage_course_timestamp_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_statements(SQLITE_FORWARD, POSTGRES_FORWARD),
+            run_statements(SQLITE_REVERSE, POSTGRES_REVERSE),
+        ),
+    ]
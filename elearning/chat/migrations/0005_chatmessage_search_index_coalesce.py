@@ -0,0 +1,35 @@
+from django.db import migrations
+
+# SearchVector('message') compiles to to_tsvector(config, COALESCE(message, '')),
+# which PostgreSQL cannot match against the index on the bare column that
+# 0004 created, so rebuild it over the expression the queries use. Other
+# backends are unaffected.
+
+POSTGRES_FORWARD = [
+    "DROP INDEX IF EXISTS chat_chatmessage_search_idx",
+    "CREATE INDEX chat_chatmessage_search_idx ON chat_chatmessage USING GIN (to_tsvector('english', COALESCE(message, '')))",
+]
+
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS chat_chatmessage_search_idx",
+    "CREATE INDEX chat_chatmessage_search_idx ON chat_chatmessage USING GIN (to_tsvector('english', message))",
+]
+
+
+def run_statements(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            for statement in statements:
+                schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_chatmessage_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_statements(POSTGRES_FORWARD), run_statements(POSTGRES_REVERSE)),
+    ]
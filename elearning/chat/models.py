@@ -1,6 +1,13 @@
 from courses.models import Course
 from django.conf import settings
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from elearning.caching import bump_versions
+
+from .ids import next_message_id
 
 class ChatMessage(models.Model):
     # Foreign key to the Course model
@@ -9,9 +16,43 @@ class ChatMessage(models.Model):
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     # Text field to store the message content
     message = models.TextField()
-    # DateTime field to store the time of the message
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # DateTime field to store the time the message was sent
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Backs the keyset-paginated history query for a course
+            models.Index(fields=['course', 'timestamp'], name='chat_course_timestamp_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Ids come from the in-process generator, see chat/ids.py
+        if self.id is None:
+            self.id = next_message_id()
+        super().save(*args, **kwargs)
 
     # String representation of ChatMessage 
     def __str__(self):
         return f"{self.sender.username}: {self.message[:50]}"
+
+# Remove a deleted course's archived chat history
+@receiver(post_delete, sender=Course)
+def delete_chat_archive(sender, instance, **kwargs):
+    from .archive import delete_course_archive
+    delete_course_archive(instance.id)
+
+# Bump the version counter of the cached chat room page, see
+# elearning/caching.py. The message buffer's bulk inserts bump it itself.
+@receiver(post_save, sender=ChatMessage)
+@receiver(post_delete, sender=ChatMessage)
+def bump_chat_room_version(sender, instance, **kwargs):
+    bump_versions('course', [instance.course_id])
+
+# Count messages saved one at a time; the message buffer counts its bulk
+# inserts itself. Deletes are not counted down, since archiving deletes
+# messages that still count.
+@receiver(post_save, sender=ChatMessage)
+def count_chat_message(sender, instance, created, **kwargs):
+    from courses.stats import add_counts
+    if created:
+        add_counts(instance.course_id, chat_messages=1)
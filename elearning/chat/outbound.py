@@ -0,0 +1,66 @@
+import asyncio
+from collections import Counter, deque
+
+# What to do when a connection's outbound queue is full
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_CLOSE = "close"
+
+# Close code sent to clients disconnected for reading too slowly
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+# Process-wide totals across every chat connection
+outbound_stats = Counter()
+
+
+class OutboundQueue:
+    # Bounded per-connection queue of outgoing frames, drained by a writer
+    # task so a slow client never stalls the consumer's channel layer reads.
+
+    def __init__(self, send, maxsize, policy):
+        self.send = send
+        self.maxsize = maxsize
+        self.policy = policy
+        self.frames = deque()
+        # Frames thrown away because the queue was full
+        self.dropped = 0
+        # Frames that had to wait behind earlier frames
+        self.delayed = 0
+        self._sending = False
+        self._ready = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._drain())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def put(self, frame):
+        # Queue a frame, returning False if the connection should be closed
+        if len(self.frames) >= self.maxsize:
+            if self.policy == POLICY_CLOSE:
+                outbound_stats["closed"] += 1
+                return False
+            self.frames.popleft()
+            self.dropped += 1
+            outbound_stats["dropped"] += 1
+        if self.frames or self._sending:
+            self.delayed += 1
+            outbound_stats["delayed"] += 1
+        self.frames.append(frame)
+        self._ready.set()
+        return True
+
+    async def _drain(self):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while self.frames:
+                frame = self.frames.popleft()
+                self._sending = True
+                try:
+                    await self.send(text_data=frame)
+                finally:
+                    self._sending = False
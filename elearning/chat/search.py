@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+
+from elearning.fts import fts5_match_query, search_terms
+
+from .models import ChatMessage
+
+# Ranked full-text search over one course's chat history, backed by the
+# indexes created in migrations 0004_chatmessage_search_index and
+# 0005_chatmessage_search_index_coalesce.
+
+SQLITE_SEARCH = """
+    SELECT m.id, m.message, m.timestamp, u.username AS username
+    FROM chat_chatmessage_fts
+    JOIN chat_chatmessage m ON m.id = chat_chatmessage_fts.rowid
+    JOIN {users} u ON u.id = m.sender_id
+    WHERE chat_chatmessage_fts MATCH %s AND m.course_id = %s
+    ORDER BY bm25(chat_chatmessage_fts), m.id DESC
+    LIMIT %s OFFSET %s
+"""
+
+
+def search_messages(course_id, query, page=1, per_page=None):
+    # Return (rows, has_next) for one page of results, best match first
+    per_page = per_page or settings.CHAT_SEARCH_PAGE_SIZE
+    offset = (page - 1) * per_page
+    if not search_terms(query):
+        return [], False
+    if connection.vendor == 'sqlite':
+        rows = _search_sqlite(course_id, query, per_page + 1, offset)
+    elif connection.vendor == 'postgresql':
+        rows = _search_postgres(course_id, query, per_page + 1, offset)
+    else:
+        rows = _search_fallback(course_id, query, per_page + 1, offset)
+    return rows[:per_page], len(rows) > per_page
+
+
+def _as_rows(messages):
+    return [
+        {"id": m.id, "message": m.message, "timestamp": m.timestamp, "username": m.username}
+        for m in messages
+    ]
+
+
+def _search_sqlite(course_id, query, limit, offset):
+    users = ChatMessage._meta.get_field('sender').related_model._meta.db_table
+    return _as_rows(ChatMessage.objects.raw(
+        SQLITE_SEARCH.format(users=users),
+        [fts5_match_query(query), course_id, limit, offset],
+    ))
+
+
+def _search_postgres(course_id, query, limit, offset):
+    # Compiles to to_tsvector('english', COALESCE(message, '')), the
+    # expression the GIN index is built on
+    from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+    vector = SearchVector('message', config='english')
+    search_query = SearchQuery(query, config='english', search_type='websearch')
+    return list(
+        ChatMessage.objects.annotate(search=vector)
+        .filter(course_id=course_id, search=search_query)
+        .annotate(rank=SearchRank(vector, search_query))
+        .order_by('-rank', '-id')
+        .values('id', 'message', 'timestamp', username=F('sender__username'))[offset:offset + limit]
+    )
+
+
+def _search_fallback(course_id, query, limit, offset):
+    # No full-text index on this backend, so match every term unranked
+    messages = ChatMessage.objects.filter(course_id=course_id)
+    for term in search_terms(query):
+        messages = messages.filter(message__icontains=term)
+    return list(
+        messages.order_by('-timestamp', '-id')
+        .values('id', 'message', 'timestamp', username=F('sender__username'))[offset:offset + limit]
+    )
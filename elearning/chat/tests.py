@@ -1,17 +1,44 @@
+import asyncio
 import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
+from asgiref.sync import sync_to_async
+from channels.exceptions import ChannelFull
 from channels.testing import WebsocketCommunicator
+from courses.membership import get_memberships
 from courses.models import Course
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.db.models import F
+from django.test import Client, SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
 from elearning.asgi import application
+from elearning.testing import TestCase, TransactionTestCase
+
+from .buffer import MessageBuffer
+from .history import get_history_page, recent_messages
+from .ids import MAX_NODE_ID, SEQUENCE_BITS, MessageIdGenerator, NodeLease, chat_node_id, node_lease
+from .layers import LocalChannelLayer
+from .models import ChatMessage
+from .outbound import POLICY_CLOSE, POLICY_DROP_OLDEST, OutboundQueue
+from .search import search_messages
 
 User = get_user_model()
 
 class ChatTests(TestCase):
     def setUp(self):
+        cache.clear()
         # Set up test users and course
         self.teacher = User.objects.create_user(
             username='teacher1',
@@ -34,6 +61,7 @@ class ChatTests(TestCase):
         )
         self.course.enrolled_students.add(self.student)
         self.client = Client()
+        recent_messages.clear()
 
     def test_course_chat_room_view_for_enrolled_student(self):
         # Test chat room view for an enrolled student
@@ -55,11 +83,27 @@ class ChatTests(TestCase):
         response = self.client.get(reverse('chat:course_chat_room', args=[self.course.id]))
         self.assertContains(response, "You are not enrolled in this course.")
 
+    def get_communicator(self, user, query="", subprotocols=None):
+        # Build a communicator with the given user already in the scope
+        communicator = WebsocketCommunicator(
+            application, f"/ws/course_chat/{self.course.id}/{query}", subprotocols=subprotocols
+        )
+        communicator.scope["user"] = user
+        return communicator
+
+    async def join(self, user, subprotocols=None):
+        # Connect as a member and consume the recent history frame
+        communicator = self.get_communicator(user, subprotocols=subprotocols)
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, subprotocols[0] if subprotocols else None)
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "recent")
+        return communicator
+
     async def test_course_chat_consumer(self):
         # Test the chat consumer using
-        communicator = WebsocketCommunicator(application, f"/ws/course_chat/{self.course.id}/")
-        connected, _ = await communicator.connect()
-        self.assertTrue(connected)
+        communicator = await self.join(self.student)
         # Send a test message
         test_message = "Hello, course chat!"
         await communicator.send_json_to({"message": test_message})
@@ -67,6 +111,88 @@ class ChatTests(TestCase):
         self.assertEqual(response["message"], test_message)
         await communicator.disconnect()
 
+    async def test_course_chat_consumer_rejects_non_members(self):
+        # Test that users outside the course are rejected at connect time
+        other_student = await sync_to_async(User.objects.create_user)(
+            username='student2',
+            password='pass123',
+            role='student',
+            email='student2@example.com',
+            real_name='Student Two'
+        )
+        communicator = self.get_communicator(other_student)
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+    async def capture_queries(self, coro):
+        # Run a coroutine and return the queries it made on the test connection
+        ctx = CaptureQueriesContext(connection)
+        await sync_to_async(ctx.__enter__)()
+        await coro
+        await sync_to_async(ctx.__exit__)(None, None, None)
+        return await sync_to_async(lambda: ctx.captured_queries)()
+
+    async def send_messages(self, communicator, count):
+        for i in range(count):
+            await communicator.send_json_to({"message": f"Message {i}"})
+            await communicator.receive_json_from()
+
+    async def test_course_chat_consumer_message_query_count(self):
+        # Test that messages are broadcast without touching the database
+        # and written in a single batch when the connection closes, followed
+        # by one update of the course's stats
+        from chat.models import ChatMessage
+        communicator = await self.join(self.teacher)
+        captured = await self.capture_queries(self.send_messages(communicator, 3))
+        self.assertEqual(len(captured), 0)
+        captured = await self.capture_queries(communicator.disconnect())
+        self.assertEqual(len(captured), 2)
+        self.assertTrue(captured[0]["sql"].startswith("INSERT"))
+        self.assertTrue(captured[1]["sql"].startswith('UPDATE "courses_coursestats"'))
+        self.assertEqual(await ChatMessage.objects.filter(course=self.course, sender=self.teacher).acount(), 3)
+
+    @override_settings(CHAT_BUFFER_MAX_SIZE=2)
+    async def test_message_buffer_flushes_at_size_threshold(self):
+        # Test that a full buffer is flushed without waiting for the timer
+        from chat.models import ChatMessage
+        communicator = await self.join(self.student)
+        await self.send_messages(communicator, 2)
+        await asyncio.sleep(0.1)
+        self.assertEqual(await ChatMessage.objects.filter(course=self.course).acount(), 2)
+        await communicator.disconnect()
+
+    @override_settings(CHAT_BUFFER_MAX_SIZE=2)
+    async def test_message_buffer_flush_bumps_room_version(self):
+        # Test that buffered writes invalidate the cached chat room page
+        from elearning.caching import get_versions
+        before = await sync_to_async(get_versions)([('course', self.course.id)])
+        communicator = await self.join(self.student)
+        await self.send_messages(communicator, 2)
+        await asyncio.sleep(0.1)
+        self.assertNotEqual(await sync_to_async(get_versions)([('course', self.course.id)]), before)
+        await communicator.disconnect()
+
+    @override_settings(CHAT_BUFFER_MAX_SIZE=2)
+    async def test_message_buffer_flush_counts_messages(self):
+        # Test that buffered writes are added to the course's stats
+        from courses.models import CourseStats
+        communicator = await self.join(self.student)
+        await self.send_messages(communicator, 2)
+        await asyncio.sleep(0.1)
+        stats = await CourseStats.objects.aget(course=self.course)
+        self.assertEqual(stats.chat_messages, 2)
+        await communicator.disconnect()
+
+    @override_settings(CHAT_BUFFER_FLUSH_INTERVAL=0.05)
+    async def test_message_buffer_flushes_at_time_threshold(self):
+        # Test that a partial buffer is flushed once the interval passes
+        from chat.models import ChatMessage
+        communicator = await self.join(self.student)
+        await self.send_messages(communicator, 1)
+        await asyncio.sleep(0.2)
+        self.assertEqual(await ChatMessage.objects.filter(course=self.course).acount(), 1)
+        await communicator.disconnect()
+
     def test_chat_history_loaded_in_template(self):
         # Test if chat history is loaded in the template
         from chat.models import ChatMessage
@@ -74,3 +200,584 @@ class ChatTests(TestCase):
         self.client.login(username='student1', password='pass123')
         response = self.client.get(reverse('chat:course_chat_room', args=[self.course.id]))
         self.assertContains(response, "Historical message")
+
+    @override_settings(CHAT_HISTORY_PAGE_SIZE=2)
+    def test_chat_room_renders_only_newest_page(self):
+        # Test that the room only renders the newest page of history
+        from chat.models import ChatMessage
+        for i in range(3):
+            ChatMessage.objects.create(course=self.course, sender=self.student, message=f"History {i}")
+        self.client.login(username='student1', password='pass123')
+        response = self.client.get(reverse('chat:course_chat_room', args=[self.course.id]))
+        self.assertNotContains(response, "History 0")
+        self.assertContains(response, "History 1")
+        self.assertContains(response, "History 2")
+        self.assertTrue(response.context["has_older"])
+
+    @override_settings(CHAT_HISTORY_PAGE_SIZE=2)
+    async def test_load_older_frame_pages_with_cursor(self):
+        # Test that older pages are returned over the WebSocket by cursor
+        from chat.history import encode_cursor, get_history_page
+        from chat.models import ChatMessage
+        for i in range(5):
+            await ChatMessage.objects.acreate(course=self.course, sender=self.student, message=f"History {i}")
+        newest, _ = await sync_to_async(get_history_page)(self.course.id)
+        communicator = await self.join(self.student)
+        await communicator.send_json_to({"type": "load_older", "before": encode_cursor(newest[0])})
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "history")
+        self.assertEqual([m["message"] for m in response["messages"]], ["History 1", "History 2"])
+        self.assertTrue(response["has_more"])
+        await communicator.send_json_to({"type": "load_older", "before": response["cursor"]})
+        response = await communicator.receive_json_from()
+        self.assertEqual([m["message"] for m in response["messages"]], ["History 0"])
+        self.assertFalse(response["has_more"])
+        await communicator.disconnect()
+
+    async def test_join_served_from_recent_messages(self):
+        # Test that a warm room is sent to joining clients without a history query
+        student = await self.join(self.student)
+        await student.send_json_to({"message": "Hello from memory"})
+        await student.receive_json_from()
+        teacher = self.get_communicator(self.teacher)
+        captured = await self.capture_queries(teacher.connect())
+        response = await teacher.receive_json_from()
+        self.assertEqual(response["type"], "recent")
+        self.assertEqual([m["message"] for m in response["messages"]], ["Hello from memory"])
+        self.assertFalse(any("chat_chatmessage" in q["sql"] for q in captured))
+        await teacher.disconnect()
+        await student.disconnect()
+
+    @override_settings(CHAT_RECENT_MAX_ROOMS=1)
+    def test_recent_messages_evicts_least_recently_used_room(self):
+        # Test that rooms beyond the limit are evicted and reloaded from the database
+        other_course = Course.objects.create(title='Other Course', description='Other', teacher=self.teacher)
+        recent_messages.join(self.course.id)
+        recent_messages.join(other_course.id)
+        self.addCleanup(recent_messages.leave, self.course.id)
+        self.addCleanup(recent_messages.leave, other_course.id)
+        with self.assertNumQueries(1):
+            recent_messages.get(self.course.id)
+        with self.assertNumQueries(0):
+            recent_messages.get(self.course.id)
+        recent_messages.get(other_course.id)
+        with self.assertNumQueries(1):
+            recent_messages.get(self.course.id)
+
+    def test_recent_messages_not_kept_without_local_consumer(self):
+        # Test that a room nobody in this process listens to is read from
+        # the database every time, since its broadcasts never arrive here
+        from chat.models import ChatMessage
+        recent_messages.get(self.course.id)
+        ChatMessage.objects.create(course=self.course, sender=self.student, message="Sent elsewhere")
+        with self.assertNumQueries(1):
+            rows, _ = recent_messages.get(self.course.id)
+        self.assertEqual([m["message"] for m in rows], ["Sent elsewhere"])
+        self.assertIsNone(recent_messages.since(self.course.id, 0))
+
+    @override_settings(CHAT_HISTORY_PAGE_SIZE=2)
+    def test_recent_messages_records_each_broadcast_once(self):
+        # Test that every local recipient of a broadcast can append it,
+        # including copies that arrive after newer messages
+        recent_messages.join(self.course.id)
+        self.addCleanup(recent_messages.leave, self.course.id)
+        recent_messages.get(self.course.id)
+        now = timezone.now().isoformat()
+        first, second, third = (
+            {"id": message_id, "username": "student1", "message": str(message_id), "timestamp": now}
+            for message_id in (1, 2, 3)
+        )
+        for event in (first, first, second, first, second):
+            recent_messages.append(self.course.id, event)
+        self.assertEqual([m["id"] for m in recent_messages.since(self.course.id, 0)], [1, 2])
+        recent_messages.append(self.course.id, third)
+        recent_messages.append(self.course.id, third)
+        rows, has_older = recent_messages.get(self.course.id)
+        self.assertEqual([m["id"] for m in rows], [2, 3])
+        self.assertTrue(has_older)
+
+    async def test_recent_messages_dropped_when_last_consumer_leaves(self):
+        # Test that a room goes cold once no local consumer can keep it up to date
+        from chat.models import ChatMessage
+        student = await self.join(self.student)
+        await student.send_json_to({"message": "Hello"})
+        await student.receive_json_from()
+        self.assertIsNotNone(recent_messages.since(self.course.id, 0))
+        await student.disconnect()
+        self.assertIsNone(recent_messages.since(self.course.id, 0))
+        await ChatMessage.objects.acreate(course=self.course, sender=self.teacher, message="Sent elsewhere")
+        rows, _ = await sync_to_async(recent_messages.get)(self.course.id)
+        self.assertEqual([m["message"] for m in rows], ["Hello", "Sent elsewhere"])
+
+    async def test_reconnect_resyncs_missed_messages(self):
+        # Test that a reconnecting client only gets messages after its last-seen id
+        student = await self.join(self.student)
+        await student.send_json_to({"message": "Seen"})
+        seen = await student.receive_json_from()
+        self.assertIn("id", seen)
+        await student.send_json_to({"message": "Missed"})
+        await student.receive_json_from()
+        teacher = self.get_communicator(self.teacher, f"?last_id={seen['id']}")
+        await teacher.connect()
+        response = await teacher.receive_json_from()
+        self.assertEqual(response["type"], "resync")
+        self.assertFalse(response["reload"])
+        self.assertEqual([m["message"] for m in response["messages"]], ["Missed"])
+        await teacher.disconnect()
+        await student.disconnect()
+
+    async def test_reconnect_resyncs_from_database_on_cold_start(self):
+        # Test that buffered messages are flushed and read back when the room is cold
+        student = await self.join(self.student)
+        await student.send_json_to({"message": "Seen"})
+        seen = await student.receive_json_from()
+        await student.send_json_to({"message": "Missed"})
+        await student.receive_json_from()
+        recent_messages.clear()
+        teacher = self.get_communicator(self.teacher, f"?last_id={seen['id']}")
+        await teacher.connect()
+        response = await teacher.receive_json_from()
+        self.assertEqual([m["message"] for m in response["messages"]], ["Missed"])
+        await teacher.disconnect()
+        await student.disconnect()
+
+    @override_settings(CHAT_RESYNC_MAX_MESSAGES=1)
+    async def test_reconnect_too_far_behind_asks_for_reload(self):
+        # Test that clients missing more than the cap are told to reload
+        from chat.models import ChatMessage
+        for i in range(3):
+            await ChatMessage.objects.acreate(course=self.course, sender=self.student, message=f"History {i}")
+        teacher = self.get_communicator(self.teacher, "?last_id=0")
+        await teacher.connect()
+        response = await teacher.receive_json_from()
+        self.assertEqual(response["type"], "resync")
+        self.assertTrue(response["reload"])
+        self.assertEqual(response["messages"], [])
+        await teacher.disconnect()
+
+    async def test_v2_clients_receive_coalesced_frames(self):
+        # Test that broadcasts within one tick reach v2 clients as a single array
+        student = await self.join(self.student)
+        teacher = await self.join(self.teacher, subprotocols=["chat.v2"])
+        await student.send_json_to({"message": "First"})
+        await student.send_json_to({"message": "Second"})
+        # v1 clients still get one object per message
+        self.assertEqual((await student.receive_json_from())["message"], "First")
+        self.assertEqual((await student.receive_json_from())["message"], "Second")
+        frame = await teacher.receive_json_from()
+        self.assertEqual([m["message"] for m in frame], ["First", "Second"])
+        await teacher.disconnect()
+        await student.disconnect()
+
+    async def test_broadcast_serialized_once_per_event(self):
+        # Test that the payload is serialized by the sender, not by each recipient
+        from chat import consumers
+        student = await self.join(self.student)
+        teacher = await self.join(self.teacher)
+        with mock.patch.object(consumers, "json", wraps=json) as consumer_json:
+            await student.send_json_to({"message": "Once"})
+            await student.receive_json_from()
+            await teacher.receive_json_from()
+        self.assertEqual(consumer_json.dumps.call_count, 1)
+        await teacher.disconnect()
+        await student.disconnect()
+
+    @override_settings(CHAT_SEND_QUEUE_SIZE=0, CHAT_SLOW_CONSUMER_POLICY="close")
+    async def test_slow_consumer_closed_with_policy_code(self):
+        # Test that a client whose queue is full is closed with the slow-consumer code
+        student = await self.join(self.student)
+        await student.send_json_to({"message": "Too much"})
+        output = await student.receive_output()
+        self.assertEqual(output, {"type": "websocket.close", "code": 4008})
+        await student.disconnect()
+
+
+class MessageBufferRetryTests(TransactionTestCase):
+    # Failed writes have to leave the connection usable, as they do in
+    # autocommit mode, so these run outside a test transaction
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username='teacher1', password='pass123', role='teacher')
+        self.student = User.objects.create_user(username='student1', password='pass123', role='student')
+        self.course = Course.objects.create(title='Test Course', description='Test Description', teacher=self.teacher)
+
+    def flaky_bulk_create(self, failures):
+        # Patch bulk_create to raise "database is locked" the first
+        # failures times it is called
+        real = ChatMessage.objects.bulk_create
+        calls = []
+
+        def bulk_create(*args, **kwargs):
+            calls.append(1)
+            if len(calls) <= failures:
+                raise OperationalError("database is locked")
+            return real(*args, **kwargs)
+        return mock.patch.object(ChatMessage.objects, 'bulk_create', side_effect=bulk_create)
+
+    def buffered(self, *texts):
+        buffer = MessageBuffer()
+        buffer._pending = [
+            ChatMessage(id=1000 + i, course=self.course, sender=self.student, message=text, timestamp=timezone.now())
+            for i, text in enumerate(texts)
+        ]
+        return buffer
+
+    @override_settings(CHAT_BUFFER_RETRY_DELAY=0.05)
+    async def test_message_buffer_requeues_failed_batch(self):
+        # Test that a batch that fails to write is queued again and stored
+        # by the retry instead of being dropped
+        buffer = self.buffered("first", "second")
+        with self.flaky_bulk_create(1):
+            await buffer.flush()
+            self.assertEqual(len(buffer), 2)
+            await asyncio.sleep(0.2)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(await ChatMessage.objects.filter(course=self.course).acount(), 2)
+        self.assertEqual(buffer._failures, 0)
+
+    @override_settings(CHAT_BUFFER_RETRY_DELAY=0, CHAT_BUFFER_MAX_RETRIES=2)
+    def test_message_buffer_retries_before_giving_up_on_batch(self):
+        # Test that transient failures are retried until the write succeeds
+        buffer = self.buffered("first", "second")
+        with self.flaky_bulk_create(2):
+            buffer.flush_sync()
+        self.assertEqual(ChatMessage.objects.filter(course=self.course).count(), 2)
+
+    @override_settings(CHAT_BUFFER_RETRY_DELAY=0, CHAT_BUFFER_MAX_RETRIES=1)
+    def test_message_buffer_inserts_rows_one_by_one_after_retries(self):
+        # Test that one row the database rejects does not drop the others
+        ChatMessage.objects.create(id=1000, course=self.course, sender=self.teacher, message="taken")
+        buffer = self.buffered("duplicate", "second", "third")
+        with self.assertLogs('chat.buffer', level='ERROR'):
+            buffer.flush_sync()
+        self.assertEqual(
+            sorted(ChatMessage.objects.filter(course=self.course).values_list('message', flat=True)),
+            ["second", "taken", "third"],
+        )
+        self.course.stats.refresh_from_db()
+        self.assertEqual(self.course.stats.chat_messages, 3)
+
+
+class FakeRedis:
+    # The few Redis commands a node lease uses
+    def __init__(self):
+        self.data = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value.encode()
+        return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def expire(self, key, seconds):
+        return key in self.data
+
+
+class ChatNodeIdTests(SimpleTestCase):
+    LOCAL_LAYERS = {'default': {'BACKEND': 'chat.layers.LocalChannelLayer'}}
+    REDIS_LAYERS = {'default': {'BACKEND': 'channels_redis.core.RedisChannelLayer'}}
+
+    @override_settings(CHAT_NODE_ID=None, CHANNEL_LAYERS=LOCAL_LAYERS)
+    def test_node_id_defaults_to_zero_with_local_layer(self):
+        self.assertEqual(chat_node_id(), 0)
+
+    @override_settings(CHAT_NODE_ID=None, CHANNEL_LAYERS=REDIS_LAYERS)
+    def test_node_id_leased_with_shared_layer(self):
+        # Test that processes sharing a channel layer never guess a node id
+        with mock.patch.object(node_lease, 'acquire', return_value=5) as acquire:
+            self.assertEqual(chat_node_id(), 5)
+        acquire.assert_called_once_with()
+
+    @override_settings(CHAT_NODE_ID=7, CHANNEL_LAYERS=REDIS_LAYERS)
+    def test_explicit_node_id(self):
+        self.assertEqual(chat_node_id(), 7)
+
+    @override_settings(CHAT_NODE_ID=64)
+    def test_out_of_range_node_id_rejected(self):
+        # Test that a node id is never masked into another process's id
+        with self.assertRaises(ImproperlyConfigured):
+            chat_node_id()
+
+    @override_settings(CHAT_NODE_ID=None, CHANNEL_LAYERS=REDIS_LAYERS)
+    def test_node_id_resolved_on_first_id(self):
+        # Test that nothing is resolved until an id is needed
+        generate = MessageIdGenerator()
+        self.assertIsNone(generate.node_id)
+        with mock.patch.object(node_lease, 'acquire', return_value=3):
+            message_id = generate()
+        self.assertEqual((message_id >> SEQUENCE_BITS) & MAX_NODE_ID, 3)
+
+    def test_leases_hand_out_distinct_node_ids(self):
+        client = FakeRedis()
+        leases = [NodeLease(), NodeLease()]
+        with mock.patch('chat.ids.threading.Thread'):
+            for lease in leases:
+                lease._client = client
+                lease.acquire()
+        self.assertEqual([lease.node_id for lease in leases], [0, 1])
+        self.assertTrue(leases[0].renew())
+        # Another process took the id after the lease expired
+        client.data["chat:node:0"] = b"someone else"
+        self.assertFalse(leases[0].renew())
+
+
+class OutboundQueueTests(SimpleTestCase):
+    def setUp(self):
+        # A send callable that blocks until released, like a slow client
+        self.sent = []
+        self.release = asyncio.Event()
+
+    async def slow_send(self, text_data):
+        await self.release.wait()
+        self.sent.append(text_data)
+
+    async def test_drop_oldest_policy_keeps_newest_frames(self):
+        queue = OutboundQueue(self.slow_send, 2, POLICY_DROP_OLDEST)
+        queue.start()
+        self.assertTrue(queue.put("1"))
+        # Let the writer pick up the first frame and block on it
+        await asyncio.sleep(0)
+        for frame in ["2", "3", "4"]:
+            self.assertTrue(queue.put(frame))
+        self.assertEqual(queue.dropped, 1)
+        self.assertEqual(queue.delayed, 3)
+        self.release.set()
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.sent, ["1", "3", "4"])
+        queue.stop()
+
+    async def test_close_policy_rejects_frames_when_full(self):
+        queue = OutboundQueue(self.slow_send, 1, POLICY_CLOSE)
+        queue.start()
+        self.assertTrue(queue.put("1"))
+        await asyncio.sleep(0)
+        self.assertTrue(queue.put("2"))
+        self.assertFalse(queue.put("3"))
+        self.assertEqual(queue.dropped, 0)
+        queue.stop()
+
+
+class LocalChannelLayerTests(SimpleTestCase):
+    async def test_group_send_reaches_every_member(self):
+        layer = LocalChannelLayer()
+        channels = [await layer.new_channel() for _ in range(3)]
+        for channel in channels:
+            await layer.group_add("room", channel)
+        await layer.group_send("room", {"type": "chat.message", "text": "hi"})
+        for channel in channels:
+            self.assertEqual((await layer.receive(channel))["text"], "hi")
+
+    async def test_group_discard_stops_delivery(self):
+        layer = LocalChannelLayer()
+        channel = await layer.new_channel()
+        await layer.group_add("room", channel)
+        await layer.group_discard("room", channel)
+        await layer.group_send("room", {"type": "chat.message"})
+        self.assertNotIn(channel, layer.channels)
+
+    async def test_send_raises_when_channel_is_full(self):
+        layer = LocalChannelLayer(capacity=1)
+        channel = await layer.new_channel()
+        await layer.send(channel, {"type": "chat.message"})
+        with self.assertRaises(ChannelFull):
+            await layer.send(channel, {"type": "chat.message"})
+
+    async def test_expired_messages_are_not_delivered(self):
+        layer = LocalChannelLayer(expiry=-1)
+        channel = await layer.new_channel()
+        await layer.group_add("room", channel)
+        await layer.send(channel, {"type": "chat.message", "text": "stale"})
+        await layer.send(channel, {"type": "chat.message", "text": "stale too"})
+        layer.expiry = 60
+        await layer.send(channel, {"type": "chat.message", "text": "fresh"})
+        self.assertEqual((await layer.receive(channel))["text"], "fresh")
+        self.assertNotIn(channel, layer.groups.get("room", {}))
+
+
+class ChatLoadTestCommandTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_chat_loadtest_reports_latency_and_cleans_up(self):
+        out = StringIO()
+        # The test database is already a throwaway one
+        call_command('chat_loadtest', rooms=2, clients=3, rate=50, duration=0.1, allow_live_db=True, stdout=out)
+        output = out.getvalue()
+        self.assertIn("10 messages sent, 30 broadcasts delivered", output)
+        self.assertIn("p99", output)
+        self.assertFalse(User.objects.filter(username__startswith="loadtest_").exists())
+
+    def test_chat_loadtest_keeps_rows_only_in_live_db(self):
+        with self.assertRaises(CommandError):
+            call_command('chat_loadtest', keep=True, stdout=StringIO())
+
+
+class ChatSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username='teacher1', password='pass123', role='teacher')
+        self.course = Course.objects.create(title='Test Course', description='Test', teacher=self.teacher)
+        self.other_course = Course.objects.create(title='Other Course', description='Other', teacher=self.teacher)
+
+    def post(self, message, course=None):
+        return ChatMessage.objects.create(course=course or self.course, sender=self.teacher, message=message)
+
+    def test_search_ranks_matches_within_course(self):
+        self.post("The exam covers recursion")
+        best = self.post("Recursion, recursion and more recursion")
+        self.post("Lunch plans")
+        self.post("Recursion in the other course", course=self.other_course)
+        results, has_next = search_messages(self.course.id, "recursion")
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0]["id"], best.id)
+        self.assertEqual(results[0]["username"], "teacher1")
+        self.assertFalse(has_next)
+
+    def test_search_index_follows_updates_and_deletes(self):
+        message = self.post("Homework is due friday")
+        message.message = "Homework is due monday"
+        message.save()
+        self.assertEqual(search_messages(self.course.id, "friday")[0], [])
+        self.assertEqual(len(search_messages(self.course.id, "monday")[0]), 1)
+        message.delete()
+        self.assertEqual(search_messages(self.course.id, "monday")[0], [])
+
+    def test_search_paginates_and_matches_prefixes(self):
+        for i in range(3):
+            self.post(f"Question {i} about databases")
+        results, has_next = search_messages(self.course.id, "databa", page=1, per_page=2)
+        self.assertEqual(len(results), 2)
+        self.assertTrue(has_next)
+        results, has_next = search_messages(self.course.id, "databa", page=2, per_page=2)
+        self.assertEqual(len(results), 1)
+        self.assertFalse(has_next)
+
+    def test_search_ignores_query_syntax(self):
+        self.post('He said "hello" AND left')
+        self.assertEqual(len(search_messages(self.course.id, '"hello AND (')[0]), 1)
+
+    def test_search_view_requires_membership(self):
+        student = User.objects.create_user(username='student1', password='pass123', role='student')
+        self.post("Secret notes")
+        self.client.login(username='student1', password='pass123')
+        response = self.client.get(reverse('chat:search_chat', args=[self.course.id]), {'q': 'secret'})
+        self.assertContains(response, "You are not enrolled in this course.")
+        self.course.enrolled_students.add(student)
+        response = self.client.get(reverse('chat:search_chat', args=[self.course.id]), {'q': 'secret'})
+        self.assertContains(response, "Secret notes")
+
+    def test_search_view_rejects_other_teachers(self):
+        User.objects.create_user(username='teacher2', password='pass123', role='teacher')
+        self.post("Secret notes")
+        self.client.login(username='teacher2', password='pass123')
+        response = self.client.get(reverse('chat:search_chat', args=[self.course.id]), {'q': 'secret'})
+        self.assertContains(response, "You are not enrolled in this course.")
+        self.assertNotContains(response, "Secret notes")
+        self.client.login(username='teacher1', password='pass123')
+        response = self.client.get(reverse('chat:search_chat', args=[self.course.id]), {'q': 'secret'})
+        self.assertContains(response, "Secret notes")
+
+
+class ChatArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.archive_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_root, ignore_errors=True)
+        settings_override = override_settings(CHAT_ARCHIVE_ROOT=self.archive_root, CHAT_HISTORY_PAGE_SIZE=3)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.teacher = User.objects.create_user(username='teacher1', password='pass123', role='teacher')
+        self.course = Course.objects.create(title='Test Course', description='Test', teacher=self.teacher)
+        old = timezone.now() - timedelta(days=100)
+        for i in range(5):
+            ChatMessage.objects.create(
+                course=self.course, sender=self.teacher, message=f"Old {i}", timestamp=old + timedelta(minutes=i)
+            )
+        for i in range(2):
+            ChatMessage.objects.create(course=self.course, sender=self.teacher, message=f"New {i}")
+
+    def archive(self):
+        call_command('archive_chat', days=90, block_size=2, stdout=StringIO())
+
+    def test_archive_moves_old_messages_out_of_the_table(self):
+        self.archive()
+        self.assertEqual(
+            list(ChatMessage.objects.filter(course=self.course).values_list('message', flat=True)),
+            ["New 0", "New 1"],
+        )
+        self.assertTrue(os.path.exists(os.path.join(self.archive_root, str(self.course.id), "index.jsonl")))
+
+    def test_history_pages_continue_into_the_archive(self):
+        self.archive()
+        pages = []
+        rows, has_more = get_history_page(self.course.id)
+        pages.append([row["message"] for row in rows])
+        while has_more:
+            rows, has_more = get_history_page(self.course.id, (rows[0]["timestamp"], rows[0]["id"]))
+            pages.append([row["message"] for row in rows])
+        self.assertEqual(pages, [["Old 4", "New 0", "New 1"], ["Old 1", "Old 2", "Old 3"], ["Old 0"]])
+
+    def test_interrupted_archive_is_not_duplicated(self):
+        from chat.archive import append_block
+        rows = list(
+            ChatMessage.objects.filter(message__in=["Old 0", "Old 1"]).order_by('timestamp')
+            .values('id', 'message', 'timestamp', username=F('sender__username'))
+        )
+        append_block(self.course.id, rows)
+        self.archive()
+        rows, _ = get_history_page(self.course.id, limit=10)
+        self.assertEqual([row["message"] for row in rows], ["Old 0", "Old 1", "Old 2", "Old 3", "Old 4", "New 0", "New 1"])
+
+    def test_deleting_course_removes_archive(self):
+        self.archive()
+        self.course.delete()
+        self.assertFalse(os.path.exists(os.path.join(self.archive_root, str(self.course.id))))
+
+
+class ChatViewQueryTests(TestCase):
+    # Query budgets for every view in chat/views.py
+    def setUp(self):
+        cache.clear()
+        recent_messages.clear()
+        self.teacher = User.objects.create_user(username='teacher1', password='pass123', role='teacher')
+        self.student = User.objects.create_user(username='student1', password='pass123', role='student')
+        self.outsider = User.objects.create_user(username='student2', password='pass123', role='student')
+        self.course = Course.objects.create(title='Test Course', description='Test', teacher=self.teacher)
+        self.course.enrolled_students.add(self.student)
+        ChatMessage.objects.bulk_create([
+            ChatMessage(course=self.course, sender=self.student, message=f"Hello {i}") for i in range(30)
+        ])
+
+    def assertQueries(self, num, user, url, data=None):
+        self.client.force_login(user)
+        # Warm the cached unread count and memberships
+        self.client.get(reverse('accounts:login'))
+        get_memberships(user.id)
+        with self.assertNumQueries(num):
+            return self.client.get(url, data or {})
+
+    def test_course_chat_room(self):
+        url = reverse('chat:course_chat_room', args=[self.course.id])
+        # Without a consumer in this process the history is read every time
+        self.assertQueries(4, self.teacher, url)
+        # Then the page itself is cached for the teacher
+        self.assertQueries(2, self.teacher, url)
+        self.assertQueries(4, self.student, url)
+        # Outsiders only need the course, with membership from the cache
+        self.assertQueries(3, self.outsider, url)
+        # While a local consumer keeps the room warm the history comes
+        # from memory after the first visit
+        cache.clear()
+        recent_messages.join(self.course.id)
+        self.addCleanup(recent_messages.leave, self.course.id)
+        self.assertQueries(4, self.student, url)
+        self.assertQueries(3, self.teacher, url)
+
+    def test_search_chat(self):
+        url = reverse('chat:search_chat', args=[self.course.id])
+        self.assertQueries(4, self.student, url, {'q': 'hello'})
+        self.assertQueries(3, self.student, url)
+        self.assertQueries(3, self.outsider, url, {'q': 'hello'})
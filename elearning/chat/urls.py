@@ -6,4 +6,5 @@ app_name = "chat"
 
 urlpatterns = [
     path('course_chat/<int:course_id>/', views.course_chat_room, name='course_chat_room'),
+    path('course_chat/<int:course_id>/search/', views.search_chat, name='search_chat'),
 ]
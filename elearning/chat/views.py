@@ -1,19 +1,58 @@
+from courses.membership import is_enrolled
 from courses.models import Course
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404, render
 
-from .models import ChatMessage
+from elearning.caching import cache_response
+
+from .history import encode_cursor, recent_messages
+from .search import search_messages
 
 
 @login_required
+@cache_response(lambda request, course_id: [('course', course_id)])
 def course_chat_room(request, course_id):
     course = get_object_or_404(Course, id=course_id)
 
     # Verify if the user is enrolled or is the teacher
-    if request.user.role == 'student' and request.user not in course.enrolled_students.all():
+    if request.user.role == 'student' and not is_enrolled(request.user, course.id):
+        return render(request, "chat/forbidden.html", {"message": "You are not enrolled in this course."})
+
+    # Retrieve only the newest page of chat history, from memory when a
+    # local consumer keeps the room warm; older pages are requested over
+    # the WebSocket
+    chat_history, has_older = recent_messages.get(course.id)
+    history_cursor = encode_cursor(chat_history[0]) if chat_history else ""
+
+    return render(request, "chat/course_chat_room.html", {
+        "course": course,
+        "chat_history": chat_history,
+        "has_older": has_older,
+        "history_cursor": history_cursor,
+        "last_message_id": chat_history[-1]["id"] if chat_history else None,
+    })
+
+
+@login_required
+def search_chat(request, course_id):
+    course = get_object_or_404(Course, id=course_id)
+
+    # Only the course's teacher and enrolled users may search, as in the
+    # chat consumer
+    if request.user.id != course.teacher_id and not is_enrolled(request.user, course.id):
         return render(request, "chat/forbidden.html", {"message": "You are not enrolled in this course."})
 
-    # Retrieve chat history
-    chat_history = ChatMessage.objects.filter(course=course).order_by('timestamp')
+    query = request.GET.get('q', '')
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
+    results, has_next = search_messages(course.id, query, page)
 
-    return render(request, "chat/course_chat_room.html", {"course": course, "chat_history": chat_history})
+    return render(request, "chat/search.html", {
+        "course": course,
+        "query": query,
+        "results": results,
+        "page": page,
+        "has_next": has_next,
+    })
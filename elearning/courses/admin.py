@@ -1,8 +1,11 @@
 from django.contrib import admin
 
-from .models import Course, Feedback, Material, Notification
+from .models import Course, CourseEvent, CourseStats, Feedback, Material, Notification, NotificationState
 
 admin.site.register(Course)
 admin.site.register(Material)
 admin.site.register(Feedback)
 admin.site.register(Notification)
+admin.site.register(CourseEvent)
+admin.site.register(NotificationState)
+admin.site.register(CourseStats)
@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.template.loader import render_to_string
+
+from elearning.caching import get_versions
+
+from .models import Course
+
+# The course catalog is paged and its rendered rows are cached per role,
+# ordering and page. Every key carries the ("catalog", 0) version,
+# which receivers in models.py bump whenever a course is saved or deleted,
+# so a change makes all cached pages unreachable at once. Rows are cached
+# together with their course ids so the students' blocked courses can be
+# dropped per request from their cached membership set.
+
+# ?order= values and the ordering each one maps to
+CATALOG_ORDERINGS = {
+    'title': ('title', 'id'),
+    'newest': ('-id',),
+}
+
+
+def catalog_cache_key(role, order, page):
+    version = get_versions([('catalog', 0)])[0]
+    return f"courses:catalog:{version}:{role}:{order}:{page}"
+
+
+def get_catalog_page(role, order='title', page=1):
+    # Return a dict with the page's rendered rows as (course id, html)
+    # pairs plus its number, num_pages, has_previous and has_next
+    key = catalog_cache_key(role, order, page)
+    entry = cache.get(key)
+    if entry is None:
+        courses = Course.objects.select_related('teacher').only(
+            'id', 'title', 'description', 'teacher__username'
+        ).order_by(*CATALOG_ORDERINGS[order])
+        page_obj = Paginator(courses, settings.COURSE_CATALOG_PAGE_SIZE).get_page(page)
+        entry = {
+            'rows': [
+                (course.id, render_to_string('courses/catalog_row.html', {'course': course, 'role': role}))
+                for course in page_obj
+            ],
+            'number': page_obj.number,
+            'num_pages': page_obj.paginator.num_pages,
+            'has_previous': page_obj.has_previous(),
+            'has_next': page_obj.has_next(),
+        }
+        cache.set(key, entry, settings.COURSE_CATALOG_CACHE_TIMEOUT)
+    return entry
@@ -0,0 +1,38 @@
+import json
+
+from asgiref.sync import sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+from .notifications import get_unread_count, notification_group
+
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    # Pushes new notifications to every open page of a logged-in user so
+    # the unread badge stays current without polling
+    async def connect(self):
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+        self.group_name = notification_group(user.pk)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        # Start the badge from the current count
+        count = await sync_to_async(get_unread_count)(user)
+        await self.send(text_data=json.dumps({"type": "unread", "count": count}))
+
+    async def disconnect(self, close_code):
+        if hasattr(self, "group_name"):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def notification_push(self, event):
+        # A new notification or course event for this user
+        await self.send(text_data=json.dumps({
+            "type": "notification",
+            "message": event["message"],
+            "created_at": event["created_at"],
+        }))
+
+    async def notification_unread(self, event):
+        # The unread count was reset elsewhere, e.g. from another tab
+        await self.send(text_data=json.dumps({"type": "unread", "count": event["count"]}))
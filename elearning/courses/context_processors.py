@@ -0,0 +1,9 @@
+from .notifications import get_unread_count
+
+
+def notifications(request):
+    # Unread count for the navbar badge, served from the cache
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {'unread_notification_count': get_unread_count(user)}
@@ -0,0 +1,86 @@
+import csv
+import io
+import re
+
+from django.contrib.auth import get_user_model
+from django.db.models import Exists, OuterRef
+
+from elearning.caching import bump_versions
+
+from .membership import forget_memberships
+from .models import Course
+from .notifications import forget_unread_counts, notify_users
+from .stats import add_counts
+
+# Bulk enrollment of a list of students by username. The through-table
+# rows go in with one bulk_create, which sends no m2m_changed, so the
+# caches and course stats the enrollment receivers in models.py would have
+# updated are updated here, and the teacher gets one notification for the
+# whole import.
+
+USERNAME_SPLIT_RE = re.compile(r"[\s,;]+")
+
+
+def parse_usernames(text):
+    # Usernames separated by commas, semicolons or whitespace, in order and
+    # without duplicates
+    return list(dict.fromkeys(name for name in USERNAME_SPLIT_RE.split(text) if name))
+
+
+def parse_username_csv(data):
+    # Usernames from the "username" column of a CSV file, or from its first
+    # column when there is no header
+    rows = [row for row in csv.reader(io.StringIO(data.decode('utf-8-sig'))) if row]
+    if not rows:
+        return []
+    header = [cell.strip().lower() for cell in rows[0]]
+    column = 0
+    if 'username' in header:
+        column = header.index('username')
+        rows = rows[1:]
+    return list(dict.fromkeys(row[column].strip() for row in rows if len(row) > column and row[column].strip()))
+
+
+def bulk_enroll(course, usernames):
+    # Enroll every student named in usernames who is not blocked from the
+    # course. Returns a dict of username lists under enrolled,
+    # already_enrolled, blocked, not_students and unknown.
+    Enrollment = Course.enrolled_students.through
+    Block = Course.blocked_students.through
+    users = get_user_model().objects.filter(username__in=usernames).annotate(
+        is_enrolled=Exists(Enrollment.objects.filter(course_id=course.id, customuser_id=OuterRef('pk'))),
+        is_blocked=Exists(Block.objects.filter(course_id=course.id, customuser_id=OuterRef('pk'))),
+    ).values_list('id', 'username', 'role', 'is_enrolled', 'is_blocked')
+
+    result = {'enrolled': [], 'already_enrolled': [], 'blocked': [], 'not_students': [], 'unknown': []}
+    found = set()
+    new_ids = []
+    for user_id, username, role, is_enrolled, is_blocked in users:
+        found.add(username)
+        if role != 'student':
+            result['not_students'].append(username)
+        elif is_blocked:
+            result['blocked'].append(username)
+        elif is_enrolled:
+            result['already_enrolled'].append(username)
+        else:
+            result['enrolled'].append(username)
+            new_ids.append(user_id)
+    result['unknown'] = [username for username in usernames if username not in found]
+
+    if new_ids:
+        Enrollment.objects.bulk_create(
+            [Enrollment(course_id=course.id, customuser_id=user_id) for user_id in new_ids],
+            ignore_conflicts=True,
+        )
+        add_counts(course.id, students=len(new_ids))
+        forget_memberships(new_ids)
+        forget_unread_counts(new_ids)
+        bump_versions('user', new_ids)
+        bump_versions('course', [course.id])
+        count = len(new_ids)
+        notify_users(
+            [course.teacher_id],
+            f"{count} student{'' if count == 1 else 's'} enrolled in {course.title}.",
+        )
+    return result
@@ -1,5 +1,7 @@
 from django import forms
+from django.conf import settings
 
+from .enrollment import parse_username_csv, parse_usernames
 from .models import Course, Feedback, Material
 
 
@@ -17,3 +19,29 @@ class MaterialForm(forms.ModelForm):
     class Meta:
         model = Material
         fields = ['file']
+
+class BulkEnrollForm(forms.Form):
+    usernames = forms.CharField(
+        widget=forms.Textarea, required=False, help_text="Usernames separated by commas or new lines."
+    )
+    csv_file = forms.FileField(
+        required=False, label="CSV file", help_text="A username column, or usernames in the first column."
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        usernames = parse_usernames(cleaned_data.get('usernames') or '')
+        if cleaned_data.get('csv_file'):
+            try:
+                usernames += parse_username_csv(cleaned_data['csv_file'].read())
+            except UnicodeDecodeError:
+                raise forms.ValidationError("The CSV file must be UTF-8 text.")
+        usernames = list(dict.fromkeys(usernames))
+        if not usernames:
+            raise forms.ValidationError("Enter some usernames or upload a CSV file.")
+        if len(usernames) > settings.BULK_ENROLL_MAX_STUDENTS:
+            raise forms.ValidationError(
+                f"At most {settings.BULK_ENROLL_MAX_STUDENTS} students can be enrolled at once."
+            )
+        cleaned_data['student_usernames'] = usernames
+        return cleaned_data
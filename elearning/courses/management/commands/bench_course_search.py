@@ -0,0 +1,115 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from courses.models import Course
+from courses.search import _search_fallback, search_courses
+from elearning.caching import bump_versions
+
+# Every seeded user's username starts with this prefix
+SEED_PREFIX = "coursebench_"
+
+
+def make_vocabulary(rng, size):
+    syllables = [c + v for c in "bdfgklmnprstvz" for v in "aeiou"]
+    return list(dict.fromkeys("".join(rng.choice(syllables) for i in range(rng.randint(2, 4))) for j in range(size)))
+
+
+class Command(BaseCommand):
+    help = (
+        "Times ranked full-text course search against unindexed matching over a synthetic catalog, "
+        "seeded into a temporary test database unless --allow-live-db is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--courses', type=int, default=100000, help="Synthetic courses to create.")
+        parser.add_argument('--queries', type=int, default=50, help="Searches to time with each method.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for the catalog and the queries.")
+        parser.add_argument(
+            '--allow-live-db',
+            action='store_true',
+            help="Seed the configured database instead, where the courses show in the catalog while it runs.",
+        )
+        parser.add_argument(
+            '--keep', action='store_true', help="Keep the seeded teacher and courses (needs --allow-live-db)."
+        )
+
+    def handle(self, *args, **options):
+        if options['keep'] and not options['allow_live_db']:
+            raise CommandError("--keep needs --allow-live-db; the temporary database is always destroyed.")
+        if options['allow_live_db']:
+            self.benchmark(options)
+            return
+        # Build a migrated throwaway database the way the test runner does,
+        # so nothing seeded can reach the real catalog
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.benchmark(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def benchmark(self, options):
+        rng = random.Random(options['seed'])
+        vocabulary = make_vocabulary(rng, 5000)
+        start = time.perf_counter()
+        self.seed(rng, vocabulary, options['courses'])
+        self.stdout.write(f"Seeded {options['courses']} courses in {time.perf_counter() - start:.1f}s")
+        try:
+            queries = [
+                " ".join(rng.choice(vocabulary) for i in range(rng.randint(1, 2)))
+                for j in range(options['queries'])
+            ]
+            for name, search in [("full-text", search_courses), ("icontains", self.unindexed)]:
+                latencies = sorted(self.time_queries(search, queries))
+                self.stdout.write(
+                    f"{name:>9}: p50 {latencies[len(latencies) // 2] * 1000:.2f} ms"
+                    f"  p95 {latencies[int(len(latencies) * 0.95)] * 1000:.2f} ms"
+                    f"  max {latencies[-1] * 1000:.2f} ms"
+                )
+        finally:
+            if not options['keep']:
+                self.cleanup()
+
+    def unindexed(self, query):
+        return _search_fallback(query, 21, 0)
+
+    def time_queries(self, search, queries):
+        for query in queries:
+            start = time.perf_counter()
+            search(query)
+            yield time.perf_counter() - start
+
+    def seed(self, rng, vocabulary, count):
+        User = get_user_model()
+        self.cleanup()
+        teacher = User(username=f"{SEED_PREFIX}teacher", role='teacher')
+        teacher.set_unusable_password()
+        teacher.save()
+        for offset in range(0, count, 1000):
+            Course.objects.bulk_create([
+                Course(
+                    title=" ".join(rng.choices(vocabulary, k=rng.randint(2, 5))).title(),
+                    description=" ".join(rng.choices(vocabulary, k=rng.randint(30, 80))),
+                    teacher=teacher,
+                )
+                for i in range(min(1000, count - offset))
+            ])
+        # bulk_create sends no post_save, so drop the cached catalog here
+        bump_versions('catalog', [0])
+
+    def cleanup(self):
+        User = get_user_model()
+        teacher_ids = list(User.objects.filter(username__startswith=SEED_PREFIX).values_list('id', flat=True))
+        if not teacher_ids:
+            return
+        # The seeded courses have nothing attached, so delete them in one
+        # statement instead of sending delete signals for each of them
+        table = connection.ops.quote_name(Course._meta.db_table)
+        placeholders = ", ".join(["%s"] * len(teacher_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {table} WHERE teacher_id IN ({placeholders})", teacher_ids)
+        User.objects.filter(id__in=teacher_ids).delete()
+        bump_versions('catalog', [0])
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.urls import get_resolver
+
+from elearning.caching import cached_views, get_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = "Reports hits and misses of the per-view response cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Zero the counters after reporting them.")
+
+    def handle(self, *args, **options):
+        # Importing the URLconf imports the views and registers them
+        get_resolver().url_patterns
+        for view_name in cached_views:
+            hits, misses = get_stats(view_name)
+            total = hits + misses
+            rate = f"{hits / total:.1%}" if total else "-"
+            self.stdout.write(f"{view_name:>20}: {hits} hits, {misses} misses, hit rate {rate}")
+            if options['reset']:
+                reset_stats(view_name)
@@ -0,0 +1,78 @@
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+
+from courses.notifications import remove_unread
+
+
+def before_notification_delete(rows):
+    # Keep the unread counters right when unread notifications go
+    counts = dict(
+        rows.filter(is_read=False).order_by().values('user').annotate(n=Count('id')).values_list('user', 'n')
+    )
+    return lambda: remove_unread(counts)
+
+
+# Extra work needed around the delete of a chunk of a model's rows. The
+# hook runs before the delete and returns a callable to run after it.
+HOOKS = {
+    'courses.Notification': before_notification_delete,
+}
+
+
+class Command(BaseCommand):
+    help = "Deletes rows older than their retention period in small primary key chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', help="Only prune this model label, e.g. courses.Notification.")
+        parser.add_argument('--chunk-size', type=int, default=settings.PRUNE_CHUNK_SIZE, help="Primary keys per chunk.")
+        parser.add_argument('--pause', type=float, default=settings.PRUNE_CHUNK_PAUSE, help="Seconds to sleep between chunks.")
+        parser.add_argument('--dry-run', action='store_true', help="Count the rows that would be deleted.")
+
+    def handle(self, *args, **options):
+        policies = settings.PRUNE_RETENTION_DAYS
+        labels = options['model'] or list(policies)
+        for label in labels:
+            if label not in policies:
+                raise CommandError(f"No retention policy for {label}")
+
+        for label in labels:
+            model = apps.get_model(label)
+            cutoff = timezone.now() - timedelta(days=policies[label])
+            start = time.perf_counter()
+            count = self.prune(label, model.objects.filter(created_at__lt=cutoff), options)
+            elapsed = time.perf_counter() - start
+            verb = "would delete" if options['dry_run'] else "deleted"
+            rate = count / elapsed if elapsed else 0
+            self.stdout.write(
+                f"{label}: {verb} {count} rows older than {cutoff:%Y-%m-%d} "
+                f"in {elapsed:.1f}s ({rate:.0f} rows/s)"
+            )
+
+    def prune(self, label, old_rows, options):
+        bounds = old_rows.aggregate(low=Min('pk'), high=Max('pk'))
+        if bounds['low'] is None:
+            return 0
+        hook = HOOKS.get(label)
+        total = 0
+        low = bounds['low']
+        while low <= bounds['high']:
+            # Each chunk is its own short statement and transaction
+            chunk = old_rows.filter(pk__gte=low, pk__lt=low + options['chunk_size'])
+            low += options['chunk_size']
+            if options['dry_run']:
+                total += chunk.count()
+                continue
+            after = hook(chunk) if hook else None
+            deleted, _ = chunk.delete()
+            if after:
+                after()
+            total += deleted
+            if deleted and low <= bounds['high']:
+                time.sleep(options['pause'])
+        return total
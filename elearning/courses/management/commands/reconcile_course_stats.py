@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from courses.models import Course
+from courses.stats import reconcile
+
+
+class Command(BaseCommand):
+    help = "Recomputes every course's dashboard stats from the tables. Meant to run nightly."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report wrong stats without fixing them.")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Courses to recompute per batch.")
+
+    def handle(self, *args, **options):
+        course_ids = list(Course.objects.order_by('id').values_list('id', flat=True))
+        wrong = []
+        for start in range(0, len(course_ids), options['chunk_size']):
+            wrong += reconcile(course_ids[start:start + options['chunk_size']], dry_run=options['dry_run'])
+
+        if options['verbosity'] > 1:
+            for course_id, stored, actual in wrong:
+                self.stdout.write(f"Course {course_id}: stored {stored}, actually {actual}")
+        if options['dry_run']:
+            self.stdout.write(f"{len(wrong)} of {len(course_ids)} courses have wrong stats")
+            return
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {len(wrong)} of {len(course_ids)} courses"))
@@ -0,0 +1,54 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from courses.models import Notification, NotificationState
+from courses.notifications import forget_unread_counts
+
+
+class Command(BaseCommand):
+    help = "Recomputes every user's unread notification counter from the notification table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report wrong counters without fixing them.")
+
+    def handle(self, *args, **options):
+        # Users with unread notifications but no counter yet
+        missing = list(
+            get_user_model().objects.filter(notifications__is_read=False, notification_state__isnull=True)
+            .values_list('id', flat=True).distinct()
+        )
+        if missing:
+            self.stdout.write(f"{len(missing)} users have unread notifications but no counter")
+        if not options['dry_run']:
+            NotificationState.objects.bulk_create(
+                [NotificationState(user_id=user_id) for user_id in missing], ignore_conflicts=True
+            )
+
+        actual = Coalesce(
+            Subquery(
+                Notification.objects.filter(user=OuterRef('user'), is_read=False)
+                .values('user')
+                .annotate(n=Count('id'))
+                .values('n'),
+                output_field=IntegerField(),
+            ),
+            Value(0),
+        )
+        wrong = list(
+            NotificationState.objects.annotate(actual=actual)
+            .exclude(unread_count=F('actual'))
+            .values_list('user_id', 'unread_count', 'actual')
+        )
+        if options['verbosity'] > 1:
+            for user_id, stored, count in wrong:
+                self.stdout.write(f"User {user_id}: counter {stored}, actually {count}")
+        if options['dry_run']:
+            self.stdout.write(f"{len(wrong)} counters are wrong")
+            return
+
+        wrong_ids = [user_id for user_id, _, _ in wrong]
+        NotificationState.objects.filter(user_id__in=wrong_ids).update(unread_count=actual)
+        forget_unread_counts(wrong_ids)
+        self.stdout.write(self.style.SUCCESS(f"Repaired {len(wrong)} counters"))
@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from elearning.caching import shared_timeout
+
+from .models import Course
+
+# Each user's enrolled and blocked course ids are cached as a pair of
+# frozensets, so a membership check is a set lookup instead of a query.
+# Receivers in models.py drop a user's entry whenever enrolled_students or
+# blocked_students changes for them, or one of their courses is deleted.
+
+
+def membership_cache_key(user_id):
+    return f"courses:membership:{user_id}"
+
+
+def get_memberships(user_id):
+    # Return (enrolled course ids, blocked course ids) for a user
+    key = membership_cache_key(user_id)
+    memberships = cache.get(key)
+    if memberships is None:
+        Enrollment = Course.enrolled_students.through
+        Block = Course.blocked_students.through
+        memberships = (
+            frozenset(Enrollment.objects.filter(customuser_id=user_id).values_list('course_id', flat=True)),
+            frozenset(Block.objects.filter(customuser_id=user_id).values_list('course_id', flat=True)),
+        )
+        cache.set(key, memberships, shared_timeout(settings.MEMBERSHIP_CACHE_TIMEOUT))
+    return memberships
+
+
+def enrolled_course_ids(user):
+    return get_memberships(user.pk)[0]
+
+
+def blocked_course_ids(user):
+    return get_memberships(user.pk)[1]
+
+
+def is_enrolled(user, course_id):
+    return course_id in enrolled_course_ids(user)
+
+
+def is_blocked(user, course_id):
+    return course_id in blocked_course_ids(user)
+
+
+def forget_memberships(user_ids):
+    cache.delete_many([membership_cache_key(user_id) for user_id in user_ids])
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0004_notification_user_created_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RenameModel(
+            old_name='NotificationWatermark',
+            new_name='NotificationState',
+        ),
+        migrations.AlterField(
+            model_name='notificationstate',
+            name='user',
+            field=models.OneToOneField(on_delete=models.deletion.CASCADE, related_name='notification_state', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='notificationstate',
+            name='read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='notificationstate',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,75 @@
+from django.db import migrations
+
+# Full-text index over Course.title and Course.description. SQLite gets an
+# external-content FTS5 table kept in sync by triggers; PostgreSQL gets a
+# GIN index on the weighted tsvector of both columns. Other backends fall
+# back to unindexed matching.
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE courses_course_fts USING fts5(
+        title, description, content='courses_course', content_rowid='id', tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER courses_course_fts_insert AFTER INSERT ON courses_course BEGIN
+        INSERT INTO courses_course_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER courses_course_fts_delete AFTER DELETE ON courses_course BEGIN
+        INSERT INTO courses_course_fts(courses_course_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER courses_course_fts_update AFTER UPDATE OF title, description ON courses_course BEGIN
+        INSERT INTO courses_course_fts(courses_course_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO courses_course_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+    "INSERT INTO courses_course_fts(courses_course_fts) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS courses_course_fts_update",
+    "DROP TRIGGER IF EXISTS courses_course_fts_delete",
+    "DROP TRIGGER IF EXISTS courses_course_fts_insert",
+    "DROP TABLE IF EXISTS courses_course_fts",
+]
+
+POSTGRES_FORWARD = [
+    """
+    CREATE INDEX courses_course_search_idx ON courses_course USING GIN ((
+        setweight(to_tsvector('english', COALESCE(title, '')), 'A')
+        || setweight(to_tsvector('english', COALESCE(description, '')), 'B')
+    ))
+    """,
+]
+
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS courses_course_search_idx",
+]
+
+
+def run_statements(sqlite, postgres):
+    def run(apps, schema_editor):
+        statements = {'sqlite': sqlite, 'postgresql': postgres}.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0005_notificationstate'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_statements(SQLITE_FORWARD, POSTGRES_FORWARD),
+            run_statements(SQLITE_REVERSE, POSTGRES_REVERSE),
+        ),
+    ]
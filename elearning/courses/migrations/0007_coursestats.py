@@ -0,0 +1,24 @@
+# Generated by Django 5.1.6 on 2026-10-18 00:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0006_course_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseStats',
+            fields=[
+                ('course', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='courses.course')),
+                ('students', models.PositiveIntegerField(default=0)),
+                ('feedbacks', models.PositiveIntegerField(default=0)),
+                ('materials', models.PositiveIntegerField(default=0)),
+                ('chat_messages', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+# 0005 added NotificationState.unread_count at 0 for everyone, so fill it in
+# from the unread notifications that already exist, creating the state rows
+# of users who had none. Same computation as repair_notification_counts.
+
+
+def backfill_unread_counts(apps, schema_editor):
+    Notification = apps.get_model('courses', 'Notification')
+    NotificationState = apps.get_model('courses', 'NotificationState')
+    user_ids = Notification.objects.filter(is_read=False).values_list('user_id', flat=True).distinct()
+    NotificationState.objects.bulk_create(
+        [NotificationState(user_id=user_id) for user_id in user_ids], ignore_conflicts=True
+    )
+    NotificationState.objects.update(unread_count=Coalesce(
+        Subquery(
+            Notification.objects.filter(user=OuterRef('user'), is_read=False)
+            .values('user')
+            .annotate(n=Count('id'))
+            .values('n'),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0007_coursestats'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_unread_counts, migrations.RunPython.noop),
+    ]
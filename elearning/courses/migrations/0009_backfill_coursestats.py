@@ -0,0 +1,38 @@
+from django.db import migrations
+
+# 0007 created CourseStats without rows for the courses that already
+# existed, and the running counters never create rows, so fill them in
+# with the computation reconcile_course_stats uses, over historical models.
+
+
+def backfill_course_stats(apps, schema_editor):
+    from courses.stats import current_counts
+
+    Course = apps.get_model('courses', 'Course')
+    CourseStats = apps.get_model('courses', 'CourseStats')
+    models = {
+        'students': Course.enrolled_students.through,
+        'feedbacks': apps.get_model('courses', 'Feedback'),
+        'materials': apps.get_model('courses', 'Material'),
+        'chat_messages': apps.get_model('chat', 'ChatMessage'),
+    }
+    course_ids = list(Course.objects.order_by('id').values_list('id', flat=True))
+    for offset in range(0, len(course_ids), 1000):
+        chunk = course_ids[offset:offset + 1000]
+        counts = current_counts(chunk, models)
+        CourseStats.objects.filter(course_id__in=chunk).delete()
+        CourseStats.objects.bulk_create(
+            [CourseStats(course_id=course_id, **fields) for course_id, fields in counts.items()]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0008_backfill_notification_unread_count'),
+        ('chat', '0005_chatmessage_search_index_coalesce'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_course_stats, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,11 @@
 from django.conf import settings
-from django.contrib.auth import get_user_model
 # courses/models.py
 from django.db import models
-from django.db.models.signals import m2m_changed, post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
+from taskqueue.queue import enqueue
+
+from elearning.caching import bump_versions
 
 class Course(models.Model):
     title = models.CharField(max_length=200)
@@ -41,28 +43,208 @@ class Notification(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='courses_notif_user_idx'),
+        ]
+
     def __str__(self):
         return f"Notification for {self.user.username}: {self.message}"
 
-# Notify teacher when a student enrolls in a course
+# Announcement to everyone enrolled in a course. It is written once and
+# merged into each student's notifications when they are read, instead of
+# being copied into a Notification row per student.
+class CourseEvent(models.Model):
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='events')
+    message = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['course', '-created_at'], name='courses_event_course_idx'),
+        ]
+
+    def __str__(self):
+        return f"Event for {self.course.title}: {self.message}"
+
+# Per-user notification state. Course events created after read_at are
+# unread (users without one start at sign-up), and unread_count is a
+# running count of unread direct notifications so the navbar badge needs
+# no COUNT query. `manage.py repair_notification_counts` recomputes it.
+class NotificationState(models.Model):
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='notification_state')
+    read_at = models.DateTimeField(null=True, blank=True)
+    unread_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.unread_count} unread"
+
+# Running counts shown on the teacher dashboard, kept up to date by the
+# receivers below and the chat message buffer so that no page has to
+# COUNT the rows. chat_messages includes archived messages.
+# `manage.py reconcile_course_stats` recomputes them.
+class CourseStats(models.Model):
+    course = models.OneToOneField(Course, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    students = models.PositiveIntegerField(default=0)
+    feedbacks = models.PositiveIntegerField(default=0)
+    materials = models.PositiveIntegerField(default=0)
+    chat_messages = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Stats for course {self.course_id}"
+
+# Notify teacher when a student enrolls in a course. The notifications
+# are written by the task worker so the request returns straight away.
 @receiver(m2m_changed, sender=Course.enrolled_students.through)
-def notify_teacher_on_enrollment(sender, instance, action, pk_set, **kwargs):
-    if action == "post_add":
-        for pk in pk_set:
-            student = get_user_model().objects.get(pk=pk)
-            teacher = instance.teacher
-            Notification.objects.create(
-                user=teacher,
-                message=f"Student {student.username} enrolled in {instance.title}."
-            )
-
-# Notify enrolled students when new material is added
+def notify_teacher_on_enrollment(sender, instance, action, reverse, pk_set, **kwargs):
+    if action != "post_add" or not pk_set:
+        return
+    if reverse:
+        # Added from the student's side, so pk_set holds course ids
+        for course_id in sorted(pk_set):
+            enqueue('courses.notify_teacher_on_enrollment', course_id=course_id, student_ids=[instance.id])
+    else:
+        enqueue('courses.notify_teacher_on_enrollment', course_id=instance.id, student_ids=sorted(pk_set))
+
+# Announce new material to the course's students with a single event row.
+# Pushing it to connected students is left to the task worker.
 @receiver(post_save, sender=Material)
 def notify_students_on_material(sender, instance, created, **kwargs):
     if created:
-        course = instance.course
-        for student in course.enrolled_students.all():
-            Notification.objects.create(
-                user=student,
-                message=f"New material added to {course.title}."
-            )
+        event = CourseEvent.objects.create(
+            course_id=instance.course_id,
+            message=f"New material added to {instance.course.title}.",
+        )
+        enqueue('courses.push_course_event', event_id=event.id)
+
+# Count notifications created one at a time; create_notifications counts
+# its bulk inserts itself
+@receiver(post_save, sender=Notification)
+def count_unread_notification(sender, instance, created, **kwargs):
+    from .notifications import add_unread
+    if created and not instance.is_read:
+        add_unread({instance.user_id: 1})
+
+def changed_member_ids(instance, action, reverse, pk_set, field):
+    # Ids of the users whose membership an m2m_changed signal on `field`
+    # affects, once the change is made
+    if reverse:
+        return [instance.pk] if action in ("post_add", "post_remove", "post_clear") else []
+    if action in ("post_add", "post_remove"):
+        return pk_set or []
+    if action == "pre_clear":
+        return list(getattr(instance, field).values_list('id', flat=True))
+    return []
+
+# Enrollment changes a student's cached memberships and which course events
+# they see, so drop both cached values
+@receiver(m2m_changed, sender=Course.enrolled_students.through)
+def forget_cached_enrollment(sender, instance, action, reverse, pk_set, **kwargs):
+    from .membership import forget_memberships
+    from .notifications import forget_unread_counts
+    user_ids = changed_member_ids(instance, action, reverse, pk_set, 'enrolled_students')
+    if user_ids:
+        forget_memberships(user_ids)
+        forget_unread_counts(user_ids)
+
+@receiver(m2m_changed, sender=Course.blocked_students.through)
+def forget_cached_block(sender, instance, action, reverse, pk_set, **kwargs):
+    from .membership import forget_memberships
+    user_ids = changed_member_ids(instance, action, reverse, pk_set, 'blocked_students')
+    if user_ids:
+        forget_memberships(user_ids)
+
+# Deleting a course removes its memberships without m2m_changed
+@receiver(pre_delete, sender=Course)
+def forget_cached_members(sender, instance, **kwargs):
+    from .membership import forget_memberships
+    from .notifications import forget_unread_counts
+    enrolled = list(instance.enrolled_students.values_list('id', flat=True))
+    blocked = list(instance.blocked_students.values_list('id', flat=True))
+    forget_memberships(enrolled + blocked)
+    forget_unread_counts(enrolled)
+    bump_versions('user', enrolled + blocked)
+
+def changed_course_ids(instance, action, reverse, pk_set, related_name):
+    # Ids of the courses an m2m_changed signal changes, once the change is
+    # made; the counterpart of changed_member_ids
+    if not reverse:
+        return [instance.pk] if action in ("post_add", "post_remove", "post_clear") else []
+    if action in ("post_add", "post_remove"):
+        return pk_set or []
+    if action == "pre_clear":
+        return list(getattr(instance, related_name).values_list('id', flat=True))
+    return []
+
+# Bump the version counters of cached pages (see elearning/caching.py).
+# Memberships show on the course page and on the member's own pages.
+@receiver(m2m_changed, sender=Course.enrolled_students.through)
+@receiver(m2m_changed, sender=Course.blocked_students.through)
+def bump_membership_versions(sender, instance, action, reverse, pk_set, **kwargs):
+    if sender is Course.enrolled_students.through:
+        field, related_name = 'enrolled_students', 'enrolled_courses'
+    else:
+        field, related_name = 'blocked_students', 'blocked_courses'
+    bump_versions('user', changed_member_ids(instance, action, reverse, pk_set, field))
+    bump_versions('course', changed_course_ids(instance, action, reverse, pk_set, related_name))
+
+# A course's details show in the catalog, on its own page and on the
+# profiles of its teacher and students
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def bump_course_versions(sender, instance, **kwargs):
+    bump_versions('catalog', [0])
+    bump_versions('course', [instance.id])
+    user_ids = [instance.teacher_id]
+    # New courses have no students yet, and a deleted course's students
+    # were bumped by forget_cached_members
+    if not kwargs.get('created', True):
+        user_ids += instance.enrolled_students.values_list('id', flat=True)
+    bump_versions('user', user_ids)
+
+@receiver(post_save, sender=Material)
+@receiver(post_delete, sender=Material)
+@receiver(post_save, sender=Feedback)
+@receiver(post_delete, sender=Feedback)
+def bump_course_page_version(sender, instance, **kwargs):
+    bump_versions('course', [instance.course_id])
+
+# Keep CourseStats current, see stats.py
+ITEM_STATS_FIELDS = {Feedback: 'feedbacks', Material: 'materials'}
+
+@receiver(post_save, sender=Course)
+def create_course_stats(sender, instance, created, **kwargs):
+    if created:
+        CourseStats.objects.create(course=instance)
+
+@receiver(m2m_changed, sender=Course.enrolled_students.through)
+def count_enrollment(sender, instance, action, reverse, pk_set, **kwargs):
+    from .stats import add_counts, recount_students
+    if action == "post_add" and pk_set:
+        # pk_set only holds the rows that were actually added
+        if reverse:
+            for course_id in pk_set:
+                add_counts(course_id, students=1)
+        else:
+            add_counts(instance.pk, students=len(pk_set))
+    elif action == "post_remove" and pk_set:
+        # pk_set may name rows that were not there, so count again
+        recount_students(pk_set if reverse else [instance.pk])
+    elif action == "pre_clear" and reverse:
+        for course_id in instance.enrolled_courses.values_list('id', flat=True):
+            add_counts(course_id, students=-1)
+    elif action == "post_clear" and not reverse:
+        CourseStats.objects.filter(course_id=instance.pk).update(students=0)
+
+@receiver(post_save, sender=Feedback)
+@receiver(post_save, sender=Material)
+def count_course_item(sender, instance, created, **kwargs):
+    from .stats import add_counts
+    if created:
+        add_counts(instance.course_id, **{ITEM_STATS_FIELDS[sender]: 1})
+
+@receiver(post_delete, sender=Feedback)
+@receiver(post_delete, sender=Material)
+def uncount_course_item(sender, instance, **kwargs):
+    from .stats import add_counts
+    add_counts(instance.course_id, **{ITEM_STATS_FIELDS[sender]: -1})
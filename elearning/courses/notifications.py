@@ -0,0 +1,242 @@
+import heapq
+import logging
+from collections import Counter, defaultdict
+from itertools import islice
+from operator import attrgetter
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from taskqueue.queue import enqueue
+
+from .models import CourseEvent, Notification, NotificationState
+
+# Direct notification rows are built in memory and written with chunked
+# bulk_create calls, so notifying many users costs a handful of INSERTs
+# rather than one per recipient. Announcements to a whole course are
+# CourseEvent rows instead, merged into each user's list at read time.
+# Either way, the worker tells connected browsers through their per-user
+# channel group so the unread badge updates without a reload, and requests
+# never wait on the channel layer.
+#
+# The badge count comes from NotificationState.unread_count, bumped with
+# F() expressions as rows are created and marked read, plus the user's
+# unread course events. The total is cached per user and dropped whenever
+# either part changes.
+
+logger = logging.getLogger(__name__)
+
+
+def notification_group(user_id):
+    return f"notifications_{user_id}"
+
+
+def push_events(events):
+    # Send (user_id, event) pairs to each user's NotificationConsumer. Only
+    # called from tasks, and best effort: a failed push must not lose the
+    # notification itself.
+    layer = get_channel_layer()
+    if layer is None:
+        return
+
+    async def send_all():
+        for user_id, event in events:
+            await layer.group_send(notification_group(user_id), event)
+
+    try:
+        async_to_sync(send_all)()
+    except Exception:
+        logger.exception("Could not push notification events")
+
+
+def notification_event(message, created_at):
+    return {"type": "notification.push", "message": message, "created_at": created_at.isoformat()}
+
+
+def create_notifications(notifications):
+    # Write an iterable of unsaved Notification objects in batches and
+    # queue one task to push them
+    notifications = iter(notifications)
+    created = []
+    unread = Counter()
+    while True:
+        batch = list(islice(notifications, settings.NOTIFICATION_BATCH_SIZE))
+        if not batch:
+            add_unread(unread)
+            if created:
+                enqueue('courses.push_notifications', notification_ids=created)
+            return len(created)
+        Notification.objects.bulk_create(batch)
+        created.extend(n.id for n in batch)
+        unread.update(n.user_id for n in batch if not n.is_read)
+
+
+def notify_users(user_ids, message):
+    # Send the same message to every user id
+    return create_notifications(Notification(user_id=user_id, message=message) for user_id in user_ids)
+
+
+def add_unread(counts):
+    # Add {user_id: n} to the users' unread counters, with one UPDATE per
+    # distinct n rather than one per user
+    if not counts:
+        return
+    NotificationState.objects.bulk_create(
+        [NotificationState(user_id=user_id) for user_id in counts], ignore_conflicts=True
+    )
+    for n, user_ids in group_by_amount(counts):
+        NotificationState.objects.filter(user_id__in=user_ids).update(unread_count=F('unread_count') + n)
+    forget_unread_counts(counts)
+
+
+def remove_unread(counts):
+    # Take {user_id: n} off the users' unread counters, e.g. when unread
+    # notifications are deleted
+    for n, user_ids in group_by_amount(counts):
+        NotificationState.objects.filter(user_id__in=user_ids).update(
+            unread_count=Greatest(F('unread_count') - n, 0)
+        )
+    forget_unread_counts(counts)
+
+
+def group_by_amount(counts):
+    by_amount = defaultdict(list)
+    for user_id, n in counts.items():
+        by_amount[n].append(user_id)
+    return by_amount.items()
+
+
+def update_state(user, read_at=None, marked=0):
+    # Move the event watermark and/or take marked notifications off the
+    # unread counter, creating the user's state row if needed
+    fields = {}
+    if read_at is not None:
+        fields['read_at'] = read_at
+    if marked:
+        fields['unread_count'] = Greatest(F('unread_count') - marked, 0)
+    if fields and not NotificationState.objects.filter(user=user).update(**fields):
+        NotificationState.objects.create(user=user, read_at=read_at)
+    forget_unread_counts([user.id])
+
+
+def get_read_watermark(user):
+    # Course events after this time are unread; new users start at sign-up
+    read_at = NotificationState.objects.filter(user=user).values_list('read_at', flat=True).first()
+    return read_at or user.date_joined
+
+
+def unread_cache_key(user_id):
+    return f"notifications:unread:{user_id}"
+
+
+def forget_unread_counts(user_ids):
+    cache.delete_many([unread_cache_key(user_id) for user_id in user_ids])
+
+
+# The notifications page is paged newest-first over both tables with a
+# keyset cursor, so each page is a range scan on the (user, created_at) and
+# (course, created_at) indexes. Rows created at the same instant are
+# ordered direct notification first, then by id.
+DIRECT, EVENT = 1, 0
+
+
+def encode_cursor(item):
+    # Build an opaque cursor pointing at a notification or course event
+    return f"{item.created_at.isoformat()}|{item.rank}|{item.id}"
+
+
+def decode_cursor(cursor):
+    # Return (created_at, rank, id) for a cursor, or None if it is malformed
+    try:
+        created_at, rank, item_id = cursor.rsplit("|", 2)
+        created_at = parse_datetime(created_at)
+        rank, item_id = int(rank), int(item_id)
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if created_at is None or rank not in (DIRECT, EVENT):
+        return None
+    return created_at, rank, item_id
+
+
+def older_than(queryset, rank, before):
+    # Keep rows that sort after the cursor in (created_at, rank, id) order
+    created_at, before_rank, before_id = before
+    older = Q(created_at__lt=created_at)
+    if rank == before_rank:
+        older |= Q(created_at=created_at, id__lt=before_id)
+    elif rank < before_rank:
+        older |= Q(created_at=created_at)
+    return queryset.filter(older)
+
+
+def get_notification_page(user, before=None, unread=False, limit=None):
+    # Return one page of the user's direct notifications merged with the
+    # events of the courses they are currently enrolled in, newest first,
+    # along with whether there are older items to load
+    limit = limit or settings.NOTIFICATION_PAGE_SIZE
+    read_at = get_read_watermark(user)
+    direct = Notification.objects.filter(user=user)
+    events = CourseEvent.objects.filter(course__enrolled_students=user)
+    if unread:
+        direct = direct.filter(is_read=False)
+        events = events.filter(created_at__gt=read_at)
+    if before is not None:
+        direct = older_than(direct, DIRECT, before)
+        events = older_than(events, EVENT, before)
+    direct = list(direct.order_by('-created_at', '-id')[:limit + 1])
+    events = list(events.order_by('-created_at', '-id')[:limit + 1])
+    for notification in direct:
+        notification.rank = DIRECT
+    for event in events:
+        event.rank = EVENT
+        event.is_read = event.created_at <= read_at
+    items = list(islice(
+        heapq.merge(direct, events, key=attrgetter('created_at', 'rank', 'id'), reverse=True),
+        limit + 1,
+    ))
+    return items[:limit], len(items) > limit
+
+
+def get_unread_count(user):
+    # Unread direct notifications plus course events past the watermark,
+    # served from the cache when possible
+    key = unread_cache_key(user.id)
+    count = cache.get(key)
+    if count is None:
+        read_at, direct = NotificationState.objects.filter(user=user).values_list(
+            'read_at', 'unread_count'
+        ).first() or (None, 0)
+        events = CourseEvent.objects.filter(
+            course__enrolled_students=user, created_at__gt=read_at or user.date_joined
+        ).count()
+        count = direct + events
+        cache.set(key, count, settings.NOTIFICATION_UNREAD_CACHE_TIMEOUT)
+    return count
+
+
+def mark_all_read(user):
+    # Mark direct notifications read in one UPDATE and move the event
+    # watermark to now
+    marked = Notification.objects.filter(user=user, is_read=False).update(is_read=True)
+    update_state(user, read_at=timezone.now(), marked=marked)
+    # Clear the badge in the user's other open tabs
+    enqueue('courses.push_unread_count', user_id=user.id)
+
+
+def mark_page_read(user, notification_ids, events_until=None):
+    # Mark the direct notifications shown on a page read. Course event read
+    # state is a single watermark, so reading a page moves it up to the
+    # newest event shown, which also covers every older event.
+    marked = Notification.objects.filter(user=user, id__in=notification_ids, is_read=False).update(is_read=True)
+    read_at = None
+    if events_until is not None:
+        events_until = min(events_until, timezone.now())
+        if events_until > get_read_watermark(user):
+            read_at = events_until
+    update_state(user, read_at=read_at, marked=marked)
+    enqueue('courses.push_unread_count', user_id=user.id)
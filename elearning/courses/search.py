@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+
+from elearning.fts import fts5_match_query, search_terms
+
+from .models import Course
+
+# Ranked full-text search over course titles and descriptions, backed by
+# the index created in migration 0006_course_search_index. Title matches
+# weigh more than description matches.
+
+SQLITE_SEARCH = """
+    SELECT c.id, c.title, c.description, u.username AS teacher_username
+    FROM courses_course_fts
+    JOIN courses_course c ON c.id = courses_course_fts.rowid
+    JOIN {users} u ON u.id = c.teacher_id
+    WHERE courses_course_fts MATCH %s
+    ORDER BY bm25(courses_course_fts, 10.0, 1.0), c.id
+    LIMIT %s OFFSET %s
+"""
+
+
+def search_courses(query, page=1, per_page=None):
+    # Return (rows, has_next) for one page of results, best match first
+    per_page = per_page or settings.COURSE_SEARCH_PAGE_SIZE
+    offset = (page - 1) * per_page
+    if not search_terms(query):
+        return [], False
+    if connection.vendor == 'sqlite':
+        rows = _search_sqlite(query, per_page + 1, offset)
+    elif connection.vendor == 'postgresql':
+        rows = _search_postgres(query, per_page + 1, offset)
+    else:
+        rows = _search_fallback(query, per_page + 1, offset)
+    return rows[:per_page], len(rows) > per_page
+
+
+def _search_sqlite(query, limit, offset):
+    users = Course._meta.get_field('teacher').related_model._meta.db_table
+    return [
+        {"id": c.id, "title": c.title, "description": c.description, "teacher_username": c.teacher_username}
+        for c in Course.objects.raw(SQLITE_SEARCH.format(users=users), [fts5_match_query(query), limit, offset])
+    ]
+
+
+def _search_postgres(query, limit, offset):
+    # Matches the weighted tsvector expression index
+    from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+    vector = (
+        SearchVector('title', weight='A', config='english')
+        + SearchVector('description', weight='B', config='english')
+    )
+    search_query = SearchQuery(query, config='english', search_type='websearch')
+    return list(
+        Course.objects.annotate(search=vector)
+        .filter(search=search_query)
+        .annotate(rank=SearchRank(vector, search_query))
+        .order_by('-rank', 'id')
+        .values('id', 'title', 'description', teacher_username=F('teacher__username'))[offset:offset + limit]
+    )
+
+
+def _search_fallback(query, limit, offset):
+    # No full-text index on this backend, so match every term unranked
+    courses = Course.objects.all()
+    for term in search_terms(query):
+        courses = courses.filter(Q(title__icontains=term) | Q(description__icontains=term))
+    return list(
+        courses.order_by('title', 'id')
+        .values('id', 'title', 'description', teacher_username=F('teacher__username'))[offset:offset + limit]
+    )
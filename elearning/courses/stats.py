@@ -0,0 +1,101 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Course, CourseStats, Feedback, Material
+
+# Running per-course counts for the teacher dashboard. Receivers in
+# models.py and the chat message buffer adjust them as rows come and go,
+# and reconcile() recomputes them from the tables. Rows are only created
+# with their course or by reconcile(), never by an adjustment, so a course
+# being deleted cannot get a new row back.
+
+STATS_FIELDS = ['students', 'feedbacks', 'materials', 'chat_messages']
+
+
+def counted_models():
+    # The rows behind each counter, all with a course_id column. The chat
+    # app depends on this one, so its model is reached through the relation.
+    return {
+        'students': Course.enrolled_students.through,
+        'feedbacks': Feedback,
+        'materials': Material,
+        'chat_messages': Course._meta.get_field('chat_messages').related_model,
+    }
+
+
+def add_counts(course_id, **deltas):
+    CourseStats.objects.filter(course_id=course_id).update(
+        **{field: Greatest(F(field) + delta, 0) for field, delta in deltas.items()}
+    )
+
+
+def recount_students(course_ids):
+    Enrollment = Course.enrolled_students.through
+    CourseStats.objects.filter(course_id__in=course_ids).update(students=Coalesce(
+        Subquery(
+            Enrollment.objects.filter(course_id=OuterRef('course_id')).order_by()
+            .values('course_id').annotate(n=Count('*')).values('n'),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    ))
+
+
+def archived_message_counts(course_ids):
+    # Return {course_id: (archived count, (timestamp, id) of the newest
+    # archived message)} for the courses with an archive
+    from chat.archive import archive_index
+
+    archived = {}
+    for course_id in course_ids:
+        blocks = archive_index.get(course_id)
+        if blocks:
+            archived[course_id] = (sum(block["count"] for block in blocks), blocks[-1]["last"])
+    return archived
+
+
+def current_counts(course_ids, models=None):
+    # Return {course_id: {field: count}} computed from the tables, counting
+    # archived chat messages that are still in the table only once. Data
+    # migrations pass their historical models in place of counted_models().
+    models = models or counted_models()
+    counts = {course_id: dict.fromkeys(STATS_FIELDS, 0) for course_id in course_ids}
+    for field, model in models.items():
+        rows = (
+            model.objects.filter(course_id__in=course_ids).order_by()
+            .values('course_id').annotate(n=Count('*')).values_list('course_id', 'n')
+        )
+        for course_id, n in rows:
+            counts[course_id][field] = n
+    ChatMessage = models['chat_messages']
+    for course_id, (archived, (timestamp, message_id)) in archived_message_counts(course_ids).items():
+        duplicates = ChatMessage.objects.filter(course_id=course_id).filter(
+            Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lte=message_id)
+        ).count()
+        counts[course_id]['chat_messages'] += archived - duplicates
+    return counts
+
+
+def reconcile(course_ids, dry_run=False):
+    # Recompute the stats of the given courses, creating missing rows.
+    # Returns [(course_id, stored counts or None, actual counts)] for every
+    # course whose stored counts were wrong.
+    actual = current_counts(course_ids)
+    stored = {
+        row['course_id']: row
+        for row in CourseStats.objects.filter(course_id__in=course_ids).values('course_id', *STATS_FIELDS)
+    }
+    wrong = []
+    for course_id, counts in actual.items():
+        row = stored.get(course_id)
+        if row is None or any(row[field] != counts[field] for field in STATS_FIELDS):
+            wrong.append((course_id, row and {field: row[field] for field in STATS_FIELDS}, counts))
+    if not dry_run and wrong:
+        CourseStats.objects.bulk_create(
+            [CourseStats(course_id=course_id, **counts) for course_id, row, counts in wrong if row is None]
+        )
+        CourseStats.objects.bulk_update(
+            [CourseStats(course_id=course_id, **counts) for course_id, row, counts in wrong if row is not None],
+            STATS_FIELDS,
+        )
+    return wrong
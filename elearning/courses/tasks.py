@@ -0,0 +1,50 @@
+from django.contrib.auth import get_user_model
+from taskqueue.queue import register
+
+from .models import Course, CourseEvent, Notification
+from .notifications import (
+    create_notifications,
+    forget_unread_counts,
+    get_unread_count,
+    notification_event,
+    push_events,
+)
+
+
+@register('courses.notify_teacher_on_enrollment')
+def notify_teacher_on_enrollment(course_id, student_ids):
+    course = Course.objects.only('title', 'teacher_id').get(id=course_id)
+    usernames = get_user_model().objects.filter(pk__in=student_ids).values_list('username', flat=True)
+    create_notifications(
+        Notification(user_id=course.teacher_id, message=f"Student {username} enrolled in {course.title}.")
+        for username in usernames
+    )
+
+
+@register('courses.push_course_event')
+def push_course_event(event_id):
+    event = CourseEvent.objects.filter(id=event_id).first()
+    if event is None:
+        return
+    Enrollment = Course.enrolled_students.through
+    student_ids = list(Enrollment.objects.filter(course_id=event.course_id).values_list('customuser_id', flat=True))
+    forget_unread_counts(student_ids)
+    push = notification_event(event.message, event.created_at)
+    push_events([(student_id, push) for student_id in student_ids])
+
+
+@register('courses.push_notifications')
+def push_notifications(notification_ids):
+    notifications = Notification.objects.filter(id__in=notification_ids).order_by('id')
+    push_events([
+        (user_id, notification_event(message, created_at))
+        for user_id, message, created_at in notifications.values_list('user_id', 'message', 'created_at')
+    ])
+
+
+@register('courses.push_unread_count')
+def push_unread_count(user_id):
+    user = get_user_model().objects.filter(id=user_id).first()
+    if user is None:
+        return
+    push_events([(user_id, {"type": "notification.unread", "count": get_unread_count(user)})])
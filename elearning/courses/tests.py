@@ -1,14 +1,52 @@
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from accounts.models import StatusUpdate
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from taskqueue.models import Task
+from taskqueue.queue import run_pending
+
+from elearning.asgi import application
+from elearning.caching import shared_timeout
+from elearning.testing import TemporaryMediaMixin, TestCase
 
-from .models import Course, Feedback, Material, Notification
+from .catalog import get_catalog_page
+from .context_processors import notifications as notification_context
+from .enrollment import bulk_enroll, parse_username_csv
+from .membership import get_memberships, is_blocked, is_enrolled
+from .models import Course, CourseEvent, CourseStats, Feedback, Material, Notification, NotificationState
+from .notifications import (
+    create_notifications,
+    decode_cursor,
+    encode_cursor,
+    get_notification_page,
+    get_unread_count,
+    mark_all_read,
+    mark_page_read,
+    notify_users,
+)
+from .search import search_courses
+from .tasks import notify_teacher_on_enrollment
 
 User = get_user_model()
 
-class CoursesTests(TestCase):
+class CoursesTests(TemporaryMediaMixin, TestCase):
     def setUp(self):
+        cache.clear()
         # Create teacher and student users
         self.teacher = User.objects.create_user(
             username='teacher1',
@@ -61,7 +99,8 @@ class CoursesTests(TestCase):
         response = self.client.get(reverse('courses:enroll_course', args=[self.course.id]))
         self.assertRedirects(response, reverse('courses:course_detail', args=[self.course.id]))
         self.assertIn(self.student, self.course.enrolled_students.all())
-        # Verify that teacher gets a notification about the new enrollment
+        # Verify that teacher gets a notification once the task has run
+        run_pending()
         notif = Notification.objects.filter(user=self.teacher, message__contains=self.student.username)
         self.assertTrue(notif.exists())
 
@@ -122,3 +161,966 @@ class CoursesTests(TestCase):
         response = self.client.get(reverse('courses:notifications'))
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, "Test notification")
+
+
+@override_settings(NOTIFICATION_BATCH_SIZE=2)
+class NotificationFanOutTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username='teacher1', password='pass123', role='teacher')
+        self.course = Course.objects.create(title='Test Course', description='Test', teacher=self.teacher)
+        self.students = User.objects.bulk_create([
+            User(username=f'student{i}', role='student') for i in range(5)
+        ])
+
+    def test_enrollment_signal_only_enqueues_a_task(self):
+        # One INSERT into the task table, no notifications written yet
+        with CaptureQueriesContext(connection) as ctx:
+            self.course.enrolled_students.add(*self.students)
+        self.assertFalse(any('courses_notification' in q['sql'] for q in ctx.captured_queries))
+        task = Task.objects.get()
+        self.assertEqual(task.name, 'courses.notify_teacher_on_enrollment')
+        self.assertEqual(task.payload['student_ids'], sorted(s.id for s in self.students))
+
+        # The task, then the push task it queues for the notifications
+        self.assertEqual(run_pending(), 2)
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(Notification.objects.filter(user=self.teacher).count(), 5)
+
+    def test_enrollment_notifications_use_one_lookup_and_chunked_inserts(self):
+        # One SELECT of the course, one of usernames, one INSERT per batch of
+        # 2, one upsert and one UPDATE of the teacher's unread counter, then
+        # one push task
+        with self.assertNumQueries(8):
+            notify_teacher_on_enrollment(self.course.id, [s.id for s in self.students])
+        messages = Notification.objects.filter(user=self.teacher).values_list('message', flat=True)
+        self.assertEqual(sorted(messages), [f"Student student{i} enrolled in Test Course." for i in range(5)])
+
+
+class CourseEventTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username='teacher1', password='pass123', role='teacher')
+        self.course = Course.objects.create(title='Test Course', description='Test', teacher=self.teacher)
+        self.other = Course.objects.create(title='Other Course', description='Test', teacher=self.teacher)
+        self.students = User.objects.bulk_create([
+            User(username=f'student{i}', role='student') for i in range(5)
+        ])
+        Enrollment = Course.enrolled_students.through
+        Enrollment.objects.bulk_create([
+            Enrollment(course_id=self.course.id, customuser_id=s.id) for s in self.students
+        ])
+        self.student = self.students[0]
+
+    def add_material(self, course):
+        return Material.objects.create(course=course, file=SimpleUploadedFile("notes.pdf", b"pdf"))
+
+    def test_material_writes_one_event_regardless_of_class_size(self):
+        material = Material(course=self.course, file=SimpleUploadedFile("notes.pdf", b"pdf"))
+        # The material, its count in the course stats, the event and the
+        # push task, however many students are enrolled
+        with self.assertNumQueries(4):
+            material.save()
+        self.assertEqual(CourseEvent.objects.get().message, "New material added to Test Course.")
+        self.assertFalse(Notification.objects.exists())
+
+    def test_events_merge_with_direct_notifications_newest_first(self):
+        self.add_material(self.course)
+        Notification.objects.create(user=self.student, message="Direct")
+        self.add_material(self.other)
+        self.assertEqual(
+            [n.message for n in get_notification_page(self.student)[0]],
+            ["Direct", "New material added to Test Course."],
+        )
+        page, has_older = get_notification_page(self.student, limit=1)
+        self.assertEqual(len(page), 1)
+        self.assertTrue(has_older)
+
+    def test_events_follow_current_enrollments(self):
+        self.add_material(self.course)
+        self.course.enrolled_students.remove(self.student)
+        self.assertEqual(get_notification_page(self.student)[0], [])
+        self.other.enrolled_students.add(self.student)
+        self.add_material(self.other)
+        self.assertEqual(
+            [n.message for n in get_notification_page(self.student)[0]], ["New material added to Other Course."]
+        )
+
+    def test_watermark_marks_events_read(self):
+        self.add_material(self.course)
+        Notification.objects.create(user=self.student, message="Direct")
+        self.assertEqual([n.is_read for n in get_notification_page(self.student)[0]], [False, False])
+        mark_all_read(self.student)
+        self.assertEqual([n.is_read for n in get_notification_page(self.student)[0]], [True, True])
+        # Other students still see the event as unread
+        self.assertFalse(get_notification_page(self.students[1])[0][0].is_read)
+        self.add_material(self.course)
+        self.assertEqual([n.is_read for n in get_notification_page(self.student)[0]], [False, True, True])
+
+    def test_notifications_view_shows_events_and_marks_read(self):
+        self.student.set_password('pass123')
+        self.student.save()
+        self.add_material(self.course)
+        self.client.login(username='student0', password='pass123')
+        response = self.client.get(reverse('courses:notifications'))
+        self.assertContains(response, "<strong>New material added to Test Course.</strong>", html=True)
+        response = self.client.post(reverse('courses:mark_notifications_read'))
+        self.assertRedirects(response, reverse('courses:notifications'))
+        response = self.client.get(reverse('courses:notifications'))
+        self.assertContains(response, "New material added to Test Course.")
+        self.assertNotContains(response, "<strong>New material")
+
+
+class NotificationConsumerTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username='teacher1', password='pass123', role='teacher')
+        self.student = User.objects.create_user(username='student1', password='pass123', role='student')
+        self.course = Course.objects.create(title='Test Course', description='Test', teacher=self.teacher)
+        Course.enrolled_students.through.objects.create(course_id=self.course.id, customuser_id=self.student.id)
+        Notification.objects.create(user=self.student, message="Old news")
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(application, "/ws/notifications/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_connect_sends_unread_count(self):
+        communicator = await self.connect(self.student)
+        self.assertEqual(await communicator.receive_json_from(), {"type": "unread", "count": 1})
+        await communicator.disconnect()
+
+    async def test_anonymous_users_are_rejected(self):
+        communicator = WebsocketCommunicator(application, "/ws/notifications/")
+        communicator.scope["user"] = AnonymousUser()
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+    async def test_direct_notifications_are_pushed_to_the_user_only(self):
+        student = await self.connect(self.student)
+        teacher = await self.connect(self.teacher)
+        await student.receive_json_from()
+        await teacher.receive_json_from()
+        await sync_to_async(notify_users)([self.student.id], "You have been removed from Test Course.")
+        # Nothing is pushed from the request itself
+        self.assertTrue(await student.receive_nothing())
+        await sync_to_async(run_pending)()
+        response = await student.receive_json_from()
+        self.assertEqual(response["type"], "notification")
+        self.assertEqual(response["message"], "You have been removed from Test Course.")
+        self.assertTrue(await teacher.receive_nothing())
+        await student.disconnect()
+        await teacher.disconnect()
+
+    async def test_course_events_are_pushed_by_the_worker(self):
+        communicator = await self.connect(self.student)
+        await communicator.receive_json_from()
+        await sync_to_async(Material.objects.create)(
+            course=self.course, file=SimpleUploadedFile("notes.pdf", b"pdf")
+        )
+        # Nothing is pushed from the request itself
+        self.assertTrue(await communicator.receive_nothing())
+        await sync_to_async(run_pending)()
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["message"], "New material added to Test Course.")
+        self.assertEqual(await sync_to_async(get_unread_count)(self.student), 2)
+        await communicator.disconnect()
+
+    async def test_mark_all_read_resets_open_badges(self):
+        communicator = await self.connect(self.student)
+        await communicator.receive_json_from()
+        await sync_to_async(mark_all_read)(self.student)
+        await sync_to_async(run_pending)()
+        self.assertEqual(await communicator.receive_json_from(), {"type": "unread", "count": 0})
+        await communicator.disconnect()
+
+
+class NotificationPageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username='teacher1', password='pass123', role='teacher')
+        self.student = User.objects.create_user(username='student1', password='pass123', role='student')
+        self.course = Course.objects.create(title='Test Course', description='Test', teacher=self.teacher)
+        Course.enrolled_students.through.objects.create(course_id=self.course.id, customuser_id=self.student.id)
+        # Interleave direct notifications and course events, a minute apart,
+        # with one tie between the two tables
+        start = timezone.now() - timedelta(hours=1)
+        User.objects.filter(id=self.student.id).update(date_joined=start - timedelta(days=1))
+        self.student.refresh_from_db()
+        create_notifications(Notification(user=self.student, message=f"direct {i}") for i in range(5))
+        CourseEvent.objects.bulk_create([
+            CourseEvent(course=self.course, message=f"event {i}") for i in range(4)
+        ])
+        for i, n in enumerate(Notification.objects.order_by('id')):
+            Notification.objects.filter(id=n.id).update(created_at=start + timedelta(minutes=2 * i))
+        for i, e in enumerate(CourseEvent.objects.order_by('id')):
+            CourseEvent.objects.filter(id=e.id).update(created_at=start + timedelta(minutes=2 * i + 1))
+        CourseEvent.objects.filter(message="event 3").update(created_at=start + timedelta(minutes=8))
+        self.client.login(username='student1', password='pass123')
+
+    def read_all_pages(self, **kwargs):
+        messages, before = [], None
+        while True:
+            page, has_older = get_notification_page(self.student, before=before, limit=2, **kwargs)
+            messages.extend(n.message for n in page)
+            if not has_older:
+                return messages
+            before = decode_cursor(encode_cursor(page[-1]))
+
+    def test_keyset_pages_cover_every_item_once(self):
+        self.assertEqual(self.read_all_pages(), [
+            "direct 4", "event 3", "direct 3", "event 2", "direct 2",
+            "event 1", "direct 1", "event 0", "direct 0",
+        ])
+
+    def test_page_costs_constant_queries(self):
+        before = decode_cursor(encode_cursor(get_notification_page(self.student, limit=3)[0][-1]))
+        # Watermark, direct notifications and events
+        with self.assertNumQueries(3):
+            get_notification_page(self.student, before=before, limit=3)
+
+    def test_unread_filter(self):
+        Notification.objects.filter(message__in=["direct 4", "direct 1"]).update(is_read=True)
+        mark_page_read(self.student, [], CourseEvent.objects.get(message="event 1").created_at)
+        self.assertEqual(self.read_all_pages(unread=True), [
+            "event 3", "direct 3", "event 2", "direct 2", "direct 0",
+        ])
+
+    def test_malformed_cursor_is_ignored(self):
+        for cursor in [None, "", "nonsense", "2025-01-01T00:00:00|7|1", "x|1|1"]:
+            self.assertIsNone(decode_cursor(cursor))
+        response = self.client.get(reverse('courses:notifications'), {'before': 'nonsense'})
+        self.assertContains(response, "direct 4")
+
+    def test_view_paginates_and_filters(self):
+        with override_settings(NOTIFICATION_PAGE_SIZE=3):
+            response = self.client.get(reverse('courses:notifications'))
+            self.assertContains(response, "direct 3")
+            self.assertNotContains(response, "event 2")
+            response = self.client.get(reverse('courses:notifications'), {'before': response.context['older_cursor']})
+            self.assertContains(response, "event 2")
+            self.assertNotContains(response, "direct 3")
+        Notification.objects.filter(user=self.student).update(is_read=True)
+        response = self.client.get(reverse('courses:notifications'), {'unread': '1'})
+        self.assertContains(response, "event 0")
+        self.assertNotContains(response, "direct")
+
+    def test_mark_all_read_is_one_update(self):
+        # One UPDATE of notifications, one of the user's state and the
+        # queued badge push
+        with self.assertNumQueries(3):
+            mark_all_read(self.student)
+        self.assertEqual(get_unread_count(self.student), 0)
+
+    @override_settings(NOTIFICATION_PAGE_SIZE=4)
+    def test_mark_page_read(self):
+        response = self.client.get(reverse('courses:notifications'))
+        self.assertEqual(response.context['page_notification_ids'], list(
+            Notification.objects.filter(message__in=["direct 4", "direct 3"]).order_by('-id').values_list('id', flat=True)
+        ))
+        next_url = reverse('courses:notifications') + '?unread=1'
+        response = self.client.post(reverse('courses:mark_notifications_page_read'), {
+            'notification': response.context['page_notification_ids'],
+            'events_until': response.context['page_events_until'],
+            'next': next_url,
+        })
+        self.assertRedirects(response, next_url)
+        self.assertEqual(
+            sorted(Notification.objects.filter(is_read=False).values_list('message', flat=True)),
+            ["direct 0", "direct 1", "direct 2"],
+        )
+        # Every event up to the newest one shown is now read
+        self.assertEqual(get_unread_count(self.student), 3)
+
+    def test_mark_page_read_accepts_naive_events_until(self):
+        # A timestamp without an offset is read in the current time zone
+        naive = timezone.make_naive(timezone.now() + timedelta(days=1)).isoformat()
+        response = self.client.post(reverse('courses:mark_notifications_page_read'), {'events_until': naive})
+        self.assertRedirects(response, reverse('courses:notifications'))
+        # Every event is read, the direct notifications are not
+        self.assertEqual(get_unread_count(self.student), 5)
+
+    def test_mark_page_read_ignores_other_users_and_external_redirects(self):
+        other = Notification.objects.create(user=self.teacher, message="teacher only")
+        response = self.client.post(reverse('courses:mark_notifications_page_read'), {
+            'notification': [other.id],
+            'next': 'https://example.com/',
+        })
+        self.assertRedirects(response, reverse('courses:notifications'))
+        other.refresh_from_db()
+        self.assertFalse(other.is_read)
+
+
+class UnreadCounterTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username='teacher1', password='pass123', role='teacher')
+        self.student = User.objects.create_user(username='student1', password='pass123', role='student')
+        self.course = Course.objects.create(title='Test Course', description='Test', teacher=self.teacher)
+
+    def counter(self, user):
+        return NotificationState.objects.get(user=user).unread_count
+
+    def test_counter_follows_creates_and_reads(self):
+        notify_users([self.student.id, self.teacher.id], "Hello")
+        Notification.objects.create(user=self.student, message="One more")
+        self.assertEqual(self.counter(self.student), 2)
+        self.assertEqual(self.counter(self.teacher), 1)
+        mark_page_read(self.student, [Notification.objects.get(message="One more").id])
+        self.assertEqual(self.counter(self.student), 1)
+        mark_all_read(self.student)
+        self.assertEqual(self.counter(self.student), 0)
+        self.assertEqual(self.counter(self.teacher), 1)
+
+    def test_counter_is_bumped_once_per_user_per_call(self):
+        students = User.objects.bulk_create([User(username=f'pupil{i}', role='student') for i in range(5)])
+        # Five INSERTs of notifications, one upsert of the state rows, a
+        # single UPDATE since every student gets one notification and one
+        # push task
+        with self.settings(NOTIFICATION_BATCH_SIZE=1), self.assertNumQueries(8):
+            notify_users([s.id for s in students], "Hello")
+        self.assertEqual(
+            list(NotificationState.objects.filter(user__in=students).values_list('unread_count', flat=True)),
+            [1] * 5,
+        )
+
+    def test_cached_count_is_dropped_on_change(self):
+        self.assertEqual(get_unread_count(self.student), 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_unread_count(self.student), 0)
+        notify_users([self.student.id], "Hello")
+        self.assertEqual(get_unread_count(self.student), 1)
+        # Enrolling shows the course's events
+        Material.objects.create(course=self.course, file=SimpleUploadedFile("notes.pdf", b"pdf"))
+        self.course.enrolled_students.add(self.student)
+        self.assertEqual(get_unread_count(self.student), 2)
+        mark_all_read(self.student)
+        self.assertEqual(get_unread_count(self.student), 0)
+
+    def test_context_processor_costs_no_query_when_cached(self):
+        notify_users([self.student.id], "Hello")
+        self.client.login(username='student1', password='pass123')
+        response = self.client.get(reverse('courses:course_list'))
+        self.assertEqual(response.context['unread_notification_count'], 1)
+        self.assertContains(response, '<span id="notification-badge" class="badge">1</span>', html=True)
+        request = response.wsgi_request
+        with self.assertNumQueries(0):
+            self.assertEqual(notification_context(request), {'unread_notification_count': 1})
+
+    def test_repair_command_recomputes_counters(self):
+        notify_users([self.student.id], "Hello")
+        # Rows written behind the counter's back
+        Notification.objects.bulk_create([Notification(user=self.teacher, message="Hi") for i in range(3)])
+        Notification.objects.filter(user=self.student).update(is_read=True)
+        out = StringIO()
+        call_command('repair_notification_counts', dry_run=True, stdout=out)
+        self.assertIn("1 users have unread notifications but no counter", out.getvalue())
+        self.assertIn("1 counters are wrong", out.getvalue())
+        self.assertEqual(self.counter(self.student), 1)
+
+        call_command('repair_notification_counts', stdout=StringIO())
+        self.assertEqual(self.counter(self.student), 0)
+        self.assertEqual(self.counter(self.teacher), 3)
+        self.assertEqual(get_unread_count(self.teacher), 3)
+
+
+@override_settings(PRUNE_CHUNK_PAUSE=0)
+class PruneCommandTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username='teacher1', password='pass123', role='teacher')
+        self.student = User.objects.create_user(username='student1', password='pass123', role='student')
+        self.course = Course.objects.create(title='Test Course', description='Test', teacher=self.teacher)
+        now = timezone.now()
+        notify_users([self.student.id] * 7, "Old")
+        notify_users([self.student.id] * 2, "New")
+        Notification.objects.filter(message="Old").update(created_at=now - timedelta(days=200))
+        read_ids = Notification.objects.filter(message="Old").values_list('id', flat=True)[:3]
+        Notification.objects.filter(id__in=list(read_ids)).update(is_read=True)
+        NotificationState.objects.filter(user=self.student).update(unread_count=6)
+        StatusUpdate.objects.bulk_create([StatusUpdate(user=self.student, content=str(i)) for i in range(5)])
+        StatusUpdate.objects.filter(content__in=["0", "1"]).update(created_at=now - timedelta(days=400))
+
+    def prune(self, *args, **kwargs):
+        out = StringIO()
+        call_command('prune', *args, stdout=out, **kwargs)
+        return out.getvalue()
+
+    def test_dry_run_counts_without_deleting(self):
+        out = self.prune(dry_run=True)
+        self.assertIn("courses.Notification: would delete 7 rows", out)
+        self.assertIn("accounts.StatusUpdate: would delete 2 rows", out)
+        self.assertIn("rows/s", out)
+        self.assertEqual(Notification.objects.count(), 9)
+        self.assertEqual(StatusUpdate.objects.count(), 5)
+
+    def test_prune_deletes_old_rows_in_chunks(self):
+        old_ids = list(Notification.objects.filter(message="Old").values_list('id', flat=True))
+        with CaptureQueriesContext(connection) as ctx:
+            out = self.prune(model=['courses.Notification'], chunk_size=3)
+        deletes = [q for q in ctx.captured_queries if q['sql'].startswith('DELETE')]
+        self.assertEqual(len(deletes), -(-(max(old_ids) - min(old_ids) + 1) // 3))
+        self.assertIn("courses.Notification: deleted 7 rows", out)
+        self.assertEqual(list(Notification.objects.values_list('message', flat=True)), ["New", "New"])
+        self.assertEqual(StatusUpdate.objects.count(), 5)
+        # The four unread old notifications came off the counter
+        self.assertEqual(NotificationState.objects.get(user=self.student).unread_count, 2)
+
+    def test_prune_all_policies(self):
+        self.prune()
+        self.assertEqual(Notification.objects.count(), 2)
+        self.assertEqual(list(StatusUpdate.objects.order_by('id').values_list('content', flat=True)), ["2", "3", "4"])
+
+    def test_unknown_model_is_rejected(self):
+        with self.assertRaises(CommandError):
+            self.prune(model=['courses.Course'])
+
+
+class CourseViewQueryTests(TemporaryMediaMixin, TestCase):
+    # Query budgets for every view in courses/views.py. Each request pays
+    # one query for the session and one for the user.
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username='teacher1', password='pass123', role='teacher')
+        self.student = User.objects.create_user(username='student1', password='pass123', role='student')
+        self.outsider = User.objects.create_user(username='student2', password='pass123', role='student')
+        self.course = Course.objects.create(title='Test Course', description='Test', teacher=self.teacher)
+        self.course.enrolled_students.add(self.student)
+        Feedback.objects.create(course=self.course, student=self.student, comment="Great")
+        run_pending()
+
+    def assertQueries(self, num, user, method, url, data=None):
+        self.client.force_login(user)
+        # Warm the cached unread count and memberships
+        get_unread_count(user)
+        get_memberships(user.id)
+        with self.assertNumQueries(num):
+            return getattr(self.client, method)(url, data or {})
+
+    def add_class(self, size):
+        students = User.objects.bulk_create([
+            User(username=f'extra{self.course.id}_{i}', role='student') for i in range(size)
+        ])
+        Course.enrolled_students.through.objects.bulk_create([
+            Course.enrolled_students.through(course_id=self.course.id, customuser_id=s.id) for s in students
+        ])
+        Course.blocked_students.through.objects.bulk_create([
+            Course.blocked_students.through(course_id=self.course.id, customuser_id=s.id) for s in students[:size // 2]
+        ])
+        Feedback.objects.bulk_create([Feedback(course=self.course, student=s, comment="Hi") for s in students])
+        for i in range(size // 5):
+            Material.objects.create(course=self.course, file=SimpleUploadedFile("notes.pdf", b"pdf"))
+
+    def test_course_list(self):
+        # The page count and the page itself, then nothing once the page
+        # is cached
+        url = reverse('courses:course_list')
+        for user in (self.student, self.teacher):
+            self.assertQueries(4, user, 'get', url)
+            self.assertQueries(2, user, 'get', url)
+
+    def test_course_detail_is_constant_in_class_size(self):
+        url = reverse('courses:course_detail', args=[self.course.id])
+        # Course and teacher, materials and feedback with their students,
+        # plus the student and ban lists for the teacher. Membership comes
+        # from the cache.
+        budgets = [(self.teacher, 7), (self.student, 5), (self.outsider, 4)]
+        for user, num in budgets:
+            self.assertQueries(num, user, 'get', url)
+        self.add_class(30)
+        for user, num in budgets:
+            response = self.assertQueries(num, user, 'get', url)
+        self.assertContains(response, "extra")
+
+    def test_course_detail_membership_flags(self):
+        url = reverse('courses:course_detail', args=[self.course.id])
+        self.client.force_login(self.outsider)
+        response = self.client.get(url)
+        self.assertFalse(response.context['is_enrolled'])
+        self.assertContains(response, "Enroll in this Course")
+        self.assertNotContains(response, "Go to Course Chat Room")
+        self.client.force_login(self.teacher)
+        response = self.client.get(url)
+        self.assertTrue(response.context['is_teacher'])
+        self.assertContains(response, "Go to Course Chat Room")
+        self.assertContains(response, "Upload Material")
+
+    def test_add_course(self):
+        self.assertQueries(2, self.teacher, 'get', reverse('courses:add_course'))
+        # The course and its stats row
+        self.assertQueries(4, self.teacher, 'post', reverse('courses:add_course'), {'title': 'New', 'description': 'New'})
+
+    def test_enroll_course(self):
+        # Course, existing enrollment check, insert, student count, queued
+        # notification task
+        self.assertQueries(7, self.outsider, 'get', reverse('courses:enroll_course', args=[self.course.id]))
+
+    def test_add_feedback(self):
+        url = reverse('courses:add_feedback', args=[self.course.id])
+        self.assertQueries(3, self.student, 'get', url)
+        self.assertQueries(5, self.student, 'post', url, {'comment': 'Good'})
+
+    def test_upload_material(self):
+        url = reverse('courses:upload_material', args=[self.course.id])
+        self.assertQueries(3, self.teacher, 'get', url)
+        self.add_class(30)
+        # Material, its count, course event and queued push task, whatever
+        # the class size
+        self.assertQueries(7, self.teacher, 'post', url, {'file': SimpleUploadedFile("notes.pdf", b"pdf")})
+
+    def test_notifications(self):
+        url = reverse('courses:notifications')
+        self.assertQueries(5, self.student, 'get', url)
+        notify_users([self.student.id] * 60, "Hello")
+        self.assertQueries(5, self.student, 'get', url)
+        # One UPDATE of notifications, one of the user's state and the
+        # queued badge push
+        self.assertQueries(5, self.student, 'post', reverse('courses:mark_notifications_read'))
+        # Already read, so only the UPDATE and the queued badge push
+        ids = list(Notification.objects.values_list('id', flat=True)[:25])
+        self.assertQueries(4, self.student, 'post', reverse('courses:mark_notifications_page_read'), {'notification': ids})
+
+    def test_remove_block_and_unblock_student(self):
+        self.add_class(30)
+        remove = reverse('courses:remove_student', args=[self.course.id, self.student.id])
+        block = reverse('courses:block_student', args=[self.course.id, self.outsider.id])
+        unblock = reverse('courses:unblock_student', args=[self.course.id, self.outsider.id])
+        self.assertQueries(10, self.teacher, 'get', remove)
+        # Adding the ban looks up missing rows first because membership
+        # receivers listen to the change, and removing the enrollment
+        # recounts the course's students
+        self.assertQueries(12, self.teacher, 'get', block)
+        self.assertQueries(5, self.teacher, 'get', unblock)
+
+
+class MembershipTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username='teacher1', password='pass123', role='teacher')
+        self.student = User.objects.create_user(username='student1', password='pass123', role='student')
+        self.course = Course.objects.create(title='Test Course', description='Test', teacher=self.teacher)
+        self.other = Course.objects.create(title='Other Course', description='Test', teacher=self.teacher)
+
+    def test_membership_checks_are_cached(self):
+        self.course.enrolled_students.add(self.student)
+        self.assertEqual(get_memberships(self.student.id), (frozenset([self.course.id]), frozenset()))
+        with self.assertNumQueries(0):
+            self.assertTrue(is_enrolled(self.student, self.course.id))
+            self.assertFalse(is_enrolled(self.student, self.other.id))
+            self.assertFalse(is_blocked(self.student, self.course.id))
+
+    def test_enrollment_changes_invalidate(self):
+        self.assertFalse(is_enrolled(self.student, self.course.id))
+        self.course.enrolled_students.add(self.student)
+        self.assertTrue(is_enrolled(self.student, self.course.id))
+        self.course.enrolled_students.remove(self.student)
+        self.assertFalse(is_enrolled(self.student, self.course.id))
+        # From the student's side of the relation
+        self.student.enrolled_courses.add(self.other)
+        self.assertTrue(is_enrolled(self.student, self.other.id))
+        run_pending()
+        self.assertTrue(Notification.objects.filter(user=self.teacher, message__contains="Other Course").exists())
+        self.other.enrolled_students.clear()
+        self.assertFalse(is_enrolled(self.student, self.other.id))
+        self.student.enrolled_courses.set([self.course])
+        self.assertTrue(is_enrolled(self.student, self.course.id))
+
+    def test_block_changes_invalidate(self):
+        self.assertFalse(is_blocked(self.student, self.course.id))
+        self.course.blocked_students.add(self.student)
+        self.assertTrue(is_blocked(self.student, self.course.id))
+        self.student.blocked_courses.clear()
+        self.assertFalse(is_blocked(self.student, self.course.id))
+
+    def test_deleting_a_course_invalidates(self):
+        self.course.enrolled_students.add(self.student)
+        self.assertTrue(is_enrolled(self.student, self.course.id))
+        course_id = self.course.id
+        self.course.delete()
+        self.assertFalse(is_enrolled(self.student, course_id))
+
+    @override_settings(UNSHARED_CACHE_TIMEOUT=0)
+    def test_locmem_entries_expire_for_changes_from_other_processes(self):
+        self.course.enrolled_students.add(self.student)
+        self.assertTrue(is_enrolled(self.student, self.course.id))
+        # Another process removing the student does not reach this cache
+        Course.enrolled_students.through.objects.filter(customuser=self.student).delete()
+        self.assertFalse(is_enrolled(self.student, self.course.id))
+
+    def test_shared_cache_keeps_the_full_timeout(self):
+        self.assertEqual(shared_timeout(3600), settings.UNSHARED_CACHE_TIMEOUT)
+        redis_cache = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}
+        with override_settings(CACHES=redis_cache):
+            self.assertEqual(shared_timeout(3600), 3600)
+
+    def test_course_list_uses_memberships(self):
+        self.course.enrolled_students.add(self.student)
+        self.other.blocked_students.add(self.student)
+        self.client.login(username='student1', password='pass123')
+        response = self.client.get(reverse('courses:course_list'))
+        self.assertEqual([course_id for course_id, html in response.context['rows']], [self.course.id])
+        self.assertContains(response, "(enrolled)")
+
+
+@override_settings(COURSE_CATALOG_PAGE_SIZE=2)
+class CatalogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username='teacher1', password='pass123', role='teacher')
+        self.student = User.objects.create_user(username='student1', password='pass123', role='student')
+        for title in ['Biology', 'Algebra', 'Chemistry', 'Advanced Algebra']:
+            Course.objects.create(title=title, description='Test', teacher=self.teacher)
+        self.client.login(username='student1', password='pass123')
+
+    def titles(self, **params):
+        response = self.client.get(reverse('courses:course_list'), params)
+        self.assertEqual(response.status_code, 200)
+        return [html.split('>')[1].split('<')[0] for course_id, html in response.context['rows']]
+
+    def test_pages_and_order(self):
+        self.assertEqual(self.titles(), ['Advanced Algebra', 'Algebra'])
+        self.assertEqual(self.titles(page=2), ['Biology', 'Chemistry'])
+        self.assertEqual(self.titles(page=99), ['Biology', 'Chemistry'])
+        self.assertEqual(self.titles(page='x'), ['Advanced Algebra', 'Algebra'])
+        self.assertEqual(self.titles(order='newest'), ['Advanced Algebra', 'Chemistry'])
+        self.assertEqual(self.titles(order='bogus'), ['Advanced Algebra', 'Algebra'])
+        response = self.client.get(reverse('courses:course_list'))
+        self.assertContains(response, 'Page 1 of 2')
+        self.assertContains(response, '?order=title&page=2')
+
+    def test_pages_are_cached_until_courses_change(self):
+        self.assertEqual(self.titles(), ['Advanced Algebra', 'Algebra'])
+        with self.assertNumQueries(0):
+            self.assertEqual(len(get_catalog_page('student')['rows']), 2)
+        course = Course.objects.create(title='Anatomy', description='Test', teacher=self.teacher)
+        self.assertEqual(self.titles(), ['Advanced Algebra', 'Algebra'])
+        course.title = 'Aardvarks'
+        course.save()
+        self.assertEqual(self.titles(), ['Aardvarks', 'Advanced Algebra'])
+        course.delete()
+        self.assertEqual(self.titles(), ['Advanced Algebra', 'Algebra'])
+
+    def test_blocked_courses_are_dropped_from_cached_pages(self):
+        self.assertEqual(self.titles(), ['Advanced Algebra', 'Algebra'])
+        Course.objects.get(title='Algebra').blocked_students.add(self.student)
+        self.assertEqual(self.titles(), ['Advanced Algebra'])
+        # Teachers never have rows dropped
+        self.client.login(username='teacher1', password='pass123')
+        self.assertEqual(self.titles(), ['Advanced Algebra', 'Algebra'])
+
+
+class ResponseCacheTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username='teacher1', password='pass123', role='teacher')
+        self.student = User.objects.create_user(username='student1', password='pass123', role='student')
+        self.course = Course.objects.create(title='Test Course', description='Test', teacher=self.teacher)
+        self.course.enrolled_students.add(self.student)
+        run_pending()
+        self.url = reverse('courses:course_detail', args=[self.course.id])
+        self.client.login(username='student1', password='pass123')
+
+    def outcome(self, url=None):
+        response = self.client.get(url or self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.get('X-Cache')
+
+    def test_course_page_is_cached_until_it_changes(self):
+        self.assertEqual(self.outcome(), 'miss')
+        self.assertEqual(self.outcome(), 'hit')
+        Feedback.objects.create(course=self.course, student=self.student, comment="Great")
+        self.assertEqual(self.outcome(), 'miss')
+        Material.objects.create(course=self.course, file=SimpleUploadedFile("notes.pdf", b"pdf"))
+        self.assertEqual(self.outcome(), 'miss')
+        self.course.blocked_students.add(User.objects.create_user(username='student2', role='student'))
+        self.assertEqual(self.outcome(), 'miss')
+        self.assertEqual(self.outcome(), 'hit')
+        # Changes to other courses leave it cached
+        Course.objects.create(title='Other Course', description='Test', teacher=self.teacher)
+        self.assertEqual(self.outcome(), 'hit')
+
+    def test_pages_are_cached_per_user(self):
+        self.assertEqual(self.outcome(), 'miss')
+        self.client.login(username='teacher1', password='pass123')
+        self.assertEqual(self.outcome(), 'miss')
+        self.assertEqual(self.outcome(), 'hit')
+        # The student's enrollment changes their page and the teacher's
+        self.student.enrolled_courses.remove(self.course)
+        self.assertEqual(self.outcome(), 'miss')
+        self.client.login(username='student1', password='pass123')
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'miss')
+        self.assertContains(response, reverse('courses:enroll_course', args=[self.course.id]))
+
+    def test_course_list_follows_course_changes(self):
+        url = reverse('courses:course_list')
+        self.assertEqual(self.outcome(url), 'miss')
+        self.assertEqual(self.outcome(url), 'hit')
+        self.course.title = 'Renamed Course'
+        self.course.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'miss')
+        self.assertContains(response, 'Renamed Course')
+
+    def test_unread_count_is_part_of_the_key(self):
+        self.assertEqual(self.outcome(), 'miss')
+        notify_users([self.student.id], "Hello")
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'miss')
+        self.assertContains(response, '<span id="notification-badge" class="badge">1</span>', html=True)
+
+    def test_pages_with_flash_messages_are_not_cached(self):
+        self.client.login(username='teacher1', password='pass123')
+        student = User.objects.create_user(username='student2', role='student')
+        self.course.enrolled_students.add(student)
+        self.outcome()
+        response = self.client.get(
+            reverse('courses:block_student', args=[self.course.id, student.id]), follow=True
+        )
+        self.assertIsNone(response.get('X-Cache'))
+        self.assertContains(response, 'student2')
+
+    def test_cache_stats_command(self):
+        self.outcome()
+        self.outcome()
+        out = StringIO()
+        call_command('cache_stats', '--reset', stdout=out)
+        self.assertIn('course_detail: 1 hits, 1 misses, hit rate 50.0%', out.getvalue())
+        self.assertIn('public_profile: 0 hits, 0 misses, hit rate -', out.getvalue())
+        out = StringIO()
+        call_command('cache_stats', stdout=out)
+        self.assertIn('course_detail: 0 hits, 0 misses', out.getvalue())
+
+
+class BulkEnrollTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username='teacher1', password='pass123', role='teacher')
+        self.course = Course.objects.create(title='Test Course', description='Test', teacher=self.teacher)
+        self.students = User.objects.bulk_create([User(username=f'pupil{i}', role='student') for i in range(4)])
+        self.course.enrolled_students.add(self.students[0])
+        self.course.blocked_students.add(self.students[1])
+        run_pending()
+        self.url = reverse('courses:bulk_enroll_students', args=[self.course.id])
+
+    def test_bulk_enroll_sorts_out_the_list(self):
+        self.assertFalse(is_enrolled(self.students[2], self.course.id))
+        unread = get_unread_count(self.teacher)
+        result = bulk_enroll(self.course, ['pupil0', 'pupil1', 'pupil2', 'pupil3', 'teacher1', 'ghost'])
+        self.assertEqual(result, {
+            'enrolled': ['pupil2', 'pupil3'],
+            'already_enrolled': ['pupil0'],
+            'blocked': ['pupil1'],
+            'not_students': ['teacher1'],
+            'unknown': ['ghost'],
+        })
+        self.assertEqual(
+            set(self.course.enrolled_students.values_list('username', flat=True)), {'pupil0', 'pupil2', 'pupil3'}
+        )
+        # The cached membership was dropped even though no signal was sent
+        self.assertTrue(is_enrolled(self.students[2], self.course.id))
+        # One notification for the whole import, and no per-student tasks
+        self.assertEqual(list(Task.objects.values_list('name', flat=True)), ['courses.push_notifications'])
+        self.assertEqual(
+            list(Notification.objects.filter(message__contains="students enrolled").values_list('user_id', 'message')),
+            [(self.teacher.id, "2 students enrolled in Test Course.")],
+        )
+        self.assertEqual(get_unread_count(self.teacher), unread + 1)
+
+    def test_large_import_runs_a_fixed_number_of_queries(self):
+        students = User.objects.bulk_create([User(username=f'cohort{i}', role='student') for i in range(1000)])
+        with CaptureQueriesContext(connection) as queries:
+            result = bulk_enroll(self.course, [s.username for s in students])
+        self.assertEqual(len(result['enrolled']), 1000)
+        self.assertEqual(self.course.enrolled_students.count(), 1001)
+        # One lookup, the batched inserts and the teacher's notification
+        self.assertLessEqual(len(queries), 10)
+
+    def test_teacher_imports_from_text_and_csv(self):
+        self.client.login(username='teacher1', password='pass123')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        csv_file = SimpleUploadedFile("class.csv", b"name,username\nThree,pupil3\n", content_type="text/csv")
+        response = self.client.post(self.url, {'usernames': 'pupil2, pupil1\nghost', 'csv_file': csv_file}, follow=True)
+        self.assertRedirects(response, reverse('courses:course_detail', args=[self.course.id]))
+        self.assertContains(response, "Enrolled 2 students.")
+        self.assertContains(response, "Skipped 1 blocked: pupil1")
+        self.assertContains(response, "Skipped 1 unknown: ghost")
+        self.assertEqual(self.course.enrolled_students.filter(username__in=['pupil2', 'pupil3']).count(), 2)
+
+    def test_empty_import_is_rejected(self):
+        self.client.login(username='teacher1', password='pass123')
+        response = self.client.post(self.url, {'usernames': ' , '})
+        self.assertContains(response, "Enter some usernames or upload a CSV file.")
+
+    def test_only_the_teacher_can_import(self):
+        self.client.force_login(self.students[2])
+        response = self.client.post(self.url, {'usernames': 'pupil2'})
+        self.assertRedirects(response, reverse('courses:course_detail', args=[self.course.id]))
+        self.assertFalse(self.course.enrolled_students.filter(id=self.students[2].id).exists())
+
+    def test_parse_username_csv(self):
+        self.assertEqual(parse_username_csv(b"\xef\xbb\xbfpupil1\npupil2,x\n\npupil1\n"), ['pupil1', 'pupil2'])
+        self.assertEqual(parse_username_csv(b"Username\n pupil3 \n"), ['pupil3'])
+        self.assertEqual(parse_username_csv(b""), [])
+
+
+class CourseSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username='teacher1', password='pass123', role='teacher')
+        self.student = User.objects.create_user(username='student1', password='pass123', role='student')
+
+    def course(self, title, description="An introduction"):
+        return Course.objects.create(title=title, description=description, teacher=self.teacher)
+
+    def test_search_ranks_title_matches_first(self):
+        in_description = self.course("Cell Biology", "Covers genetics and evolution")
+        in_title = self.course("Genetics", "Heredity and variation")
+        self.course("Chemistry")
+        results, has_next = search_courses("genetics")
+        self.assertEqual([row["id"] for row in results], [in_title.id, in_description.id])
+        self.assertEqual(results[0]["teacher_username"], "teacher1")
+        self.assertFalse(has_next)
+
+    def test_search_index_follows_updates_and_deletes(self):
+        course = self.course("Organic Chemistry")
+        course.title = "Inorganic Chemistry"
+        course.save()
+        self.assertEqual(search_courses("organic")[0], [])
+        self.assertEqual(len(search_courses("inorganic")[0]), 1)
+        course.delete()
+        self.assertEqual(search_courses("inorganic")[0], [])
+
+    def test_search_paginates_and_matches_prefixes(self):
+        for i in range(5):
+            self.course(f"Statistics {i}")
+        results, has_next = search_courses("statis", page=1, per_page=2)
+        self.assertEqual(len(results), 2)
+        self.assertTrue(has_next)
+        results, has_next = search_courses("statis", page=3, per_page=2)
+        self.assertEqual(len(results), 1)
+        self.assertFalse(has_next)
+        self.assertEqual(search_courses("  !! ")[0], [])
+
+    def test_search_view_hides_blocked_courses_from_students(self):
+        open_course = self.course("Astronomy Basics")
+        blocked = self.course("Astronomy Advanced")
+        blocked.blocked_students.add(self.student)
+        self.client.login(username='student1', password='pass123')
+        response = self.client.get(reverse('courses:search_catalog'), {'q': 'astronomy'})
+        self.assertEqual([row["id"] for row in response.context['results']], [open_course.id])
+        self.assertContains(response, "Astronomy Basics")
+        self.client.login(username='teacher1', password='pass123')
+        response = self.client.get(reverse('courses:search_catalog'), {'q': 'astronomy'})
+        self.assertEqual(len(response.context['results']), 2)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        # The test database is already a throwaway one
+        call_command('bench_course_search', '--courses', '300', '--queries', '5', '--allow-live-db', stdout=out)
+        self.assertIn("300 courses", out.getvalue())
+        self.assertIn("full-text", out.getvalue())
+        self.assertIn("icontains", out.getvalue())
+        self.assertFalse(User.objects.filter(username__startswith='coursebench_').exists())
+
+    def test_benchmark_command_keeps_rows_only_in_live_db(self):
+        with self.assertRaises(CommandError):
+            call_command('bench_course_search', '--keep', stdout=StringIO())
+
+
+class CourseStatsTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username='teacher1', password='pass123', role='teacher')
+        self.students = User.objects.bulk_create([User(username=f'pupil{i}', role='student') for i in range(3)])
+        self.course = Course.objects.create(title='Test Course', description='Test', teacher=self.teacher)
+
+    def stats(self, course=None):
+        stats = CourseStats.objects.get(course=course or self.course)
+        return {field: getattr(stats, field) for field in ['students', 'feedbacks', 'materials', 'chat_messages']}
+
+    def test_enrollment_is_counted_from_both_sides(self):
+        self.course.enrolled_students.add(*self.students[:2])
+        self.course.enrolled_students.add(self.students[0])
+        self.assertEqual(self.stats()['students'], 2)
+        self.students[2].enrolled_courses.add(self.course)
+        self.assertEqual(self.stats()['students'], 3)
+        # Removing someone who is not enrolled changes nothing
+        self.course.enrolled_students.remove(self.students[0], self.teacher)
+        self.assertEqual(self.stats()['students'], 2)
+        self.students[1].enrolled_courses.remove(self.course)
+        self.assertEqual(self.stats()['students'], 1)
+        self.students[2].enrolled_courses.clear()
+        self.assertEqual(self.stats()['students'], 0)
+        self.course.enrolled_students.set(self.students)
+        self.course.enrolled_students.clear()
+        self.assertEqual(self.stats()['students'], 0)
+        bulk_enroll(self.course, ['pupil0', 'pupil1'])
+        self.assertEqual(self.stats()['students'], 2)
+
+    def test_feedback_materials_and_chat_are_counted(self):
+        from chat.models import ChatMessage
+        feedback = Feedback.objects.create(course=self.course, student=self.students[0], comment="Great")
+        Feedback.objects.create(course=self.course, student=self.students[1], comment="Fine")
+        Material.objects.create(course=self.course, file=SimpleUploadedFile("notes.pdf", b"pdf"))
+        ChatMessage.objects.create(course=self.course, sender=self.teacher, message="Hello")
+        feedback.delete()
+        self.assertEqual(self.stats(), {'students': 0, 'feedbacks': 1, 'materials': 1, 'chat_messages': 1})
+
+    def test_deleting_a_course_removes_its_stats(self):
+        Feedback.objects.create(course=self.course, student=self.students[0], comment="Great")
+        course_id = self.course.id
+        self.course.delete()
+        self.assertFalse(CourseStats.objects.filter(course_id=course_id).exists())
+
+    def test_reconcile_command_fixes_drift(self):
+        self.course.enrolled_students.add(*self.students)
+        Feedback.objects.bulk_create([Feedback(course=self.course, student=s, comment="Hi") for s in self.students])
+        other = Course.objects.create(title='Other Course', description='Test', teacher=self.teacher)
+        CourseStats.objects.filter(course=other).delete()
+        out = StringIO()
+        call_command('reconcile_course_stats', '--dry-run', stdout=out)
+        self.assertIn("2 of 2 courses have wrong stats", out.getvalue())
+        self.assertEqual(self.stats()['feedbacks'], 0)
+        out = StringIO()
+        call_command('reconcile_course_stats', '--chunk-size', '1', stdout=out)
+        self.assertIn("Reconciled 2 of 2 courses", out.getvalue())
+        self.assertEqual(self.stats(), {'students': 3, 'feedbacks': 3, 'materials': 0, 'chat_messages': 0})
+        self.assertEqual(self.stats(other)['students'], 0)
+
+    def test_reconcile_counts_archived_messages_once(self):
+        from chat.models import ChatMessage
+        archive_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_root, ignore_errors=True)
+        settings_override = override_settings(CHAT_ARCHIVE_ROOT=archive_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        old = timezone.now() - timedelta(days=400)
+        ChatMessage.objects.bulk_create([
+            ChatMessage(course=self.course, sender=self.teacher, message=f"Old {i}", timestamp=old) for i in range(5)
+        ])
+        ChatMessage.objects.create(course=self.course, sender=self.teacher, message="New")
+        call_command('archive_chat', '--days', '30', stdout=StringIO())
+        self.assertEqual(ChatMessage.objects.filter(course=self.course).count(), 1)
+        call_command('reconcile_course_stats', stdout=StringIO())
+        self.assertEqual(self.stats()['chat_messages'], 6)
+
+    def test_dashboard_reads_every_course_in_one_query(self):
+        for i in range(5):
+            Course.objects.create(title=f'Course {i}', description='Test', teacher=self.teacher)
+        self.course.enrolled_students.add(*self.students)
+        self.client.force_login(self.teacher)
+        get_unread_count(self.teacher)
+        # The session and user, then the courses with their stats
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('courses:teacher_dashboard'))
+        self.assertEqual(len(response.context['courses']), 6)
+        self.assertContains(response, '<td>3</td>', html=True)
+
+    def test_dashboard_is_for_teachers(self):
+        self.client.force_login(self.students[0])
+        response = self.client.get(reverse('courses:teacher_dashboard'))
+        self.assertRedirects(response, reverse('courses:course_list'))
@@ -7,13 +7,18 @@ app_name = 'courses'
 
 urlpatterns = [
     path('', views.course_list, name='course_list'),
+    path('search/', views.search_catalog, name='search_catalog'),
+    path('dashboard/', views.teacher_dashboard, name='teacher_dashboard'),
     path('<int:course_id>/', views.course_detail, name='course_detail'),
     path('add/', views.add_course, name='add_course'),
     path('<int:course_id>/enroll/', views.enroll_course, name='enroll_course'),
+    path('<int:course_id>/bulk_enroll/', views.bulk_enroll_students, name='bulk_enroll_students'),
     path('<int:course_id>/feedback/', views.add_feedback, name='add_feedback'),
     path('<int:course_id>/upload/', views.upload_material, name='upload_material'),
     path('<int:course_id>/remove_student/<int:student_id>/', views.remove_student, name='remove_student'),
     path('<int:course_id>/block_student/<int:student_id>/', views.block_student, name='block_student'),
     path('notifications/', views.notifications, name='notifications'),
+    path('notifications/read/', views.mark_notifications_read, name='mark_notifications_read'),
+    path('notifications/read_page/', views.mark_notifications_page_read, name='mark_notifications_page_read'),
     path('<int:course_id>/unblock_student/<int:student_id>/', views.unblock_student, name='unblock_student'),
 ]
@@ -1,33 +1,112 @@
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.http import url_has_allowed_host_and_scheme
 
-from .forms import CourseForm, FeedbackForm, MaterialForm
-from .models import Course, Feedback, Material, Notification
+from elearning.caching import cache_response
+
+from .catalog import CATALOG_ORDERINGS, get_catalog_page
+from .enrollment import bulk_enroll
+from .forms import BulkEnrollForm, CourseForm, FeedbackForm, MaterialForm
+from .membership import blocked_course_ids, enrolled_course_ids
+from .models import Course, Feedback, Material
+from .notifications import (
+    DIRECT,
+    EVENT,
+    decode_cursor,
+    encode_cursor,
+    get_notification_page,
+    mark_all_read,
+    mark_page_read,
+    notify_users,
+)
+from .search import search_courses
 
 @login_required
+@cache_response(lambda request: [('catalog', 0)])
 def course_list(request):
-    # Display list of courses, excluding blocked courses for students
+    # Display one page of the course catalog, excluding blocked courses for
+    # students. Their blocked courses are dropped from the cached page, so
+    # such a page can be shorter than the others.
+    order = request.GET.get('order', 'title')
+    if order not in CATALOG_ORDERINGS:
+        order = 'title'
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    catalog = get_catalog_page(request.user.role, order, page)
+    rows = catalog['rows']
     if request.user.role == 'student':
-        courses = Course.objects.exclude(blocked_students=request.user)
-    else:
-        courses = Course.objects.all()
-    return render(request, 'courses/course_list.html', {'courses': courses})
+        blocked = blocked_course_ids(request.user)
+        rows = [(course_id, html) for course_id, html in rows if course_id not in blocked]
+    return render(request, 'courses/course_list.html', {
+        'rows': rows,
+        'catalog': catalog,
+        'order': order,
+        'enrolled_course_ids': enrolled_course_ids(request.user),
+    })
+
+@login_required
+def teacher_dashboard(request):
+    # Show the stats of every course the teacher runs, read in one query
+    if request.user.role != 'teacher':
+        messages.error(request, "Only teachers have a dashboard.")
+        return redirect('courses:course_list')
+    courses = request.user.courses.select_related('stats').order_by('title')
+    return render(request, 'courses/dashboard.html', {'courses': courses})
 
 @login_required
+def search_catalog(request):
+    # Ranked full-text search over course titles and descriptions,
+    # excluding blocked courses for students
+    query = request.GET.get('q', '')
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    results, has_next = search_courses(query, page)
+    if request.user.role == 'student':
+        blocked = blocked_course_ids(request.user)
+        results = [course for course in results if course['id'] not in blocked]
+    return render(request, 'courses/search.html', {
+        'query': query,
+        'results': results,
+        'page': page,
+        'has_next': has_next,
+        'enrolled_course_ids': enrolled_course_ids(request.user),
+    })
+
+@login_required
+@cache_response(lambda request, course_id: [('course', course_id)])
 def course_detail(request, course_id):
-    # Display course details and materials if the user is enrolled or is the teacher
-    course = get_object_or_404(Course, id=course_id)
-    if request.user.role == 'student' and request.user not in course.enrolled_students.all():
+    # Display course details and materials if the user is enrolled or is the teacher.
+    # The page runs a fixed number of queries however many students and
+    # feedbacks the course has.
+    course = get_object_or_404(Course.objects.select_related('teacher'), id=course_id)
+    is_teacher = request.user.id == course.teacher_id
+    is_enrolled = course.id in enrolled_course_ids(request.user)
+    if request.user.role == 'student' and not is_enrolled:
         # Not enrolled so do not show materials.
         materials = []
     else:
         materials = course.materials.all()
-    feedbacks = course.feedbacks.all()
+    feedbacks = course.feedbacks.select_related('student')
+    enrolled_students = blocked_students = []
+    if is_teacher:
+        enrolled_students = course.enrolled_students.only('id', 'username')
+        blocked_students = course.blocked_students.only('id', 'username')
     return render(request, 'courses/course_detail.html', {
         'course': course,
         'feedbacks': feedbacks,
-        'materials': materials
+        'materials': materials,
+        'is_teacher': is_teacher,
+        'is_enrolled': is_enrolled,
+        'enrolled_students': enrolled_students,
+        'blocked_students': blocked_students,
     })
 
 @login_required
@@ -79,11 +158,38 @@ def add_feedback(request, course_id):
         form = FeedbackForm()
     return render(request, 'courses/add_feedback.html', {'form': form, 'course': course})
 
+@login_required
+def bulk_enroll_students(request, course_id):
+    # Allow teachers to enroll a list of students at once
+    course = get_object_or_404(Course, id=course_id)
+    if request.user.id != course.teacher_id:
+        messages.error(request, "Only the teacher can enroll students in this course.")
+        return redirect('courses:course_detail', course_id=course.id)
+    if request.method == 'POST':
+        form = BulkEnrollForm(request.POST, request.FILES)
+        if form.is_valid():
+            result = bulk_enroll(course, form.cleaned_data['student_usernames'])
+            messages.success(request, f"Enrolled {len(result['enrolled'])} students.")
+            skipped = [
+                ("already enrolled", result['already_enrolled']),
+                ("blocked", result['blocked']),
+                ("not students", result['not_students']),
+                ("unknown", result['unknown']),
+            ]
+            for reason, usernames in skipped:
+                if usernames:
+                    shown = ", ".join(usernames[:20]) + (", ..." if len(usernames) > 20 else "")
+                    messages.warning(request, f"Skipped {len(usernames)} {reason}: {shown}")
+            return redirect('courses:course_detail', course_id=course.id)
+    else:
+        form = BulkEnrollForm()
+    return render(request, 'courses/bulk_enroll.html', {'form': form, 'course': course})
+
 @login_required
 def upload_material(request, course_id):
     # Allow teachers to upload materials for their courses
     course = get_object_or_404(Course, id=course_id)
-    if request.user != course.teacher:
+    if request.user.id != course.teacher_id:
         messages.error(request, "Only the teacher can upload materials for this course.")
         return redirect('courses:course_detail', course_id=course.id)
     if request.method == 'POST':
@@ -102,39 +208,67 @@ def upload_material(request, course_id):
 def remove_student(request, course_id, student_id):
     # Allow teachers to remove students from their courses
     course = get_object_or_404(Course, id=course_id)
-    if request.user != course.teacher:
+    if request.user.id != course.teacher_id:
         messages.error(request, "Only the teacher can remove students.")
         return redirect('courses:course_detail', course_id=course.id)
     student = get_object_or_404(course.enrolled_students.model, id=student_id)
     course.enrolled_students.remove(student)
-    Notification.objects.create(
-        user=student,
-        message=f"You have been removed from {course.title} by {request.user.username}."
-    )
+    notify_users([student.id], f"You have been removed from {course.title} by {request.user.username}.")
     messages.success(request, f"{student.username} has been removed from the course.")
     return redirect('courses:course_detail', course_id=course.id)
 
 @login_required
 def notifications(request):
-    # Display notifications for the logged-in user
-    user_notifications = Notification.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'courses/notifications.html', {'notifications': user_notifications})
+    # Display one page of notifications for the logged-in user
+    before = decode_cursor(request.GET.get('before'))
+    unread = request.GET.get('unread') == '1'
+    user_notifications, has_older = get_notification_page(request.user, before=before, unread=unread)
+    events = [n for n in user_notifications if n.rank == EVENT]
+    return render(request, 'courses/notifications.html', {
+        'notifications': user_notifications,
+        'unread': unread,
+        'has_older': has_older,
+        'older_cursor': encode_cursor(user_notifications[-1]) if has_older else "",
+        'page_notification_ids': [n.id for n in user_notifications if n.rank == DIRECT],
+        'page_events_until': max(e.created_at for e in events).isoformat() if events else "",
+    })
+
+@login_required
+def mark_notifications_read(request):
+    # Mark every notification and course event as read
+    if request.method == 'POST':
+        mark_all_read(request.user)
+    return redirect('courses:notifications')
+
+@login_required
+def mark_notifications_page_read(request):
+    # Mark the notifications shown on one page as read
+    if request.method == 'POST':
+        ids = [int(i) for i in request.POST.getlist('notification') if i.isdigit()]
+        try:
+            events_until = parse_datetime(request.POST.get('events_until', ''))
+        except ValueError:
+            events_until = None
+        if events_until is not None and timezone.is_naive(events_until):
+            events_until = timezone.make_aware(events_until)
+        mark_page_read(request.user, ids, events_until)
+    # Go back to the same page
+    next_url = request.POST.get('next', '')
+    if not url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        next_url = reverse('courses:notifications')
+    return redirect(next_url)
 
 @login_required
 def block_student(request, course_id, student_id):
     # Allow teachers to block students from their courses
     course = get_object_or_404(Course, id=course_id)
-    if request.user != course.teacher:
+    if request.user.id != course.teacher_id:
         messages.error(request, "Only the teacher can block students.")
         return redirect('courses:course_detail', course_id=course.id)
     student = get_object_or_404(course.enrolled_students.model, id=student_id)
     course.blocked_students.add(student)
-    if student in course.enrolled_students.all():
-        course.enrolled_students.remove(student)
-    Notification.objects.create(
-        user=student,
-        message=f"You have been banned from {course.title} by {request.user.username}."
-    )
+    course.enrolled_students.remove(student)
+    notify_users([student.id], f"You have been banned from {course.title} by {request.user.username}.")
     messages.success(request, f"{student.username} has been blocked from this course.")
     return redirect('courses:course_detail', course_id=course.id)
 
@@ -142,7 +276,7 @@ def block_student(request, course_id, student_id):
 def unblock_student(request, course_id, student_id):
     # Allow teachers to unblock students from their courses
     course = get_object_or_404(Course, id=course_id)
-    if request.user != course.teacher:
+    if request.user.id != course.teacher_id:
         messages.error(request, "Only the teacher can unban students.")
         return redirect('courses:course_detail', course_id=course.id)
     student = get_object_or_404(course.blocked_students.model, id=student_id)
@@ -7,6 +7,7 @@ import django
 django.setup()
 
 import chat.routing
+import courses.routing
 from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
@@ -18,6 +19,7 @@ application = ProtocolTypeRouter({
     "websocket": AuthMiddlewareStack(
         URLRouter(
             chat.routing.websocket_urlpatterns
+            + courses.routing.websocket_urlpatterns
         )
     ),
 })
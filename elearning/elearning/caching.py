@@ -0,0 +1,134 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+
+# Version counters and a per-view response cache built on them.
+#
+# A version counter is a cache entry per (scope, id), such as
+# ("course", 3) or ("user", 7), that signal receivers bump whenever
+# something shown on a page changes. Cached responses are keyed on the
+# versions they were rendered from, so a bump makes them unreachable and
+# they simply expire. A new counter starts from the clock so that it never
+# repeats the values of one that was evicted.
+
+# Names of the views wrapped with cache_response, for cache_stats
+cached_views = []
+
+
+def shared_timeout(timeout):
+    # Entries in a per-process cache are not dropped when another process
+    # changes what they hold, so anything used for access checks is only
+    # kept there for UNSHARED_CACHE_TIMEOUT seconds
+    if settings.CACHES['default']['BACKEND'] == 'django.core.cache.backends.locmem.LocMemCache':
+        return min(timeout, settings.UNSHARED_CACHE_TIMEOUT)
+    return timeout
+
+
+def version_key(scope, obj_id):
+    return f"version:{scope}:{obj_id}"
+
+
+def get_versions(pairs):
+    # Return the current version of each (scope, id) pair
+    keys = [version_key(scope, obj_id) for scope, obj_id in pairs]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        start = time.time_ns() // 1000
+        for key in missing:
+            cache.add(key, start, None)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key) for key in keys]
+
+
+def bump_versions(scope, ids):
+    for obj_id in set(ids):
+        key = version_key(scope, obj_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns() // 1000, None)
+
+
+def stats_key(view_name, outcome):
+    return f"response_cache:{view_name}:{outcome}"
+
+
+def record(view_name, outcome):
+    key = stats_key(view_name, outcome)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def get_stats(view_name):
+    # Return (hits, misses) counted since the last reset
+    stats = cache.get_many([stats_key(view_name, 'hits'), stats_key(view_name, 'misses')])
+    return stats.get(stats_key(view_name, 'hits'), 0), stats.get(stats_key(view_name, 'misses'), 0)
+
+
+def reset_stats(view_name):
+    cache.delete_many([stats_key(view_name, 'hits'), stats_key(view_name, 'misses')])
+
+
+def is_cacheable(request):
+    # Never cache a page while a flash message is waiting to be shown
+    return (
+        request.method == 'GET'
+        and request.user.is_authenticated
+        and not len(get_messages(request))
+    )
+
+
+def response_cache_key(view_name, request, versions):
+    from courses.notifications import get_unread_count
+
+    # Pages embed the viewer's CSRF token, name and unread count
+    parts = [
+        request.get_full_path(),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+        get_unread_count(request.user),
+    ] + get_versions([('user', request.user.pk)] + versions)
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    return f"response_cache:{view_name}:{request.user.pk}:{digest}"
+
+
+def cache_response(versions):
+    # Cache a view's successful GET responses for each user. versions is
+    # called with the view's arguments and returns the (scope, id) pairs
+    # the page depends on, or None when it should not be cached.
+    def decorator(view):
+        view_name = view.__name__
+        cached_views.append(view_name)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            pairs = versions(request, *args, **kwargs) if is_cacheable(request) else None
+            if pairs is None:
+                return view(request, *args, **kwargs)
+            key = response_cache_key(view_name, request, pairs)
+            cached = cache.get(key)
+            if cached is not None:
+                record(view_name, 'hits')
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+                response['X-Cache'] = 'hit'
+                return response
+            record(view_name, 'misses')
+            response = view(request, *args, **kwargs)
+            response['X-Cache'] = 'miss'
+            # A token made from a brand new CSRF cookie must not be stored
+            # under the key of a request that had none
+            new_csrf_cookie = request.META.get('CSRF_COOKIE') != request.COOKIES.get(settings.CSRF_COOKIE_NAME)
+            if response.status_code == 200 and not response.streaming and not new_csrf_cookie:
+                cache.set(key, (response.content, response['Content-Type']), shared_timeout(settings.RESPONSE_CACHE_TIMEOUT))
+            return response
+        return wrapper
+    return decorator
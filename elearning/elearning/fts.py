@@ -0,0 +1,23 @@
+import re
+
+# Helpers shared by the full-text search indexes (SQLite FTS5 virtual
+# tables, or tsvector expression indexes with a GIN index on PostgreSQL).
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def search_terms(text):
+    # Split free text typed by a user into plain search terms
+    return TOKEN_RE.findall(text or "")
+
+
+def fts5_match_query(text):
+    # Build an FTS5 MATCH expression that ANDs every term, matching the last
+    # one as a prefix so partially typed words still find results. Terms are
+    # quoted so user input can never be parsed as FTS5 query syntax.
+    terms = search_terms(text)
+    if not terms:
+        return ""
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
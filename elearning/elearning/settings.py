@@ -54,6 +54,7 @@ INSTALLED_APPS = [
     'accounts',
     'courses',
     'chat',
+    'taskqueue',
 ]
 
 
@@ -81,6 +82,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'courses.context_processors.notifications',
 
             ],
         },
@@ -155,14 +157,163 @@ REST_FRAMEWORK = {
     ]
 }
 
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
-        'CONFIG': {
-            "hosts": [env('REDIS_URL')],
+# Set CHANNEL_LAYER=memory to use the bundled in-process layer when a
+# single daphne process serves every WebSocket; Redis is used otherwise.
+if env('CHANNEL_LAYER', default='redis') == 'memory':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'chat.layers.LocalChannelLayer',
         },
-    },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                "hosts": [env('REDIS_URL')],
+            },
+        },
+    }
+
+# CACHE_BACKEND picks the cache: locmem (per process, the default), file
+# (shared by the processes on one host, under CACHE_LOCATION) or redis
+# (shared by every host, at CACHE_URL). Invalidation only reaches other
+# processes through a shared cache, so use redis when running more than
+# one web process or a task worker.
+CACHE_BACKEND = env('CACHE_BACKEND', default='locmem')
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': env('CACHE_URL', default='redis://127.0.0.1:6379/1'),
+        },
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': env('CACHE_LOCATION', default=str(BASE_DIR / 'cache')),
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+    }
+
+# With the per-process locmem cache, cached pages and memberships are kept
+# for at most this many seconds, since a student removed or blocked through
+# another process is not dropped from this one's cache.
+UNSHARED_CACHE_TIMEOUT = env.int('UNSHARED_CACHE_TIMEOUT', default=5)
+
+# Pages of the busiest read views are cached per user for this many
+# seconds. Cached pages are dropped as soon as something they show changes.
+RESPONSE_CACHE_TIMEOUT = env.int('RESPONSE_CACHE_TIMEOUT', default=300)
+
+# Notifications sent to many users at once are inserted in batches of
+# this many rows.
+NOTIFICATION_BATCH_SIZE = 500
+
+# Largest list of students a teacher can enroll in one bulk import.
+BULK_ENROLL_MAX_STUDENTS = 5000
+
+# Number of notifications shown per page.
+NOTIFICATION_PAGE_SIZE = 25
+
+# Each user's unread count is cached for the navbar badge. It is dropped
+# whenever it changes; the timeout only bounds how stale it can get when a
+# course event is posted and no task worker is running.
+NOTIFICATION_UNREAD_CACHE_TIMEOUT = 300
+
+# Each user's enrolled and blocked course ids are cached for membership
+# checks. Entries are dropped when memberships change, so with a shared
+# cache the timeout only limits how long idle entries stay around (see
+# UNSHARED_CACHE_TIMEOUT for locmem).
+MEMBERSHIP_CACHE_TIMEOUT = 3600
+
+# The course catalog is shown this many courses per page. Rendered pages
+# are cached and dropped whenever a course is saved or deleted.
+COURSE_CATALOG_PAGE_SIZE = 20
+COURSE_CATALOG_CACHE_TIMEOUT = 600
+
+# Number of course search results per page.
+COURSE_SEARCH_PAGE_SIZE = 20
+
+# `manage.py prune` deletes rows older than this many days from each model,
+# PRUNE_CHUNK_SIZE primary keys at a time with PRUNE_CHUNK_PAUSE seconds
+# between chunks so other writers are never blocked for long.
+PRUNE_RETENTION_DAYS = {
+    'courses.Notification': 180,
+    'courses.CourseEvent': 365,
+    'accounts.StatusUpdate': 365,
 }
+PRUNE_CHUNK_SIZE = 1000
+PRUNE_CHUNK_PAUSE = 0.2
+
+# Chat messages are written behind the broadcast in batches. A batch is
+# flushed when it reaches this many messages or after this many seconds.
+CHAT_BUFFER_MAX_SIZE = env.int('CHAT_BUFFER_MAX_SIZE', default=50)
+CHAT_BUFFER_FLUSH_INTERVAL = env.float('CHAT_BUFFER_FLUSH_INTERVAL', default=1.0)
+# A batch that fails to write is retried after CHAT_BUFFER_RETRY_DELAY
+# seconds, doubling on every further failure, and is inserted row by row
+# once it has failed CHAT_BUFFER_MAX_RETRIES times.
+CHAT_BUFFER_RETRY_DELAY = env.float('CHAT_BUFFER_RETRY_DELAY', default=0.5)
+CHAT_BUFFER_MAX_RETRIES = env.int('CHAT_BUFFER_MAX_RETRIES', default=3)
+
+# Node id mixed into generated chat message ids, between 0 and 63, unique
+# to each process that serves chat. CHANNEL_LAYER=memory defaults it to 0;
+# with Redis, processes without one lease a free id in the channel layer's
+# Redis for CHAT_NODE_LEASE_TIMEOUT seconds at a time, renewed while they run.
+CHAT_NODE_ID = env.int('CHAT_NODE_ID', default=None)
+CHAT_NODE_LEASE_TIMEOUT = 60
+
+# Number of chat messages rendered with the room and returned per
+# "load older" request.
+CHAT_HISTORY_PAGE_SIZE = 50
+
+# A reconnecting chat client is sent the messages it missed, up to this
+# many; beyond that it is told to reload the room instead.
+CHAT_RESYNC_MAX_MESSAGES = 200
+
+# Clients speaking the chat.v2 subprotocol get every broadcast that
+# arrives within this many seconds batched into a single frame.
+CHAT_COALESCE_TICK = 0.05
+
+# Each chat connection queues at most this many outgoing frames. When a
+# slow client fills its queue the oldest frame is dropped
+# ('drop_oldest') or the connection is closed with code 4008 ('close').
+CHAT_SEND_QUEUE_SIZE = 100
+CHAT_SLOW_CONSUMER_POLICY = env('CHAT_SLOW_CONSUMER_POLICY', default='drop_oldest')
+
+# Each process keeps the newest page of every room it has consumers in
+# in memory so joins are served without a history query. The least
+# recently used rooms beyond the maximum are dropped and reloaded later.
+CHAT_RECENT_MAX_ROOMS = 1000
+
+# Number of chat search results per page.
+CHAT_SEARCH_PAGE_SIZE = 20
+
+# `manage.py archive_chat` moves chat messages older than this many days
+# into compressed per-course segment files under CHAT_ARCHIVE_ROOT. A new
+# segment is started once the current one reaches CHAT_ARCHIVE_SEGMENT_BYTES.
+CHAT_ARCHIVE_ROOT = env('CHAT_ARCHIVE_ROOT', default=str(BASE_DIR / 'chat_archive'))
+CHAT_ARCHIVE_AFTER_DAYS = 90
+CHAT_ARCHIVE_SEGMENT_BYTES = 8 * 1024 * 1024
+
+# Background tasks are stored in the database and run by
+# `manage.py run_tasks`. A claimed task stays hidden from other workers for
+# TASKQUEUE_VISIBILITY_TIMEOUT seconds, failures are retried with
+# exponential backoff starting at TASKQUEUE_RETRY_DELAY seconds, and a task
+# is marked failed after TASKQUEUE_MAX_ATTEMPTS attempts. Set
+# TASKQUEUE_EAGER to run tasks inline instead, e.g. without a worker.
+TASKQUEUE_EAGER = env.bool('TASKQUEUE_EAGER', default=False)
+TASKQUEUE_BATCH_SIZE = 50
+TASKQUEUE_VISIBILITY_TIMEOUT = 300
+TASKQUEUE_RETRY_DELAY = 10
+TASKQUEUE_MAX_ATTEMPTS = 5
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -0,0 +1,33 @@
+import shutil
+import tempfile
+
+from django import test
+from django.test import override_settings
+
+# Base classes for the apps' database tests. They run on the bundled
+# in-process channel layer, so signals that push to websockets work without
+# Redis whatever CHANNEL_LAYER is set to.
+
+LOCAL_CHANNEL_LAYERS = {'default': {'BACKEND': 'chat.layers.LocalChannelLayer'}}
+
+
+@override_settings(CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class TestCase(test.TestCase):
+    pass
+
+
+@override_settings(CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class TransactionTestCase(test.TransactionTestCase):
+    pass
+
+
+class TemporaryMediaMixin:
+    # For test cases that store uploaded files: each class gets its own
+    # MEDIA_ROOT, removed with everything in it once the class has run
+
+    @classmethod
+    def setUpClass(cls):
+        media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        cls.enterClassContext(override_settings(MEDIA_ROOT=media_root))
+        super().setUpClass()
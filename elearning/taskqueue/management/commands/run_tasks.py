@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from taskqueue.queue import process_batch
+
+
+class Command(BaseCommand):
+    help = "Runs queued background tasks in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.TASKQUEUE_BATCH_SIZE, help="Tasks claimed at once.")
+        parser.add_argument('--sleep', type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--once', action='store_true', help="Exit once no tasks are ready.")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Task worker started")
+        processed = 0
+        try:
+            while True:
+                claimed = process_batch(options['batch_size'])
+                processed += claimed
+                if claimed:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f"Task worker stopped after {processed} tasks")
@@ -0,0 +1,34 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Task(models.Model):
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('failed', 'Failed'),
+    )
+    # Name of the registered handler to run
+    name = models.CharField(max_length=200)
+    # Keyword arguments passed to the handler
+    payload = models.JSONField(default=dict)
+    # Pending tasks are retried; failed ones ran out of attempts
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    # Number of times a worker has claimed the task
+    attempts = models.PositiveIntegerField(default=0)
+    # The task is invisible to workers until this time. Claiming a task
+    # pushes it forward by the visibility timeout, so a task whose worker
+    # dies is picked up again once the timeout passes.
+    available_at = models.DateTimeField(default=timezone.now)
+    # Token of the claim that currently holds the task
+    claimed_by = models.CharField(max_length=64, blank=True)
+    # Traceback of the most recent failure
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='taskqueue_ready_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status}, {self.attempts} attempts)"
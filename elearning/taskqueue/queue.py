@@ -0,0 +1,89 @@
+import logging
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# Handlers registered with @register, keyed by task name
+registry = {}
+
+
+def register(name):
+    # Register a function as the handler for tasks with this name
+    def decorator(func):
+        registry[name] = func
+        return func
+    return decorator
+
+
+def enqueue(name, **payload):
+    # Queue a task for the worker; in eager mode run it straight away
+    if settings.TASKQUEUE_EAGER:
+        registry[name](**payload)
+        return None
+    return Task.objects.create(name=name, payload=payload)
+
+
+def claim(batch_size):
+    # Claim up to batch_size ready tasks for this worker. The conditional
+    # UPDATE means two workers racing for the same rows can never both win.
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    ready = list(
+        Task.objects.filter(status='pending', available_at__lte=now)
+        .order_by('available_at', 'id')
+        .values_list('id', flat=True)[:batch_size]
+    )
+    if not ready:
+        return []
+    Task.objects.filter(id__in=ready, status='pending', available_at__lte=now).update(
+        claimed_by=token,
+        available_at=now + timedelta(seconds=settings.TASKQUEUE_VISIBILITY_TIMEOUT),
+        attempts=F('attempts') + 1,
+    )
+    return list(Task.objects.filter(claimed_by=token).order_by('id'))
+
+
+def run_task(task):
+    # Run one claimed task, then delete it or schedule a retry
+    try:
+        registry[task.name](**task.payload)
+    except Exception:
+        error = traceback.format_exc()
+        logger.exception("Task %s (%s) failed", task.id, task.name)
+        if task.attempts >= settings.TASKQUEUE_MAX_ATTEMPTS:
+            Task.objects.filter(id=task.id).update(status='failed', last_error=error, claimed_by='')
+        else:
+            # Back off exponentially between attempts
+            delay = settings.TASKQUEUE_RETRY_DELAY * 2 ** (task.attempts - 1)
+            Task.objects.filter(id=task.id).update(
+                available_at=timezone.now() + timedelta(seconds=delay), last_error=error, claimed_by=''
+            )
+        return False
+    Task.objects.filter(id=task.id).delete()
+    return True
+
+
+def process_batch(batch_size=None):
+    # Claim and run one batch of tasks, returning how many were claimed
+    tasks = claim(batch_size or settings.TASKQUEUE_BATCH_SIZE)
+    for task in tasks:
+        run_task(task)
+    return len(tasks)
+
+
+def run_pending():
+    # Run tasks until none are ready, e.g. from tests or a one-off drain
+    total = 0
+    while True:
+        claimed = process_batch()
+        if not claimed:
+            return total
+        total += claimed
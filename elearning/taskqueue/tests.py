@@ -0,0 +1,108 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import Task
+from .queue import claim, enqueue, process_batch, register, run_pending
+
+calls = []
+
+
+@register('tests.record')
+def record(value):
+    calls.append(value)
+
+
+@register('tests.fail')
+def fail():
+    raise ValueError("boom")
+
+
+@override_settings(
+    TASKQUEUE_EAGER=False,
+    TASKQUEUE_BATCH_SIZE=3,
+    TASKQUEUE_VISIBILITY_TIMEOUT=60,
+    TASKQUEUE_RETRY_DELAY=10,
+    TASKQUEUE_MAX_ATTEMPTS=3,
+)
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_stores_task_without_running_it(self):
+        task = enqueue('tests.record', value=1)
+        self.assertEqual(task.payload, {'value': 1})
+        self.assertEqual(task.status, 'pending')
+        self.assertEqual(calls, [])
+
+    @override_settings(TASKQUEUE_EAGER=True)
+    def test_eager_mode_runs_inline(self):
+        self.assertIsNone(enqueue('tests.record', value=1))
+        self.assertEqual(calls, [1])
+        self.assertFalse(Task.objects.exists())
+
+    def test_worker_processes_in_batches(self):
+        for i in range(7):
+            enqueue('tests.record', value=i)
+        # Claim, mark and fetch, then one DELETE per task
+        with self.assertNumQueries(6):
+            self.assertEqual(process_batch(), 3)
+        self.assertEqual(calls, [0, 1, 2])
+        self.assertEqual(run_pending(), 4)
+        self.assertEqual(calls, list(range(7)))
+        self.assertFalse(Task.objects.exists())
+
+    def test_claimed_tasks_are_hidden_until_visibility_timeout(self):
+        enqueue('tests.record', value=1)
+        claimed = claim(10)
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(claimed[0].attempts, 1)
+        # A second worker sees nothing while the claim is live
+        self.assertEqual(claim(10), [])
+        # The first worker died, so the task comes back after the timeout
+        Task.objects.update(available_at=timezone.now() - timedelta(seconds=1))
+        reclaimed = claim(10)
+        self.assertEqual([t.id for t in reclaimed], [claimed[0].id])
+        self.assertEqual(reclaimed[0].attempts, 2)
+        self.assertNotEqual(reclaimed[0].claimed_by, claimed[0].claimed_by)
+
+    def test_failed_tasks_retry_with_backoff(self):
+        task = enqueue('tests.fail')
+        before = timezone.now()
+        self.assertEqual(process_batch(), 1)
+        task.refresh_from_db()
+        self.assertEqual(task.status, 'pending')
+        self.assertEqual(task.attempts, 1)
+        self.assertIn("ValueError: boom", task.last_error)
+        self.assertGreaterEqual(task.available_at, before + timedelta(seconds=10))
+        # Not ready again until the backoff has passed
+        self.assertEqual(process_batch(), 0)
+
+        Task.objects.update(available_at=timezone.now())
+        before = timezone.now()
+        process_batch()
+        task.refresh_from_db()
+        self.assertEqual(task.attempts, 2)
+        self.assertGreaterEqual(task.available_at, before + timedelta(seconds=20))
+
+    def test_task_is_marked_failed_after_max_attempts(self):
+        task = enqueue('tests.fail')
+        for i in range(3):
+            Task.objects.update(available_at=timezone.now())
+            process_batch()
+        task.refresh_from_db()
+        self.assertEqual(task.status, 'failed')
+        self.assertEqual(task.attempts, 3)
+        Task.objects.update(available_at=timezone.now())
+        self.assertEqual(process_batch(), 0)
+
+    def test_run_tasks_command_once(self):
+        for i in range(5):
+            enqueue('tests.record', value=i)
+        out = StringIO()
+        call_command('run_tasks', once=True, batch_size=2, stdout=out)
+        self.assertEqual(calls, list(range(5)))
+        self.assertIn("after 5 tasks", out.getvalue())